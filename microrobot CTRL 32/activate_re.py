@@ -2,6 +2,10 @@
 # 4x8 electromagnet GUI (NO DECAY)
 # - region1/region2: vibrating regions (square wave in time)
 # - trap: always-ON magnets (independent of vibration)
+# - event-driven: the output only changes at the regions' gate / polarity edges, so the
+#   next edge is computed from period / dutycycle (next_edge) and the field is recomposed,
+#   redrawn and sent only there (at most SEND_HZ); the unchanged frame is resent every
+#   KEEPALIVE_S in between
 #
 # Change requested:
 # - Allow intensity_range to be given as either:
@@ -36,14 +40,19 @@ trap_intensity = 0.8         # [-1,1]
 
 SERIAL_PORT = '/dev/cu.usbmodem1020BA0ABA902'
 SERIAL_BAUD = 115200
-SEND_HZ = 10
+SEND_HZ = 10                  # max frame rate (edges closer than 1/SEND_HZ are sampled)
+KEEPALIVE_S = 0.5             # resend the unchanged frame this often between edges
 PWM_MAX = 10                  # hardware scaling (0..PWM_MAX)
 # ====================================================================
 
 import pygame
 import numpy as np
-import serial
+import device_client
+import serial_manager
 import time
+from coil_state import CoilState
+from compositor import Compositor
+from sampling_profiler import SamplingProfiler
 
 # UI
 SCREEN_W, SCREEN_H = 800, 550
@@ -59,11 +68,14 @@ TABLE_GRID = (70, 70, 70)
 # Grid
 n, m = 4, 8
 
-def create_grid(n, m):
-    # grid[i,j] = [pos_pwm, neg_pwm, reserved]
-    return np.zeros((n, m, 3), dtype=float)
+# signed int8 level per coil; the compositor writes straight into it
+state = CoilState(n, m)
 
-grid_data = create_grid(n, m)
+# layers are precomputed cell masks; the trap has the highest priority (applied last)
+compositor = Compositor(n, m, pwm_max=PWM_MAX, dtype=np.int8)
+compositor.add_layer("region1", cells=location, blend="max", priority=0)
+compositor.add_layer("region2", cells=location2, blend="max", priority=1)
+compositor.add_layer("trap", cells=trap_location, blend="max", priority=2)
 
 pygame.init()
 screen = pygame.display.set_mode((SCREEN_W, SCREEN_H))
@@ -87,7 +99,7 @@ def get_dynamic_tile_size(n, m):
     tile_size = min((SCREEN_W - 20)//m, (SCREEN_H - 180)//n)
     return max(4, tile_size)
 
-def draw_grid(grid):
+def draw_grid(state):
     tile = get_dynamic_tile_size(n, m)
     grid_w, grid_h = m * tile, n * tile
     x0 = (SCREEN_W - grid_w) // 2
@@ -98,7 +110,8 @@ def draw_grid(grid):
         for j in range(m):
             x = x0 + j * tile
             y = y0 + i * tile
-            pos_val, neg_val, _ = grid[i, j]
+            level = int(state.levels[i, j])
+            pos_val, neg_val = max(level, 0), max(-level, 0)
 
             if pos_val > 0:
                 alpha = int(np.clip(255.0 * (pos_val / PWM_MAX), 25, 255))
@@ -115,7 +128,7 @@ def draw_grid(grid):
 
     return x0, y0 + grid_h, grid_w, tile, y0
 
-def draw_table(grid, pos_x, pos_y, width):
+def draw_table(state, pos_x, pos_y, width):
     table_top = pos_y + 10
     cell_h = 28
     cell_w = max(width // max(m, 1), 28)
@@ -127,9 +140,8 @@ def draw_table(grid, pos_x, pos_y, width):
         for j in range(m):
             cx = pos_x + j * cell_w + cell_w // 2
             cy = table_top + i * cell_h + cell_h // 2
-            pv = int(round(grid[i, j][0]))
-            nv = int(round(grid[i, j][1]))
-            draw_text(screen, f"{pv}/{nv}", (cx, cy), center=True, size=16)
+            level = int(state.levels[i, j])
+            draw_text(screen, f"{max(level, 0)}/{max(-level, 0)}", (cx, cy), center=True, size=16)
 
     for i in range(n + 1):
         y = table_top + i * cell_h
@@ -138,12 +150,6 @@ def draw_table(grid, pos_x, pos_y, width):
         x = pos_x + j * cell_w
         pygame.draw.line(screen, TABLE_GRID, (x, table_top), (x, table_top + n * cell_h))
 
-def user_to_ij(rc):
-    r, c = rc
-    i = n - int(r)       # 1-indexed bottom -> 0-indexed top
-    j = int(c) - 1
-    return i, j
-
 def square_gate(now, period, dutycycle):
     T = float(period)
     if T <= 0:
@@ -152,29 +158,14 @@ def square_gate(now, period, dutycycle):
     phase = now % T
     return 1.0 if phase < (d * T) else 0.0
 
-def clear_all(grid):
-    grid[:, :, :] = 0.0
-
-def add_cells(grid, cells, signed_level):
-    """
-    signed_level in [-1,1]
-    + => pos channel, - => neg channel
-    magnitude => abs(signed_level)*PWM_MAX
-    """
-    signed_level = clamp(float(signed_level), -1.0, 1.0)
-    amp = abs(signed_level) * PWM_MAX
-    if amp <= 0:
-        return
-
-    for rc in cells:
-        i, j = user_to_ij(rc)
-        if 0 <= i < n and 0 <= j < m:
-            if signed_level >= 0:
-                grid[i, j][0] = max(grid[i, j][0], amp)
-                grid[i, j][1] = 0.0
-            else:
-                grid[i, j][1] = max(grid[i, j][1], amp)
-                grid[i, j][0] = 0.0
+def next_edge(now, period, dutycycle, polarity):
+    """First time after `now` at which square_gate or polarity_sign changes (inf = never)."""
+    T = float(period)
+    d = clamp(float(dutycycle), 0.0, 1.0)
+    if T <= 0 or d <= 0 or (polarity != "alt" and d >= 1):
+        return float("inf")
+    phase = now % T
+    return now + ((d * T if phase < d * T else T) - phase)
 
 def parse_intensity_range(ir):
     """
@@ -229,45 +220,31 @@ def polarity_sign(now, polarity, period, start_sign_for_alt):
     k = int(now // T)          # period index
     return start_sign_for_alt if (k % 2 == 0) else -start_sign_for_alt
 
-def apply_location_vibration_region(grid, now, location, intensity_range, polarity, period, dutycycle):
-    g = square_gate(now, period, dutycycle)
-    if g <= 0:
-        return
+def region_level(now, intensity_range, polarity, period, dutycycle):
+    """Signed level in [-1,1] of a vibrating region at time `now` (0 while the gate is off)."""
+    if square_gate(now, period, dutycycle) <= 0:
+        return 0.0
 
     neg_level, pos_level, start_sign = parse_intensity_range(intensity_range)
     s = polarity_sign(now, polarity, period, start_sign)
-
-    signed_level = pos_level if s > 0 else neg_level
-    add_cells(grid, location, signed_level)
+    return pos_level if s > 0 else neg_level
 
 # Serial open
-ser = None
-try:
-    ser = serial.Serial(SERIAL_PORT, SERIAL_BAUD, timeout=0)
-    time.sleep(2)
-except Exception as e:
-    print(f"Serial open error: {e}")
-    ser = None
-
-def get_output_matrix(grid):
-    arr = np.round(grid[:, :, :2]).astype(int).reshape(-1, 2)  # (n*m, 2)
-    flat = arr.flatten()                                       # length = n*m*2
-    group = 16
-    rows = len(flat) // group
-    A = np.zeros((rows, group), dtype=int)
-    for idx, v in enumerate(flat):
-        A[idx // group, idx % group] = v
-    return A
-
-def matrix_to_csv_string(A):
-    return ",".join(str(int(v)) for v in A.flatten())
-
-def send_matrix_over_serial(A, ser):
-    ser.write((matrix_to_csv_string(A) + "\n").encode("utf-8"))
-
-last_sent = time.time()
+ser = device_client.connect()   # running device_daemon.py skips the port-open reset
+if ser is None:
+    ser = serial_manager.open_managed([SERIAL_PORT], SERIAL_BAUD)
+    if ser is None:
+        print("Serial not found; running without serial output.")
+
+def send_state_over_serial(state, ser):
+    # pos,neg pairs straight from the int8 levels
+    ser.write(state.csv_line())
+
+last_sent = last_frame = 0.0
 send_dt = 1.0 / float(SEND_HZ)
+t_next = 0.0                  # next gate / polarity edge
 running = True
+profiler = SamplingProfiler()
 
 while running:
     now = time.time()
@@ -277,57 +254,50 @@ while running:
             running = False
         elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
             running = False
-
-    # compose field
-    clear_all(grid_data)
-
-    # region 1
-    apply_location_vibration_region(
-        grid_data, now,
-        location, intensity_range, polarity, period, dutycycle
-    )
-
-    # region 2
-    apply_location_vibration_region(
-        grid_data, now,
-        location2, intensity_range2, polarity2, period2, dutycycle2
-    )
-
-    # always-on trap (applied last)
-    add_cells(grid_data, trap_location, trap_intensity)
-
-    # draw
-    x0, pos_y, grid_w, _, _ = draw_grid(grid_data)
-    draw_table(grid_data, x0, pos_y, grid_w)
-
-    # show current signs (helpful debug)
-    n1, p1, start1 = parse_intensity_range(intensity_range)
-    n2, p2, start2 = parse_intensity_range(intensity_range2)
-    s1 = polarity_sign(now, polarity, period, start1)
-    s2 = polarity_sign(now, polarity2, period2, start2)
-
-    draw_text(screen, f"region1 location: {location}", (20, SCREEN_H - 130))
-    draw_text(screen, f"region1 intensity_range={intensity_range} (start={'POS' if start1>0 else 'NEG'})", (20, SCREEN_H - 108))
-    draw_text(screen, f"region1 T={period}s, duty={dutycycle}, gate={int(square_gate(now, period, dutycycle))}, sign={'POS' if s1>0 else 'NEG'}",
-              (20, SCREEN_H - 86))
-
-    draw_text(screen, f"region2 location: {location2}", (20, SCREEN_H - 64))
-    draw_text(screen, f"region2 intensity_range={intensity_range2} (start={'POS' if start2>0 else 'NEG'})", (20, SCREEN_H - 42))
-    draw_text(screen, f"region2 T={period2}s, duty={dutycycle2}, gate={int(square_gate(now, period2, dutycycle2))}, sign={'POS' if s2>0 else 'NEG'}",
-              (20, SCREEN_H - 20))
-
-    draw_text(screen, f"trap: {trap_location}, I={trap_intensity}", (420, SCREEN_H - 20))
-
-    # send
-    A = get_output_matrix(grid_data)
-    if ser and (now - last_sent) >= send_dt:
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_F9:
+            profiler.toggle("prof_activate_re")
+
+    changed = now >= t_next and (now - last_frame) >= send_dt
+    if changed:
+        # compose field: set each layer's level, then blend all masks at once
+        compositor.set("region1", PWM_MAX * region_level(now, intensity_range, polarity, period, dutycycle))
+        compositor.set("region2", PWM_MAX * region_level(now, intensity_range2, polarity2, period2, dutycycle2))
+        compositor.set("trap", PWM_MAX * clamp(float(trap_intensity), -1.0, 1.0))
+        compositor.compose(out=state.levels)
+        t_next = min(next_edge(now, period, dutycycle, polarity), next_edge(now, period2, dutycycle2, polarity2))
+        last_frame = now
+
+        # draw
+        x0, pos_y, grid_w, _, _ = draw_grid(state)
+        draw_table(state, x0, pos_y, grid_w)
+
+        # show current signs (helpful debug)
+        n1, p1, start1 = parse_intensity_range(intensity_range)
+        n2, p2, start2 = parse_intensity_range(intensity_range2)
+        s1 = polarity_sign(now, polarity, period, start1)
+        s2 = polarity_sign(now, polarity2, period2, start2)
+
+        draw_text(screen, f"region1 location: {location}", (20, SCREEN_H - 130))
+        draw_text(screen, f"region1 intensity_range={intensity_range} (start={'POS' if start1>0 else 'NEG'})", (20, SCREEN_H - 108))
+        draw_text(screen, f"region1 T={period}s, duty={dutycycle}, gate={int(square_gate(now, period, dutycycle))}, sign={'POS' if s1>0 else 'NEG'}",
+                  (20, SCREEN_H - 86))
+
+        draw_text(screen, f"region2 location: {location2}", (20, SCREEN_H - 64))
+        draw_text(screen, f"region2 intensity_range={intensity_range2} (start={'POS' if start2>0 else 'NEG'})", (20, SCREEN_H - 42))
+        draw_text(screen, f"region2 T={period2}s, duty={dutycycle2}, gate={int(square_gate(now, period2, dutycycle2))}, sign={'POS' if s2>0 else 'NEG'}",
+                  (20, SCREEN_H - 20))
+
+        draw_text(screen, f"trap: {trap_location}, I={trap_intensity}", (420, SCREEN_H - 20))
+        pygame.display.flip()
+
+    # send: every edge, keepalive in between
+    if ser and (changed or (now - last_sent) >= KEEPALIVE_S):
         try:
-            send_matrix_over_serial(A, ser)
+            send_state_over_serial(state, ser)
         except Exception as e:
             print("Serial write error:", e)
         last_sent = now
 
-    pygame.display.flip()
     clock.tick(FPS)
 
 if ser:
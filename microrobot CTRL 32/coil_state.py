@@ -0,0 +1,141 @@
+# SAM LAB, D H HAN
+# Compact coil state: one signed int8 level per coil, optional float32 envelope timing
+#
+# The scripts used to keep np.zeros((n, m, 3), float): float64 pos, float64 neg and a
+# third channel that was unused or a click timestamp, then round + astype(int) + a
+# pos/neg split on every frame. Here:
+#   levels : (n, m) int8, signed PWM units (+ POS, - NEG), quantized ONCE when written
+#   t_on   : (n, m) float32 envelope start [s since `epoch`], NaN = no envelope
+#   peak   : (n, m) int8 level the envelope holds / decays from
+# (t_on / peak only exist with envelope=True.) That is 1 byte per coil instead of 24
+# (6 with the envelope), and the outputs come straight from the int8 array:
+#   socket FRAME payload  = levels.tobytes()            (frame_codec.encode_frame)
+#   firmware CSV line     = one table lookup per coil   (frame_codec.levels_to_csv_line)
+# Times are stored relative to `epoch` because float32 cannot resolve time.time().
+#
+# Usage:
+#   st = CoilState(4, 8, envelope=True)
+#   st.press(i, j, -10)                       # click: NEG at full level, envelope restarts
+#   st.update_envelope(hold=5, total=10)      # hold, then linear decay to 0
+#   st.next_transition(hold=5, total=10)      # when the levels change next (event-driven loops)
+#   ser.write(st.csv_line()); st.pos, st.neg  # outputs / display
+
+import math
+import time
+
+import numpy as np
+
+from frame_codec import levels_to_csv_line, quantize
+
+STEP_EPS = 1e-6      # [s] next_transition is always at least this far past `now`
+
+
+class CoilState:
+    def __init__(self, n, m, envelope=False, epoch=None):
+        self.n, self.m = n, m
+        self.levels = np.zeros((n, m), dtype=np.int8)
+        self.epoch = time.time() if epoch is None else float(epoch)
+        self.t_on = np.full((n, m), np.nan, dtype=np.float32) if envelope else None
+        self.peak = np.zeros((n, m), dtype=np.int8) if envelope else None
+
+    @property
+    def pos(self):
+        return np.maximum(self.levels, 0)
+
+    @property
+    def neg(self):
+        return np.maximum(-self.levels, 0)       # int8 is clipped to +-127, so -levels never wraps
+
+    def set(self, levels):
+        """Signed levels (float or int, (n, m) or flat) -> quantized in place."""
+        quantize(np.reshape(levels, (self.n, self.m)), out=self.levels)
+        return self.levels
+
+    def clear(self):
+        self.levels.fill(0)
+        if self.t_on is not None:
+            self.t_on.fill(np.nan)
+            self.peak.fill(0)
+
+    def press(self, i, j, level, t=None):
+        """Set one coil (internal 0-based i, j) and (re)start its envelope at t (default now)."""
+        q = quantize(level)
+        self.levels[i, j] = q
+        if self.t_on is not None:
+            self.peak[i, j] = q
+            self.t_on[i, j] = (time.time() if t is None else t) - self.epoch
+
+    def update_envelope(self, hold=0.0, total=0.0, now=None):
+        """
+        Every coil with an envelope: `peak` for `hold` s, then linear decay to 0 at `total` s,
+        then off. Vectorized over the array; quantized once.
+        """
+        e = ((time.time() if now is None else now) - self.epoch) - self.t_on     # NaN where idle
+        active = e >= 0                                                          # False for NaN
+        if not active.any():
+            return self.levels
+        e = np.where(active, e, 0.0)
+        hold = max(0.0, float(hold))
+        total = max(hold, float(total))
+        k = np.ones_like(e) if total <= hold else np.clip(1.0 - (e - hold) / (total - hold), 0.0, 1.0)
+        k[e < hold] = 1.0
+        done = active & (e >= total)
+        k[done] = 0.0
+        np.copyto(self.levels, quantize(self.peak * k), where=active)
+        self.t_on[done] = np.nan
+        return self.levels
+
+    def next_transition(self, hold=0.0, total=0.0, now=None):
+        """
+        Time (same clock as `now`, default time.time()) of the next change update_envelope
+        would make, math.inf when no envelope is running. During the decay that is the
+        next quantization step: |peak| * (1 - (e - hold) / (total - hold)) falling below
+        the current |level| - 0.5, plus STEP_EPS: quantize() rounds half to even, so an even
+        level only drops once the decay is strictly below the boundary. With `now` the
+        result is always at least STEP_EPS after it, so an event loop never wakes at the
+        same time twice.
+        """
+        if self.t_on is None:
+            return math.inf
+        active = ~np.isnan(self.t_on)
+        if not active.any():
+            return math.inf
+        hold = max(0.0, float(hold))
+        total = max(hold, float(total))
+        t_on = self.t_on[active].astype(float)
+        if total <= hold:
+            e = np.full(t_on.shape, total)                          # no decay: off at `total`
+        else:
+            p = np.abs(self.peak[active].astype(float))
+            q = np.abs(self.levels[active].astype(float))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                e = hold + (total - hold) * (1.0 - (q - 0.5) / p) + STEP_EPS  # just past: rint(1.5) == 2
+            e[(q == 0) | (p == 0)] = math.inf                       # already off (cleared at `total`)
+        nxt = float((t_on + e).min()) + self.epoch
+        if nxt < math.inf and now is not None:
+            nxt = max(nxt, float(now) + STEP_EPS)
+        return nxt
+
+    # ----- outputs -----
+    def csv_line(self):
+        return levels_to_csv_line(self.levels)
+
+    def frame_bytes(self):
+        return self.levels.tobytes()
+
+    def to_grid(self, grid=None):
+        """Legacy (n, m, 3) [pos, neg, t] float grid, for code that still expects it."""
+        if grid is None:
+            grid = np.zeros((self.n, self.m, 3), dtype=float)
+        grid[:, :, 0] = self.pos
+        grid[:, :, 1] = self.neg
+        grid[:, :, 2] = 0.0 if self.t_on is None else np.nan_to_num(self.t_on.astype(float) + self.epoch, nan=0.0)
+        return grid
+
+    @classmethod
+    def from_grid(cls, grid):
+        """Legacy (n, m, 3) float grid -> CoilState (pos - neg, quantized)."""
+        g = np.asarray(grid, dtype=float)
+        st = cls(g.shape[0], g.shape[1])
+        st.set(g[:, :, 0] - g[:, :, 1])
+        return st
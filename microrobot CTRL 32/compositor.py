@@ -0,0 +1,131 @@
+# SAM LAB, D H HAN
+# Layer compositor: named layers with precomputed cell masks, blend rule and priority
+#
+# Replaces clearing the grid and calling add_cells() cell by cell every frame.
+# Every layer owns a flat index array of its cells (computed once), a signed level
+# (scalar, one value per layer cell, or a full n x m frame) and a blend rule:
+#   max      : same sign -> keep the larger magnitude, opposite sign -> this layer wins
+#              (the add_cells() rule of activate_re.py)
+#   override : this layer's value replaces what is below
+#   sum      : add, then clamp to [-pwm_max, pwm_max]
+# A zero level never writes (a layer that is "off" is transparent), in every mode.
+# Layers are applied in ascending priority (ties: insertion order), so the highest
+# priority is applied last. compose() is a few array ops per layer, independent of
+# how many cells a layer covers.
+# dtype=np.int8 keeps every layer and the output as quantized int8 levels (frame_codec
+# quantize(), applied once in set()); "sum" is accumulated in int16 before clamping.
+#
+# Coordinates for cells: (row, col), 1-indexed, (1,1) = LEFT-BOTTOM; cells outside
+# the grid are dropped (same as add_cells()).
+#
+# Usage:
+#   comp = Compositor(4, 8, pwm_max=10)
+#   comp.add_layer("region1", cells=location)
+#   comp.add_layer("trap", cells=trap_location, priority=10)
+#   comp.set("region1", -10); comp.set("trap", 8)
+#   levels = comp.compose()                 # signed (n, m), PWM units
+
+import numpy as np
+
+from frame_codec import quantize
+
+BLENDS = ("max", "override", "sum")
+
+
+def cells_to_index(cells, n, m):
+    """(row, col) 1-based, left-bottom origin -> flat row-major indices; out-of-grid cells dropped."""
+    if isinstance(cells, str) and cells == "all":
+        return np.arange(n * m)
+    rc = np.asarray(list(cells), dtype=int).reshape(-1, 2)
+    ok = (rc[:, 0] >= 1) & (rc[:, 0] <= n) & (rc[:, 1] >= 1) & (rc[:, 1] <= m)
+    rc = rc[ok]
+    return np.unique((n - rc[:, 0]) * m + (rc[:, 1] - 1))
+
+
+class Layer:
+    def __init__(self, name, index, blend, priority, order, dtype=float):
+        if blend not in BLENDS:
+            raise ValueError(f"layer {name!r}: blend must be one of {BLENDS}, got {blend!r}")
+        self.name = name
+        self.index = index                  # flat cell indices, fixed
+        self.blend = blend
+        self.priority = priority
+        self.order = order
+        self.values = np.zeros(len(index), dtype=dtype)  # signed level per layer cell
+        self.enabled = True
+
+
+class Compositor:
+    def __init__(self, n, m, pwm_max=10.0, dtype=float):
+        self.n, self.m = n, m
+        self.pwm_max = float(pwm_max)
+        self.dtype = np.dtype(dtype)
+        self.quantized = self.dtype == np.int8
+        self.layers = {}
+        self._stack = []                    # layers in application order
+        self._out = np.zeros(n * m, dtype=self.dtype)
+
+    def add_layer(self, name, cells=None, mask=None, blend="max", priority=0):
+        """Register a layer over `cells` (user coordinates), a boolean (n, m) `mask`, or all cells."""
+        if mask is not None:
+            index = np.flatnonzero(np.asarray(mask, dtype=bool).ravel())
+        elif cells is not None:
+            index = cells_to_index(cells, self.n, self.m)
+        else:
+            index = np.arange(self.n * self.m)
+        layer = Layer(name, index, blend, priority, len(self.layers), self.dtype)
+        self.layers[name] = layer
+        self._stack = sorted(self.layers.values(), key=lambda L: (L.priority, L.order))
+        return layer
+
+    def set(self, name, level):
+        """
+        Signed level in PWM units: a scalar for all of the layer's cells, an array with one
+        value per layer cell, or a full (n, m) frame (only the layer's cells are used).
+        """
+        L = self.layers[name]
+        lv = quantize(level) if self.quantized else np.asarray(level, dtype=float)
+        if lv.ndim == 0:
+            L.values.fill(lv)
+        elif lv.size == self.n * self.m and lv.size != len(L.index):
+            L.values[:] = lv.ravel()[L.index]
+        else:
+            L.values[:] = lv.ravel()
+
+    def set_cell(self, name, i, j, level):
+        """Set one cell (internal 0-based i, j; row 0 = top) of a layer, e.g. a manual click."""
+        L = self.layers[name]
+        k = np.searchsorted(L.index, i * self.m + j)
+        if k < len(L.index) and L.index[k] == i * self.m + j:
+            L.values[k] = quantize(level) if self.quantized else level
+
+    def enable(self, name, on=True):
+        self.layers[name].enabled = bool(on)
+
+    def compose(self, out=None):
+        """Blend all enabled layers -> signed (n, m) levels (PWM units)."""
+        flat = self._out
+        flat.fill(0)
+        for L in self._stack:
+            if not L.enabled:
+                continue
+            v = L.values
+            nz = v != 0
+            if not nz.any():
+                continue
+            idx = L.index[nz]
+            v = v[nz]
+            if L.blend == "override":
+                flat[idx] = v
+            elif L.blend == "sum":
+                acc = flat[idx] + v if not self.quantized else flat[idx].astype(np.int16) + v
+                flat[idx] = np.clip(acc, -self.pwm_max, self.pwm_max)
+            else:
+                cur = flat[idx]
+                same = np.sign(cur) == np.sign(v)
+                flat[idx] = np.where(same, np.sign(v) * np.maximum(np.abs(cur), np.abs(v)), v)
+        levels = flat.reshape(self.n, self.m)
+        if out is None:
+            return levels.copy()
+        out[:] = levels
+        return out
@@ -0,0 +1,121 @@
+# SAM LAB, D H HAN
+# Client side of device_daemon.py
+#
+# connect() returns a DeviceClient when the daemon is running, else None.
+# DeviceClient.write() accepts the same CSV line the scripts already send to the
+# serial port, so it is a drop-in replacement for `ser` in send_matrix_over_serial().
+# send_levels() skips the CSV step entirely for new code.
+#
+# Arbitration (see device_daemon.py): pass name/priority/lease/overlay to connect(),
+# e.g. an e-stop panel: connect(name="estop", priority=100) then .stop() / .resume(),
+# or from a shell: python device_client.py stop | resume | stats
+
+import argparse
+import json
+import os
+import socket
+import tempfile
+
+from frame_codec import (encode_frame, encode_hello, encode_message, csv_line_to_levels,
+                         STOP, RESUME, PING, PONG, STATS, STATS_REPLY, HEADER)
+
+DEFAULT_SOCKET = os.environ.get("PWM32_SOCKET", os.path.join(tempfile.gettempdir(), "pwm32.sock"))
+
+
+class DeviceClient:
+    def __init__(self, sock):
+        self.sock = sock
+        self.in_waiting = 0          # serial.Serial compatibility (no echo over the socket)
+
+    def send_levels(self, levels):
+        self.sock.sendall(encode_frame(levels))
+
+    def write(self, data):
+        """Legacy CSV line (pos/neg pairs) -> compact frame."""
+        self.send_levels(csv_line_to_levels(data))
+        return len(data)
+
+    def stop(self):
+        self.sock.sendall(encode_message(STOP))
+
+    def resume(self):
+        self.sock.sendall(encode_message(RESUME))
+
+    def _request(self, kind, reply_kind, timeout):
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.sendall(encode_message(kind))
+            head = self._recv_exact(HEADER.size)
+            _, got, length = HEADER.unpack(head)
+            payload = self._recv_exact(length)
+            if got != reply_kind:
+                raise ConnectionError(f"unexpected reply kind {got}")
+            return payload
+        finally:
+            self.sock.settimeout(None)
+
+    def _recv_exact(self, k):
+        buf = b""
+        while len(buf) < k:
+            chunk = self.sock.recv(k - len(buf))
+            if not chunk:
+                raise ConnectionError("daemon closed the connection")
+            buf += chunk
+        return buf
+
+    def ping(self, timeout=0.5):
+        try:
+            self._request(PING, PONG, timeout)
+            return True
+        except (OSError, ConnectionError):
+            return False
+
+    def stats(self, timeout=0.5):
+        """Per-client forwarded / dropped / latency counters from the daemon."""
+        return json.loads(self._request(STATS, STATS_REPLY, timeout).decode("utf-8"))
+
+    def readline(self):
+        return b""
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def connect(path=None, name="", priority=0, lease=0.0, overlay=False):
+    path = path or DEFAULT_SOCKET
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        if name or priority or lease or overlay:
+            sock.sendall(encode_hello(name, priority, lease, overlay))
+    except OSError:
+        sock.close()
+        return None
+    return DeviceClient(sock)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Query / control a running device_daemon.py")
+    ap.add_argument("command", choices=["stats", "stop", "resume"])
+    ap.add_argument("--socket", default=DEFAULT_SOCKET)
+    args = ap.parse_args()
+
+    c = connect(args.socket, name=f"cli-{args.command}", priority=1000)
+    if c is None:
+        raise SystemExit(f"no daemon at {args.socket}")
+    if args.command == "stats":
+        print(json.dumps(c.stats(), indent=2))
+    elif args.command == "stop":
+        c.stop()
+    else:
+        c.resume()
+    c.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+# SAM LAB, D H HAN
+# Persistent device daemon / frame server: owns the serial port, arbitrates between clients
+#
+# Opening the Pico's CDC port resets the board, so every script waits for the board
+# to answer the port_discovery.py handshake after opening it. Run this daemon once
+# per session instead:
+#
+#   python device_daemon.py --port /dev/ttyACM0 --hz 10
+#
+# Scripts then connect through device_client.py (their try_open_serial() does this
+# automatically) and the first frame goes out within milliseconds.
+#
+# Several clients may stream at once (manual GUI, scripted pattern, e-stop button):
+# - every tick exactly ONE merged frame is written to the device
+# - merge: active clients are applied in ascending priority, so the highest priority
+#   wins; OVERLAY clients only claim their nonzero coils
+# - lease: a client whose newest frame is older than its lease drops out of the merge
+#   (lease 0 = hold until disconnect, the default for legacy CSV clients)
+# - STOP from any client latches all-zero output and forces an immediate tick, so it
+#   preempts within one send period; RESUME releases it, but only from a client whose
+#   priority is at least that of the client that stopped (refusals counted in STATS)
+# - STATS returns per-client frame / drop / latency counters as JSON
+# - --ws-port: the HTML GUIs join the same merge over WebSocket (ws_bridge.py)
+# - --ack N: sequence-numbered frames, short acks, N frames in flight (frame_link.py);
+#   round-trip percentiles and lost/mismatched counts appear in STATS
+# - the send rate adapts to backpressure (echo/ack lag, OS out_waiting): it drops
+#   toward --min-hz and skips frames that would only queue up, then recovers to --hz
+# - the port is a serial_manager.ManagedSerial: a USB glitch or unplug is retried in
+#   the background and the newest merged frame is resent on reconnect; outage counts
+#   and durations appear under "serial" in STATS
+# - --profile PREFIX: sample the event loop for the whole run (sampling_profiler.py),
+#   written at exit as PREFIX_*.collapsed / .txt
+# - Ctrl+C: sends all zeros and closes the port.
+
+import argparse
+import asyncio
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+import ws_bridge
+import serial_manager
+from device_client import DEFAULT_SOCKET
+from frame_link import FrameLink, AdaptiveRate
+from frame_codec import (MessageReader, encode_message, decode_frame, decode_hello, levels_to_csv_line,
+                         FRAME, STOP, PING, PONG, HELLO, RESUME, STATS, STATS_REPLY)
+from sampling_profiler import SamplingProfiler
+
+# ================== Config ==================
+SERIAL_PORTS = ['/dev/cu.usbmodem1020BA0ABA902']
+SERIAL_BAUD = 115200
+N_COILS = 32
+SEND_HZ = 10               # merged frames per second written to the device (upper bound)
+MIN_HZ = 2                 # adaptive rate never drops below this
+ECHO_WINDOW = 4            # legacy-echo frames in flight before the daemon stops adding
+WS_HOST = "127.0.0.1"      # WebSocket bridge for the HTML GUIs (local only)
+# ================== Config ==================
+
+
+def try_open_serial(ports):
+    ser = serial_manager.open_managed(ports, SERIAL_BAUD)
+    if ser is not None:
+        return ser
+    print("Serial not found; daemon runs without serial output.")
+    return None
+
+
+class ClientState:
+    def __init__(self, cid):
+        self.id = cid
+        self.name = f"client{cid}"
+        self.priority = 0
+        self.lease = 0.0
+        self.overlay = False
+        self.levels = None
+        self.t_frame = 0.0
+        self.fresh = False          # newest frame not forwarded yet
+        self.frames_in = 0
+        self.forwarded = 0
+        self.dropped = 0            # superseded before a tick picked them up
+        self.lat_sum = 0.0
+        self.lat_max = 0.0
+
+    def active(self, now):
+        return self.levels is not None and (self.lease <= 0 or (now - self.t_frame) <= self.lease)
+
+    def stats(self, now):
+        return {
+            "id": self.id, "name": self.name, "priority": self.priority,
+            "lease": self.lease, "overlay": self.overlay, "active": self.active(now),
+            "frames_in": self.frames_in, "forwarded": self.forwarded, "dropped": self.dropped,
+            "latency_ms_mean": 1e3 * self.lat_sum / self.forwarded if self.forwarded else None,
+            "latency_ms_max": 1e3 * self.lat_max,
+        }
+
+
+class DeviceDaemon:
+    def __init__(self, ser, socket_path=DEFAULT_SOCKET, n_coils=N_COILS, send_hz=SEND_HZ, ws_port=None,
+                 ack_window=0, min_hz=MIN_HZ, adaptive=True):
+        self.ser = ser
+        self.socket_path = socket_path
+        self.ws_port = ws_port
+        self.n_coils = n_coils
+        self.period = 1.0 / float(send_hz)
+        self.clients = {}
+        self.next_id = 1
+        self.stopped = False
+        self.stop_priority = None           # priority of the highest client that latched STOP
+        self.resume_refused = 0
+        self.current = np.zeros(n_coils, dtype=np.int8)
+        self.preempt = None                 # asyncio.Event, created inside the loop
+        self.ticks = 0
+        self.write_errors = 0
+        self.window_stalls = 0
+        # ack mode needs the ack firmware; otherwise the legacy echo is timed instead
+        self.link = None
+        if ser is not None:
+            self.link = FrameLink(ser, window=ack_window or ECHO_WINDOW, ack=bool(ack_window))
+        self.rate = AdaptiveRate(send_hz, min_hz) if (adaptive and self.link is not None) else None
+        self.loop = None
+        self.reader_fd = None
+        if isinstance(ser, serial_manager.ManagedSerial):
+            ser.on_reconnect = self.on_reconnect
+
+    # ----- clients -----
+    def register(self):
+        c = ClientState(self.next_id)
+        self.next_id += 1
+        self.clients[c.id] = c
+        return c
+
+    def dispatch(self, c, kind, payload):
+        """Apply one client message; returns a (kind, payload) reply or None."""
+        if kind == FRAME:
+            self.submit(c, decode_frame(payload))
+        elif kind == HELLO:
+            c.name, c.priority, c.lease, c.overlay = decode_hello(payload)
+            c.name = c.name or f"client{c.id}"
+        elif kind == STOP:
+            self.emergency_stop(c)
+        elif kind == RESUME:
+            self.resume(c)
+        elif kind == PING:
+            return PONG, payload
+        elif kind == STATS:
+            return STATS_REPLY, json.dumps(self.stats()).encode("utf-8")
+        return None
+
+    async def handle_client(self, reader, writer):
+        c = self.register()
+        parser = MessageReader()
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                for kind, payload in parser.feed(data):
+                    try:
+                        reply = self.dispatch(c, kind, payload)
+                    except (ValueError, struct.error) as e:
+                        # the binary protocol has no error reply: log and close this client only
+                        print(f"Bad message from {c.name}: {e}; closing")
+                        return
+                    if reply is not None:
+                        writer.write(encode_message(*reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self.clients[c.id]
+            writer.close()
+
+    async def handle_ws(self, reader, writer):
+        # browser GUIs (ws_bridge.py): same dispatch, text or binary messages
+        c = None
+        parser = MessageReader()
+        try:
+            if not await ws_bridge.handshake(reader, writer):
+                return
+            c = self.register()
+            c.name = f"browser{c.id}"
+            while True:
+                msg = await ws_bridge.read_message(reader, writer)
+                if msg is None:
+                    break
+                opcode, data = msg
+                try:
+                    if opcode == ws_bridge.OP_TEXT:
+                        for kind, payload in ws_bridge.text_to_messages(data.decode("utf-8", errors="ignore")):
+                            reply = self.dispatch(c, kind, payload)
+                            if reply is not None:
+                                writer.write(ws_bridge.encode_ws(reply[1] if reply[0] == STATS_REPLY else "pong"))
+                    else:
+                        for kind, payload in parser.feed(data):
+                            reply = self.dispatch(c, kind, payload)
+                            if reply is not None:
+                                writer.write(ws_bridge.encode_ws(encode_message(*reply), ws_bridge.OP_BINARY))
+                except (ValueError, struct.error, KeyError) as e:
+                    # one bad message from a browser must not drop the connection
+                    parser = MessageReader()
+                    writer.write(ws_bridge.encode_ws(json.dumps({"error": str(e)})))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            if c is not None:
+                del self.clients[c.id]
+            writer.close()
+
+    def submit(self, c, levels):
+        f = np.zeros(self.n_coils, dtype=np.int8)
+        k = min(self.n_coils, len(levels))
+        f[:k] = levels[:k]
+        if c.fresh:
+            c.dropped += 1
+        c.levels = f
+        c.t_frame = time.monotonic()
+        c.fresh = True
+        c.frames_in += 1
+
+    def emergency_stop(self, c):
+        if not self.stopped:
+            print(f"STOP from {c.name}")
+        self.stopped = True
+        self.stop_priority = c.priority if self.stop_priority is None else max(self.stop_priority, c.priority)
+        self.preempt.set()
+
+    def resume(self, c):
+        if not self.stopped:
+            return
+        if c.priority < self.stop_priority:
+            # a GUI or script must not undo an e-stop it does not outrank
+            self.resume_refused += 1
+            print(f"RESUME from {c.name} (priority {c.priority}) refused, STOP held at {self.stop_priority}")
+            return
+        print(f"RESUME from {c.name}")
+        self.stopped = False
+        self.stop_priority = None
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "send_hz": self.rate.hz if self.rate is not None else 1.0 / self.period,
+            "ticks": self.ticks, "stopped": self.stopped,
+            "stop_priority": self.stop_priority, "resume_refused": self.resume_refused,
+            "write_errors": self.write_errors, "window_stalls": self.window_stalls,
+            "link": self.link.stats() if self.link is not None else None,
+            "serial": self.ser.metrics() if isinstance(self.ser, serial_manager.ManagedSerial) else None,
+            "rate": self.rate.stats() if self.rate is not None else None,
+            "clients": [c.stats(now) for c in self.clients.values()],
+        }
+
+    # ----- arbitration -----
+    def merge(self, now):
+        """One merged frame from all active clients (highest priority applied last)."""
+        out = np.zeros(self.n_coils, dtype=np.int8)
+        if self.stopped:
+            return out, []
+        active = sorted((c for c in self.clients.values() if c.active(now)),
+                        key=lambda c: (c.priority, c.t_frame))
+        for c in active:
+            if c.overlay:
+                np.copyto(out, c.levels, where=c.levels != 0)
+            else:
+                out[:] = c.levels
+        return out, active
+
+    async def tick_loop(self):
+        next_t = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self.preempt.wait(), timeout=max(0.0, next_t - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+            self.preempt.clear()
+
+            levels, used = self.merge(time.monotonic())
+            self.current = levels
+            if self.link is not None:
+                try:
+                    if self.stopped:
+                        # STOP preempts: no rate / window check, zeros straight to the port
+                        self.link.send(levels, force=True)
+                    elif self.rate is not None and not self.rate.allow(self.link):
+                        # link is backed up: skip instead of queueing a frame that will be stale
+                        used = []
+                    elif self.link.send(levels) is None:
+                        # full window; the next tick sends the newest merge
+                        self.window_stalls += 1
+                        used = []
+                except Exception as e:
+                    self.write_errors += 1
+                    print("Serial write error:", e)
+            t_out = time.monotonic()
+            for c in used:
+                if c.fresh:
+                    lat = t_out - c.t_frame
+                    c.fresh = False
+                    c.forwarded += 1
+                    c.lat_sum += lat
+                    c.lat_max = max(c.lat_max, lat)
+            self.ticks += 1
+
+            period = 1.0 / self.rate.hz if self.rate is not None else self.period
+            next_t += period
+            if next_t < t_out:
+                next_t = t_out + period
+
+    # ----- device -----
+    def read_input(self):
+        # acks / echoes -> FrameLink (this also keeps the device->host buffer from filling)
+        try:
+            self.link.poll()
+        except Exception:
+            pass
+
+    def add_reader(self):
+        if self.reader_fd is not None:
+            self.loop.remove_reader(self.reader_fd)
+            self.reader_fd = None
+        fd = self.ser.fileno()
+        self.loop.add_reader(fd, self.read_input)
+        self.reader_fd = fd
+
+    def on_reconnect(self, ser):
+        # serial_manager supervisor thread: the port was reopened (new fd) and the newest frame resent
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.resync)
+
+    def resync(self):
+        self.link.inflight.clear()          # sent to the old port; their replies are never coming
+        self.link.rx.clear()
+        if self.reader_fd is not None:
+            try:
+                self.add_reader()
+            except (OSError, ValueError):
+                pass
+
+    async def drain_input(self):
+        if self.ser is None:
+            return
+        try:
+            # wake on incoming bytes so ack round trips are timed without polling delay
+            self.add_reader()
+            return
+        except (AttributeError, NotImplementedError, OSError, ValueError):
+            pass
+        while True:
+            await asyncio.sleep(0.005)
+            self.read_input()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.preempt = asyncio.Event()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self.handle_client, path=self.socket_path)
+        print(f"Listening on {self.socket_path} ({1.0 / self.period:g} Hz, {self.n_coils} coils)")
+        tasks = [asyncio.create_task(self.tick_loop()), asyncio.create_task(self.drain_input())]
+        if self.ws_port:
+            ws_server = await asyncio.start_server(self.handle_ws, WS_HOST, self.ws_port)
+            print(f"WebSocket bridge on ws://{WS_HOST}:{self.ws_port}")
+            tasks.append(asyncio.create_task(ws_server.serve_forever()))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for t in tasks:
+                t.cancel()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Long-lived owner of the coil array serial port")
+    ap.add_argument("--port", action="append", help="serial port (repeatable); default: SERIAL_PORTS")
+    ap.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path")
+    ap.add_argument("--hz", type=float, default=SEND_HZ, help="merged frames per second (max when adaptive)")
+    ap.add_argument("--min-hz", type=float, default=MIN_HZ, help="lowest adaptive send rate")
+    ap.add_argument("--fixed-rate", action="store_true", help="disable the backpressure-adaptive send rate")
+    ap.add_argument("--coils", type=int, default=N_COILS, help="number of coils in a device frame")
+    ap.add_argument("--ws-port", type=int, default=None, help="also serve the HTML GUIs on ws://127.0.0.1:PORT")
+    ap.add_argument("--ack", type=int, default=0, metavar="WINDOW",
+                    help="sequenced frames + acks with WINDOW frames in flight (needs the ack firmware)")
+    ap.add_argument("--profile", metavar="PREFIX", default=None,
+                    help="sampling-profile the whole run, dump PREFIX_*.collapsed / .txt at exit")
+    args = ap.parse_args()
+
+    ser = try_open_serial(args.port or SERIAL_PORTS)
+    daemon = DeviceDaemon(ser, args.socket, n_coils=args.coils, send_hz=args.hz, ws_port=args.ws_port,
+                          ack_window=args.ack, min_hz=args.min_hz, adaptive=not args.fixed_rate)
+    profiler = SamplingProfiler() if args.profile else None
+    if profiler:
+        profiler.start()
+    try:
+        asyncio.run(daemon.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if ser is not None:
+            try:
+                ser.write(levels_to_csv_line(np.zeros(daemon.n_coils, dtype=int)))
+                ser.close()
+            except Exception:
+                pass
+        if profiler:
+            profiler.toggle(args.profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# SAM LAB, D H HAN
+# Precomputed per-coil field basis for live field maps
+#
+# Bz in the particle plane is linear in the coil levels, so the field of ANY command
+# is   field = B @ levels   with B = (H*W, n*m), one column per coil (unit level).
+# B is computed once on a fine workspace grid (RES samples per cell) and cached to
+# disk keyed by the geometry, so a GUI frame costs one float32 matrix-vector product
+# plus a colour lookup -- cheap enough for every pygame frame.
+#
+# Same dipole model and geometry constants as microrobot_sim.py:
+#   Bz(rho) ~ (2h^2 - rho^2) / (rho^2 + h^2)^(5/2),   + level => +Bz
+# Image orientation matches the grid view: row 0 = TOP coil row.
+#
+# Usage (in a pygame loop):
+#   basis = FieldBasis(n, m)                      # loads or builds the cache
+#   rgb = field_rgb(basis.field(levels), basis.vmax)   # (H, W, 3) uint8
+#   pygame.surfarray.blit_array(surf, rgb.swapaxes(0, 1))
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from microrobot_sim import CELL_PITCH, COIL_HEIGHT, coil_centers
+
+# ================== Config ==================
+RES = 16                   # field samples per cell (each axis)
+CACHE_DIR = os.environ.get("PWM32_CACHE", os.path.join(tempfile.gettempdir(), "pwm32_cache"))
+POS_RGB = (255, 0, 0)      # +Bz (POS channel) - same colours as the tile view
+NEG_RGB = (0, 0, 255)      # -Bz (NEG channel)
+# ================== Config ==================
+
+
+def bz_matrix(points, n, m, pitch=CELL_PITCH, height=COIL_HEIGHT):
+    """Points (k, 2) mm -> (k, n*m) Bz of each coil at unit level (float64)."""
+    pts = np.asarray(points, dtype=float).reshape(-1, 2)
+    c = coil_centers(n, m, pitch)
+    r2 = ((pts[:, None, :] - c[None, :, :]) ** 2).sum(-1)
+    h2 = height * height
+    return (2.0 * h2 - r2) / (r2 + h2) ** 2.5
+
+
+def compute_basis(n, m, res=RES, pitch=CELL_PITCH, height=COIL_HEIGHT):
+    """(n*res*m*res, n*m) float32: Bz of each coil at unit level on the sample grid."""
+    step = pitch / res
+    ys = (n * res - 0.5 - np.arange(n * res)) * step           # row 0 = top
+    xs = (np.arange(m * res) + 0.5) * step
+    X, Y = np.meshgrid(xs, ys)
+    return bz_matrix(np.stack([X.ravel(), Y.ravel()], axis=-1), n, m, pitch, height).astype(np.float32)
+
+
+class FieldBasis:
+    def __init__(self, n, m, res=RES, pitch=CELL_PITCH, height=COIL_HEIGHT, cache_dir=CACHE_DIR):
+        self.n, self.m, self.res = n, m, res
+        self.shape = (n * res, m * res)
+        key = hashlib.sha1(repr((n, m, res, float(pitch), float(height))).encode()).hexdigest()[:16]
+        path = os.path.join(cache_dir, f"field_basis_{key}.npy") if cache_dir else None
+        B = None
+        if path and os.path.exists(path):
+            try:
+                B = np.load(path)
+            except (OSError, ValueError):
+                B = None
+        if B is None or B.shape != (self.shape[0] * self.shape[1], n * m):
+            B = compute_basis(n, m, res, pitch, height)
+            if path:
+                try:
+                    os.makedirs(cache_dir, exist_ok=True)
+                    tmp = path + f".{os.getpid()}.tmp.npy"
+                    np.save(tmp, B)
+                    os.replace(tmp, path)
+                except OSError as e:
+                    print("Field basis cache not written:", e)
+        self.B = np.ascontiguousarray(B)
+        self.path = path
+        self.vmax = float(np.abs(self.B).max())    # one coil at unit level
+        self._lv = np.zeros(n * m, dtype=np.float32)
+        self._out = np.zeros(self.shape[0] * self.shape[1], dtype=np.float32)
+
+    def field(self, levels):
+        """Signed levels (n, m) or (n*m,) -> (H, W) Bz map (same units as levels * basis)."""
+        self._lv[:] = np.ravel(levels)
+        np.dot(self.B, self._lv, out=self._out)
+        return self._out.reshape(self.shape)
+
+
+def _make_lut(n=256):
+    t = np.linspace(-1.0, 1.0, n)[:, None]
+    pos = np.asarray(POS_RGB, dtype=float)
+    neg = np.asarray(NEG_RGB, dtype=float)
+    return np.where(t >= 0, t * pos, -t * neg).clip(0, 255).astype(np.uint8)
+
+
+_LUT = _make_lut()
+
+
+def field_rgb(field, vmax, gamma=0.5):
+    """(H, W) signed field -> (H, W, 3) uint8 through a diverging colour table (gamma < 1 lifts weak field)."""
+    x = np.clip(field / max(vmax, 1e-12), -1.0, 1.0)
+    x = np.sign(x) * np.abs(x) ** gamma
+    idx = ((x + 1.0) * 127.5).astype(np.intp)
+    return _LUT[idx]
@@ -0,0 +1,211 @@
+# SAM LAB, D H HAN
+# Shared-memory frame bus: one control process publishes, any number of viewers read
+#
+# The control loop publishes every composed frame into a multiprocessing.shared_memory
+# double buffer; viewers (pygame GUI, recorder, monitors) read the newest frame at
+# their own rate and never block or slow the writer.
+#
+# Layout (little endian, 8-byte aligned):
+#   header : int64 [magic, seq, n, m]              seq = number of frames published
+#   slot 0 : int64 seq, float64 t, float64 pattern_t, int8 levels[n*m] (quantized PWM
+#            units, padded to 8 bytes); t = wall clock (time.time()) at publish,
+#            pattern_t = the publisher's own clock (e.g. seconds since pattern start)
+#   slot 1 : same
+# Frame k goes to slot k % 2. The writer invalidates the slot (seq = -1), writes the
+# levels, then stamps the slot and the header with k (seqlock). A reader picks the
+# slot of the header seq and accepts it only if the slot stamp is k before AND after
+# reading, so it never sees a half-written frame.
+#
+# Usage:
+#   bus = FrameBus.create(n, m)               # control process
+#   bus.publish(levels, pattern_t=t)
+#   view = FrameBus.attach()                  # viewer process
+#   seq, t, levels = view.read()              # newest complete frame (copy into a reusable buffer)
+#   view.pattern_t                            # pattern time of the frame read last
+#   seq, t, levels = view.read(copy=False)    # zero-copy view; check view.valid(seq) after use
+#
+#   python frame_bus.py monitor               # rate / newest frame of a running publisher
+#   python frame_bus.py record out.npz --seconds 30
+
+import argparse
+import struct
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from frame_codec import quantize
+
+# ================== Config ==================
+BUS_NAME = "pwm32_frames"
+# ================== Config ==================
+
+MAGIC = 0x3950574D3332  # "PWM32" + "9": int8 slot layout with wall + pattern time
+HEADER = 4 * 8
+SLOT_HEAD = 24
+
+
+def _untrack(shm):
+    # attach-only users must not unlink the block when they exit (Python < 3.13 tracks every attach)
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+class FrameBus:
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        buf = shm.buf
+        self.header = np.ndarray((4,), dtype=np.int64, buffer=buf)
+        self.n, self.m = int(self.header[2]), int(self.header[3])
+        c = self.n * self.m
+        self.slot_size = SLOT_HEAD + c + (-c) % 8
+        self.slot_seq, self.slot_t, self.slot_pt, self.slot_levels = [], [], [], []
+        for k in range(2):
+            off = HEADER + k * self.slot_size
+            self.slot_seq.append(np.ndarray((1,), dtype=np.int64, buffer=buf, offset=off))
+            self.slot_t.append(np.ndarray((1,), dtype=np.float64, buffer=buf, offset=off + 8))
+            self.slot_pt.append(np.ndarray((1,), dtype=np.float64, buffer=buf, offset=off + 16))
+            self.slot_levels.append(np.ndarray((self.n, self.m), dtype=np.int8, buffer=buf, offset=off + SLOT_HEAD))
+        self._copy = np.zeros((self.n, self.m), dtype=np.int8)
+        self.pattern_t = 0.0                  # pattern time of the frame returned by the last read()
+
+    @classmethod
+    def create(cls, n, m, name=BUS_NAME):
+        """Writer side. Replaces a stale block of the same name (e.g. after a crash)."""
+        c = n * m
+        size = HEADER + 2 * (SLOT_HEAD + c + (-c) % 8)
+        try:
+            old = shared_memory.SharedMemory(name=name)
+            old.close()
+            old.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        struct.pack_into("<qqqq", shm.buf, 0, 0, 0, n, m)
+        bus = cls(shm, owner=True)
+        for k in range(2):
+            bus.slot_seq[k][0] = -1
+        bus.header[0] = MAGIC
+        return bus
+
+    @classmethod
+    def attach(cls, name=BUS_NAME, timeout=0.0):
+        """Reader side. Waits up to `timeout` s for the writer; raises FileNotFoundError."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+                break
+            except FileNotFoundError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+        _untrack(shm)
+        if struct.unpack_from("<q", shm.buf, 0)[0] != MAGIC:
+            shm.close()
+            raise FileNotFoundError(f"shared memory {name!r} is not a frame bus")
+        return cls(shm, owner=False)
+
+    # ----- writer -----
+    def publish(self, levels, pattern_t=0.0, t=None):
+        """t: wall-clock time of the frame (default now), read back as its age by monitors."""
+        k = int(self.header[1]) + 1
+        s = k % 2
+        self.slot_seq[s][0] = -1
+        quantize(np.reshape(levels, (self.n, self.m)), out=self.slot_levels[s])
+        self.slot_t[s][0] = time.time() if t is None else t
+        self.slot_pt[s][0] = pattern_t
+        self.slot_seq[s][0] = k
+        self.header[1] = k
+        return k
+
+    # ----- reader -----
+    @property
+    def seq(self):
+        return int(self.header[1])
+
+    def read(self, copy=True):
+        """Newest complete frame -> (seq, t, levels). seq 0 means nothing published yet."""
+        while True:
+            k = int(self.header[1])
+            if k == 0:
+                return 0, 0.0, self._copy
+            s = k % 2
+            if self.slot_seq[s][0] != k:
+                continue                       # writer is on this slot right now
+            t = float(self.slot_t[s][0])
+            pt = float(self.slot_pt[s][0])
+            if not copy:
+                self.pattern_t = pt
+                return k, t, self.slot_levels[s]
+            np.copyto(self._copy, self.slot_levels[s])
+            if self.slot_seq[s][0] == k:
+                self.pattern_t = pt
+                return k, t, self._copy
+
+    def valid(self, k):
+        """True while a zero-copy view of frame k has not been overwritten."""
+        return self.slot_seq[k % 2][0] == k
+
+    def close(self):
+        # drop our views before closing the mapping
+        self.header = self.slot_seq = self.slot_t = self.slot_pt = self.slot_levels = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Watch or record a running frame publisher")
+    ap.add_argument("command", choices=["monitor", "record"])
+    ap.add_argument("out", nargs="?", default="frames.npz", help="record: output .npz")
+    ap.add_argument("--name", default=BUS_NAME)
+    ap.add_argument("--seconds", type=float, default=10.0, help="record: duration")
+    ap.add_argument("--poll", type=float, default=200.0, help="reads per second")
+    args = ap.parse_args()
+
+    bus = FrameBus.attach(args.name, timeout=5.0)
+    period = 1.0 / args.poll
+    try:
+        if args.command == "monitor":
+            last_seq, last_t = bus.seq, time.monotonic()
+            while True:
+                time.sleep(1.0)
+                k, t, lv = bus.read()
+                now = time.monotonic()
+                rate = (k - last_seq) / (now - last_t)
+                last_seq, last_t = k, now
+                print(f"seq {k:8d}  {rate:6.1f} frames/s  age {1e3 * (time.time() - t):6.1f} ms  "
+                      f"active coils {int(np.count_nonzero(lv))}")
+        else:
+            seqs, ts, pts, frames, missed = [], [], [], [], 0
+            end = time.monotonic() + args.seconds
+            last = bus.seq
+            while time.monotonic() < end:
+                k, t, lv = bus.read()
+                if k != last:
+                    missed += max(0, k - last - 1)
+                    seqs.append(k)
+                    ts.append(t)
+                    pts.append(bus.pattern_t)
+                    frames.append(lv.copy())
+                    last = k
+                time.sleep(period)
+            np.savez_compressed(args.out, seq=np.asarray(seqs), t=np.asarray(ts), pattern_t=np.asarray(pts),
+                                frames=np.asarray(frames).reshape(-1, bus.n, bus.m))
+            print(f"Saved {len(frames)} frames to {args.out} ({missed} published between polls)")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bus.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# SAM LAB, D H HAN
+# Compact frame encoding shared by the device daemon and its clients
+#
+# Message = 4-byte header + payload
+#   header: magic (0xA5), kind, payload length (uint16, little endian)
+#   FRAME payload: one signed int8 level per coil, row-major (pos > 0, neg < 0)
+#   HELLO payload: priority (int16), lease_ms (uint16), flags (uint8), name (utf-8)
+#   STOP / RESUME: latch / release the emergency stop (all coils zero)
+#   STATS -> STATS_REPLY: JSON with per-client counters
+#
+# A 4x8 frame is 36 bytes on the socket instead of a ~130 byte CSV line.
+# The device itself still receives the CSV line (pos/neg pairs) it expects;
+# levels_to_csv_line() does that conversion in the daemon.
+#
+# Levels are quantized to int8 once (quantize(); coil_state.py keeps them that way).
+# An int8 array is the FRAME payload as is, and its CSV line is one lookup per coil
+# in a table of the 256 possible "pos,neg" pairs.
+
+import struct
+
+import numpy as np
+
+MAGIC = 0xA5
+HEADER = struct.Struct("<BBH")
+
+# message kinds
+FRAME = 1
+STOP = 2
+PING = 3
+PONG = 4
+HELLO = 5
+RESUME = 6
+STATS = 7
+STATS_REPLY = 8
+
+# HELLO flags
+OVERLAY = 0x01       # only nonzero coils of this client's frames are claimed
+
+HELLO_FMT = struct.Struct("<hHB")
+
+MAX_PAYLOAD = 0xFFFF
+
+
+def encode_message(kind, payload=b""):
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"payload too large ({len(payload)} bytes)")
+    return HEADER.pack(MAGIC, kind, len(payload)) + payload
+
+
+def quantize(levels, out=None):
+    """Signed levels (PWM units) -> int8, rounded and clipped to [-127, 127]. int8 input passes through."""
+    lv = np.asarray(levels)
+    if lv.dtype == np.int8:
+        if out is None:
+            return lv
+        out[...] = lv
+        return out
+    q = np.clip(np.rint(lv), -127, 127)
+    if out is None:
+        return q.astype(np.int8)
+    np.copyto(out, q, casting="unsafe")
+    return out
+
+
+def encode_frame(levels):
+    """Signed levels (any shape, PWM units) -> FRAME message."""
+    return encode_message(FRAME, quantize(levels).tobytes())
+
+
+def encode_hello(name="", priority=0, lease=0.5, overlay=False):
+    lease_ms = int(min(max(lease, 0.0) * 1000.0, 0xFFFF))
+    body = HELLO_FMT.pack(int(priority), lease_ms, OVERLAY if overlay else 0) + name.encode("utf-8")
+    return encode_message(HELLO, body)
+
+
+def decode_hello(payload):
+    """HELLO payload -> (name, priority, lease_seconds, overlay)."""
+    if len(payload) < HELLO_FMT.size:
+        raise ValueError(f"HELLO payload too short ({len(payload)} < {HELLO_FMT.size} bytes)")
+    priority, lease_ms, flags = HELLO_FMT.unpack_from(payload)
+    name = payload[HELLO_FMT.size:].decode("utf-8", errors="replace")
+    return name, priority, lease_ms / 1000.0, bool(flags & OVERLAY)
+
+
+def decode_frame(payload):
+    """FRAME payload -> flat int8 level array (row-major coil order)."""
+    return np.frombuffer(payload, dtype=np.int8)
+
+
+_PAIR_TEXT = [b"%d,%d" % (max(v, 0), max(-v, 0)) for v in range(-128, 128)]   # int8 level + 128 -> b"pos,neg"
+
+
+def levels_to_csv_line(levels):
+    """Signed coil levels -> firmware CSV line ("pos,neg,pos,neg,...\\n") as bytes."""
+    idx = quantize(levels).ravel().astype(np.intp) + 128
+    return b",".join([_PAIR_TEXT[k] for k in idx.tolist()]) + b"\n"
+
+
+def csv_line_to_levels(line):
+    """Firmware CSV line (pos/neg pairs) -> signed int levels (pos - neg)."""
+    if isinstance(line, (bytes, bytearray)):
+        line = line.decode("ascii", errors="ignore")
+    vals = [int(float(v)) for v in line.strip().split(",") if v.strip()]
+    if len(vals) % 2:
+        vals.append(0)
+    pairs = np.asarray(vals, dtype=int).reshape(-1, 2)
+    return pairs[:, 0] - pairs[:, 1]
+
+
+class MessageReader:
+    """Incremental decoder: feed() raw bytes, get back complete (kind, payload) messages."""
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data):
+        self.buf += data
+        out = []
+        while len(self.buf) >= HEADER.size:
+            magic, kind, length = HEADER.unpack_from(self.buf)
+            if magic != MAGIC:
+                # resync on the next magic byte
+                nxt = self.buf.find(bytes([MAGIC]), 1)
+                del self.buf[:nxt if nxt > 0 else len(self.buf)]
+                continue
+            end = HEADER.size + length
+            if len(self.buf) < end:
+                break
+            out.append((kind, bytes(self.buf[HEADER.size:end])))
+            del self.buf[:end]
+        return out
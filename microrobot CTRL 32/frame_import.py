@@ -0,0 +1,229 @@
+# SAM LAB, D H HAN
+# Image / animated GIF / video -> n x m signed coil frame sequences
+#
+# - every decoded frame is area-averaged onto the coil grid in one vectorized step
+#   (np.add.reduceat over row and column bands, any source size), then thresholded /
+#   quantized to integer PWM levels
+# - frames are decoded and reduced ONE AT A TIME (PIL ImageSequence, imageio reader),
+#   so a long clip never sits in memory; only the tiny n x m results are kept
+# - results are cached by content hash (file bytes + conversion options), so
+#   re-running a spec or script with the same clip is instant
+#
+# Modes (what turns a coil on):
+#   dark    : dark pixels -> on   (pixel art on white, the default)
+#   bright  : bright pixels -> on
+#   redblue : red -> POS level, blue -> NEG level (colours of the GUI tiles)
+# `levels` = number of quantization steps: 2 -> on/off (threshold), 11 -> 0..10.
+# `polarity` = sign of the output for dark / bright (+1 POS, -1 NEG).
+#
+# Pillow is needed for images / GIFs, imageio (+ ffmpeg plugin) for video; both optional.
+#
+# Usage:
+#   python frame_import.py art.gif --grid 4 8 --preview
+#   python frame_import.py clip.mp4 --fps 10 --levels 11 -o clip_frames.npz
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from frame_codec import levels_to_csv_line
+
+try:
+    from PIL import Image, ImageSequence
+except ImportError:  # images / GIFs need Pillow
+    Image = None
+
+try:
+    import imageio
+except ImportError:  # video needs imageio
+    imageio = None
+
+# ================== Config ==================
+CACHE_DIR = os.environ.get("PWM32_CACHE", os.path.join(tempfile.gettempdir(), "pwm32_cache"))
+PWM_MAX = 10
+DEFAULT_FRAME_DT = 0.1     # seconds per frame when the source has no timing (still images)
+VIDEO_EXTS = (".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v")
+MODES = ("dark", "bright", "redblue")
+# ================== Config ==================
+
+
+# ---------------------------------------------
+# Reduction
+# ---------------------------------------------
+def area_average(img, n, m):
+    """(H, W) or (H, W, C) array -> (n, m[, C]) mean over each cell's pixel area."""
+    a = np.asarray(img, dtype=np.float32)
+    H, W = a.shape[:2]
+    if H < n:
+        a = np.repeat(a, -(-n // H), axis=0)
+    if W < m:
+        a = np.repeat(a, -(-m // W), axis=1)
+    H, W = a.shape[:2]
+    r = np.linspace(0, H, n + 1).astype(int)
+    c = np.linspace(0, W, m + 1).astype(int)
+    s = np.add.reduceat(np.add.reduceat(a, r[:-1], axis=0), c[:-1], axis=1)
+    area = np.outer(np.diff(r), np.diff(c))
+    return s / (area[..., None] if s.ndim == 3 else area)
+
+
+def quantize_unit(x, levels, pwm_max=PWM_MAX):
+    """
+    x in [0, 1] -> integer PWM levels; levels=2 is a 0.5 threshold (0 or pwm_max).
+    Not frame_codec.quantize (signed levels -> int8), which the same scripts import.
+    """
+    x = np.clip(x, 0.0, 1.0)
+    steps = max(int(levels) - 1, 1)
+    return np.round(np.round(x * steps) / steps * pwm_max)
+
+
+def to_levels(rgb_cells, mode="dark", levels=2, polarity=-1, pwm_max=PWM_MAX):
+    """(n, m, 3) cell colours in [0, 1] -> signed int8 (n, m) PWM levels."""
+    if mode == "redblue":
+        r, b = rgb_cells[..., 0], rgb_cells[..., 2]
+        out = (quantize_unit(np.clip(r - b, 0, 1), levels, pwm_max)
+               - quantize_unit(np.clip(b - r, 0, 1), levels, pwm_max))
+    else:
+        luma = rgb_cells @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        on = 1.0 - luma if mode == "dark" else luma
+        out = np.sign(polarity) * quantize_unit(on, levels, pwm_max)
+    return out.astype(np.int8)
+
+
+def _rgb01(frame):
+    a = np.asarray(frame)
+    if a.ndim == 2:
+        a = np.repeat(a[..., None], 3, axis=2)
+    a = a[..., :3].astype(np.float32)
+    return a / (65535.0 if a.max() > 255 else 255.0)
+
+
+# ---------------------------------------------
+# Decoding (streaming)
+# ---------------------------------------------
+def iter_source(path):
+    """Yield (rgb frame as array, duration seconds) one decoded frame at a time."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in VIDEO_EXTS:
+        if imageio is None:
+            raise ValueError(f"{path}: video import needs imageio (pip install imageio imageio-ffmpeg)")
+        reader = imageio.get_reader(path)
+        try:
+            fps = float(reader.get_meta_data().get("fps") or 1.0 / DEFAULT_FRAME_DT)
+            for frame in reader:
+                yield frame, 1.0 / fps
+        finally:
+            reader.close()
+        return
+    if Image is None:
+        raise ValueError(f"{path}: image import needs Pillow (pip install pillow)")
+    with Image.open(path) as im:
+        for fr in ImageSequence.Iterator(im):
+            dur = fr.info.get("duration", im.info.get("duration"))
+            yield np.asarray(fr.convert("RGB")), (dur / 1000.0 if dur else DEFAULT_FRAME_DT)
+
+
+def iter_frames(path, n, m, mode="dark", levels=2, polarity=-1, max_fps=None, pwm_max=PWM_MAX):
+    """
+    Yield (signed int8 (n, m) frame, duration) per output frame, streaming.
+    With max_fps, source frames closer than 1/max_fps are merged into the previous output frame.
+    """
+    min_dt = 1.0 / max_fps if max_fps else 0.0
+    pending, acc = None, 0.0
+    for frame, dur in iter_source(path):
+        if pending is not None and acc < min_dt:
+            acc += dur                 # skip the reduction entirely for dropped frames
+            continue
+        if pending is not None:
+            yield pending, acc
+        pending = to_levels(area_average(_rgb01(frame), n, m), mode, levels, polarity, pwm_max)
+        acc = dur
+    if pending is not None:
+        yield pending, acc
+
+
+# ---------------------------------------------
+# Cached import
+# ---------------------------------------------
+def content_key(path, **opts):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    h.update(json.dumps(opts, sort_keys=True).encode())
+    return h.hexdigest()[:20]
+
+
+def import_frames(path, n, m, mode="dark", levels=2, polarity=-1, max_fps=None, pwm_max=PWM_MAX,
+                  cache_dir=CACHE_DIR):
+    """
+    Whole sequence as (frames (T, n, m) int8, durations (T,) seconds), cached by content hash.
+    Raises ValueError for unknown modes or a missing decoder.
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+    opts = dict(n=n, m=m, mode=mode, levels=int(levels), polarity=int(np.sign(polarity)),
+                max_fps=max_fps, pwm_max=pwm_max)
+    cache = os.path.join(cache_dir, f"frames_{content_key(path, **opts)}.npz") if cache_dir else None
+    if cache and os.path.exists(cache):
+        try:
+            with np.load(cache) as z:
+                return z["frames"], z["durations"]
+        except (OSError, ValueError, KeyError):
+            pass
+    frames, durations = [], []
+    for f, d in iter_frames(path, **opts):
+        frames.append(f)
+        durations.append(d)
+    if not frames:
+        raise ValueError(f"{path}: no frames decoded")
+    frames, durations = np.stack(frames), np.asarray(durations)
+    if cache:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = cache + f".{os.getpid()}.tmp.npz"
+            np.savez_compressed(tmp, frames=frames, durations=durations)
+            os.replace(tmp, cache)
+        except OSError as e:
+            print("Frame cache not written:", e)
+    return frames, durations
+
+
+def preview(frame):
+    """ASCII view: '+' POS, '-' NEG, '.' off (row 0 = top)."""
+    return "\n".join("".join("+" if v > 0 else "-" if v < 0 else "." for v in row) for row in frame)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert an image / GIF / video into coil frames")
+    ap.add_argument("source")
+    ap.add_argument("--grid", nargs=2, type=int, default=[4, 8], metavar=("ROWS", "COLS"))
+    ap.add_argument("--mode", choices=MODES, default="dark")
+    ap.add_argument("--levels", type=int, default=2, help="quantization steps (2 = on/off)")
+    ap.add_argument("--polarity", type=int, choices=[-1, 1], default=-1, help="dark/bright: -1 NEG, +1 POS")
+    ap.add_argument("--fps", type=float, default=None, help="cap the output frame rate (drops source frames)")
+    ap.add_argument("-o", "--out", default=None, help="write frames/durations to .npz, or device CSV lines to .csv")
+    ap.add_argument("--preview", action="store_true", help="print the frames as ASCII")
+    args = ap.parse_args()
+
+    n, m = args.grid
+    frames, durations = import_frames(args.source, n, m, args.mode, args.levels, args.polarity, args.fps)
+    print(f"{args.source}: {len(frames)} frames of {n}x{m}, {durations.sum():.2f} s")
+    if args.preview:
+        for k, (f, d) in enumerate(zip(frames, durations)):
+            print(f"-- frame {k} ({d * 1000:.0f} ms)\n{preview(f)}")
+    if args.out:
+        if args.out.endswith(".csv"):
+            with open(args.out, "wb") as fh:
+                for f in frames:
+                    fh.write(levels_to_csv_line(f))
+        else:
+            np.savez_compressed(args.out, frames=frames, durations=durations)
+        print("Saved", args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# SAM LAB, D H HAN
+# Sequence-numbered frames with short acknowledgements and a bounded in-flight window
+#
+# Wire format (firmware >= ack support, see magnet_control_arduino.ino):
+#   host -> device : "@<seq>,p0,n0,p1,n1,...\n"   (seq = 0..65535, wraps)
+#   device -> host : "!<seq>,<status>\n"           (status 0 = ok, 1 = short frame)
+# Lines without the '@' prefix are still echoed in full by the firmware (legacy mode),
+# so old scripts keep working; the ack mode replaces the ~130 byte echo with ~8 bytes.
+#
+# FrameLink keeps at most `window` frames in flight, measures the round trip of each
+# acked frame and detects lost (skipped or timed out) and mismatched acks.
+# With ack=False it speaks the legacy protocol and times the full-line echo instead,
+# so backpressure is visible with the old firmware too. A STOP / all-zero frame never
+# waits for a window slot: send(force=True) writes it and resets the window.
+#
+# AdaptiveRate turns that into a send rate: when the echo/ack lag or the OS output
+# queue (out_waiting) grows, the rate is cut multiplicatively and frames that would
+# only queue up are skipped (the caller sends the newest one later); when the link is
+# idle again the rate creeps back up. Command-to-coil latency stays bounded instead of
+# growing with every frame buffered in the OS / USB stack.
+
+import collections
+import time
+
+import numpy as np
+
+from frame_codec import levels_to_csv_line
+
+SEQ_MOD = 1 << 16
+ACK_TIMEOUT = 0.5          # seconds without ack -> frame counted as lost
+RTT_HISTORY = 512          # round trips kept for percentiles
+RTT_ALPHA = 0.2            # EWMA weight of the newest round trip
+
+
+class FrameLink:
+    def __init__(self, ser, window=4, ack_timeout=ACK_TIMEOUT, ack=True):
+        self.ser = ser
+        self.window = int(window)
+        self.ack_timeout = float(ack_timeout)
+        self.ack = bool(ack)
+        self.seq = 0
+        self.inflight = collections.OrderedDict()   # seq -> (t_sent, expected echo or None)
+        self.rx = bytearray()
+        self.rtts = np.zeros(RTT_HISTORY)
+        self.n_rtt = 0
+        self.rtt_ewma = 0.0
+        self.sent = 0
+        self.acked = 0
+        self.lost = 0
+        self.mismatched = 0
+        self.nacked = 0            # acks with nonzero status
+        self.flushed = 0           # in-flight frames dropped by a forced send
+
+    def can_send(self):
+        self.expire()
+        return len(self.inflight) < self.window
+
+    def send(self, levels, force=False):
+        """
+        Write one frame if the window has room. Returns the seq used, or None if full.
+        force: write regardless of the window (STOP / all-zero frames); the frames still in
+        flight are superseded and dropped from the window.
+        """
+        if force:
+            self.flushed += len(self.inflight)
+            self.inflight.clear()
+        elif not self.can_send():
+            return None
+        seq = self.seq
+        self.seq = (self.seq + 1) % SEQ_MOD
+        body = levels_to_csv_line(levels)
+        self.ser.write(b"@%d," % seq + body if self.ack else body)
+        self.inflight[seq] = (time.monotonic(), None if self.ack else body.strip())
+        self.sent += 1
+        return seq
+
+    def lag(self, now=None):
+        """Current link lag: age of the oldest unacknowledged frame or the recent round trip."""
+        now = time.monotonic() if now is None else now
+        oldest = now - next(iter(self.inflight.values()))[0] if self.inflight else 0.0
+        return max(oldest, self.rtt_ewma)
+
+    def expire(self, now=None):
+        now = time.monotonic() if now is None else now
+        while self.inflight:
+            seq, (t, _) = next(iter(self.inflight.items()))
+            if now - t < self.ack_timeout:
+                break
+            del self.inflight[seq]
+            self.lost += 1
+
+    def poll(self):
+        """Read whatever the device sent and process acks. Returns the number of acks handled."""
+        n = self.ser.in_waiting
+        return self.process(self.ser.read(n) if n else b"")
+
+    def process(self, data):
+        """Process bytes received from the device (for callers that read the port themselves)."""
+        self.rx += data
+        handled = 0
+        while True:
+            k = self.rx.find(b"\n")
+            if k < 0:
+                break
+            line = bytes(self.rx[:k]).strip()
+            del self.rx[:k + 1]
+            if line.startswith(b"!"):
+                self.on_ack(line)
+                handled += 1
+            elif not self.ack and line:
+                self.on_echo(line)
+                handled += 1
+        self.expire()
+        return handled
+
+    def on_ack(self, line):
+        now = time.monotonic()
+        try:
+            seq_s, _, status_s = line[1:].partition(b",")
+            seq, status = int(seq_s), int(status_s or b"0")
+        except ValueError:
+            self.mismatched += 1
+            return
+        if seq not in self.inflight:
+            self.mismatched += 1
+            return
+        # acks arrive in order: everything sent before `seq` and still in flight was lost
+        while self.inflight:
+            s, (t, _) = self.inflight.popitem(last=False)
+            if s == seq:
+                break
+            self.lost += 1
+        self.record_rtt(now - t)
+        if status != 0:
+            self.nacked += 1
+
+    def on_echo(self, line):
+        # legacy firmware echoes every line in order; match it against the oldest in flight
+        if not self.inflight:
+            self.mismatched += 1
+            return
+        _, (t, expect) = self.inflight.popitem(last=False)
+        if line != expect:
+            self.mismatched += 1
+        self.record_rtt(time.monotonic() - t)
+
+    def record_rtt(self, rtt):
+        self.rtts[self.n_rtt % RTT_HISTORY] = rtt
+        self.rtt_ewma = rtt if self.n_rtt == 0 else (1 - RTT_ALPHA) * self.rtt_ewma + RTT_ALPHA * rtt
+        self.n_rtt += 1
+        self.acked += 1
+
+    def rtt_percentiles(self, q=(50, 99)):
+        k = min(self.n_rtt, RTT_HISTORY)
+        if k == 0:
+            return [None for _ in q]
+        return list(np.percentile(self.rtts[:k], q))
+
+    def stats(self):
+        p50, p99 = self.rtt_percentiles()
+        return {
+            "sent": self.sent, "acked": self.acked, "lost": self.lost,
+            "mismatched": self.mismatched, "nacked": self.nacked, "flushed": self.flushed,
+            "inflight": len(self.inflight), "window": self.window, "mode": "ack" if self.ack else "echo",
+            "rtt_ms_p50": None if p50 is None else 1e3 * p50,
+            "rtt_ms_p99": None if p99 is None else 1e3 * p99,
+        }
+
+
+class AdaptiveRate:
+    """
+    AIMD send-rate control from link lag and the OS output queue.
+    Call allow(link) once per tick: returns False when the frame should be skipped
+    because it would only queue behind stale ones. `hz` is the rate to tick at next.
+    """
+
+    def __init__(self, max_hz, min_hz=1.0, target_lag=0.1, out_limit=192,
+                 decrease=0.7, increase_hz=0.5):
+        self.max_hz = float(max_hz)
+        self.min_hz = float(min(min_hz, max_hz))
+        self.target_lag = float(target_lag)
+        self.out_limit = int(out_limit)      # bytes queued in the OS before we stop adding
+        self.decrease = float(decrease)
+        self.increase_hz = float(increase_hz)
+        self.hz = self.max_hz
+        self.skipped = 0
+        self.cuts = 0
+
+    def allow(self, link):
+        try:
+            queued = link.ser.out_waiting
+        except (AttributeError, OSError):
+            queued = 0
+        lag = link.lag()
+        congested = lag > self.target_lag or queued > self.out_limit or not link.can_send()
+        if congested:
+            self.hz = max(self.min_hz, self.hz * self.decrease)
+            self.cuts += 1
+        elif lag < 0.5 * self.target_lag and queued == 0:
+            self.hz = min(self.max_hz, self.hz + self.increase_hz)
+        # never queue behind frames the device has not taken yet
+        if queued > self.out_limit or not link.can_send():
+            self.skipped += 1
+            return False
+        return True
+
+    def stats(self):
+        return {"hz": self.hz, "max_hz": self.max_hz, "min_hz": self.min_hz,
+                "skipped": self.skipped, "cuts": self.cuts}
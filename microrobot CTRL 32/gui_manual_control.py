@@ -6,17 +6,31 @@
 # - Add a "100% hold" period of 5 seconds after each click.
 # - After the hold, linearly decay to 0 over the remaining time.
 # - Remove hard-coded "10" in decay; use maxIntensity.
+#
+# Event-driven: the envelope only changes at its breakpoints (hold end, each quantization
+# step of the decay, off), so update_decay / redraw / send run only at
+# CoilState.next_transition() or after a click (at most SEND_HZ), with the unchanged frame
+# resent every KEEPALIVE_S in between.
+#
+# F: toggle the live field map (Bz of the current command, field_basis.py) over the tiles
+# F9: start / stop the sampling profiler (dumps prof_manual_*.collapsed / .txt)
 
 import pygame
 import numpy as np
-import serial
+import device_client
+import serial_manager
 import time
+from coil_state import CoilState
+from field_basis import FieldBasis, field_rgb
+from sampling_profiler import SamplingProfiler
 
 # ================== Config ==================
 SERIAL_PORT = '/dev/cu.usbmodem1020BA0ABA902'
 DECAY_DURATION = 10        # total ON window (seconds): hold + decay
 HOLD_DURATION  = 5         # 100% (maxIntensity) hold time (seconds)
 maxIntensity   = 10        # maximum intensity of each magnet [0,10]
+SEND_HZ        = 10        # max frame rate to the board
+KEEPALIVE_S    = 0.5       # resend the unchanged frame this often between transitions
 # ================== Config ==================
 
 # === Pygame / UI ===
@@ -25,20 +39,20 @@ SCREEN_W, SCREEN_H = 800, 550
 FPS = 30
 BG_COLOR   = (30, 30, 30)
 GRID_COLOR = (80, 80, 80)
-POS_COLOR  = (255, 0, 0)  # positive (shown when grid[i,j,0] > 0)
-NEG_COLOR  = (0, 0, 255)  # negative (shown when grid[i,j,1] > 0)
+POS_COLOR  = (255, 0, 0)  # positive (shown when level > 0)
+NEG_COLOR  = (0, 0, 255)  # negative (shown when level < 0)
 TEXT_COLOR = (255, 255, 255)
 TABLE_BG   = (15, 15, 15)
 TABLE_GRID = (70, 70, 70)
+FIELD_ALPHA = 170          # opacity of the field map overlay (0..255)
 
 # === Grid fixed ===
 n, m = 4, 8  # rows=4, cols=8 (fixed)
 
-def create_grid(n, m):
-    # channels: [pos_val (0..maxIntensity), neg_val (0..maxIntensity), t_start]
-    return np.zeros((n, m, 3), dtype=float)
-
-grid_data = create_grid(n, m)
+# signed int8 level per coil + click envelope (start time, peak) per coil
+state = CoilState(n, m, envelope=True)
+basis = FieldBasis(n, m)     # cached on disk after the first run
+show_field = False
 
 pygame.init()
 screen = pygame.display.set_mode((SCREEN_W, SCREEN_H))
@@ -59,7 +73,7 @@ def get_dynamic_tile_size(n, m):
     return max(4, tile_size)
 
 # this is to show grid (control input in UI)
-def draw_grid(grid):
+def draw_grid(state):
     tile = get_dynamic_tile_size(n, m)
     grid_w, grid_h = m*tile, n*tile
     x0 = (SCREEN_W - grid_w)//2
@@ -69,7 +83,8 @@ def draw_grid(grid):
         for j in range(m):
             x = x0 + j*tile
             y = y0 + i*tile
-            pos_val, neg_val, _ = grid[i, j]
+            level = int(state.levels[i, j])
+            pos_val, neg_val = max(level, 0), max(-level, 0)
             if pos_val > 0:
                 alpha = int(np.clip(25.5 * (pos_val / maxIntensity) * 10.0, 25, 255))
                 surf = pygame.Surface((tile-2, tile-2), pygame.SRCALPHA)
@@ -84,58 +99,24 @@ def draw_grid(grid):
                 pygame.draw.rect(screen, GRID_COLOR, (x, y, tile-2, tile-2))
     return x0, y0 + grid_h, grid_w, tile, y0
 
-def update_decay(grid):
+def draw_field(state, x0, y0, tile):
+    # signed command -> Bz map, one matrix-vector product per frame
+    rgb = field_rgb(basis.field(state.levels), basis.vmax * maxIntensity)
+    surf = pygame.surfarray.make_surface(rgb.swapaxes(0, 1))
+    surf = pygame.transform.smoothscale(surf, (m*tile - 2, n*tile - 2))
+    surf.set_alpha(FIELD_ALPHA)
+    screen.blit(surf, (x0, y0))
+
+def update_decay(state):
     """
     Behavior:
       - For HOLD_DURATION seconds after click: keep intensity at maxIntensity (100%).
       - Then linearly decay to 0 by DECAY_DURATION.
       - After DECAY_DURATION: OFF (zero).
     """
-    now = time.time()
-
-    # Safety: ensure sensible parameters
-    hold = max(0.0, float(HOLD_DURATION))
-    total = max(0.0, float(DECAY_DURATION))
-    decay_window = max(0.0, total - hold)
+    state.update_envelope(hold=HOLD_DURATION, total=DECAY_DURATION)
 
-    for i in range(n):
-        for j in range(m):
-            pos_val, neg_val, t0 = grid[i, j]
-            if t0 <= 0:
-                continue
-
-            elapsed = now - t0
-
-            if elapsed < hold:
-                # 100% hold: keep whatever polarity was set at maxIntensity
-                if pos_val > 0:
-                    grid[i, j][0] = float(maxIntensity)
-                    grid[i, j][1] = 0.0
-                elif neg_val > 0:
-                    grid[i, j][1] = float(maxIntensity)
-                    grid[i, j][0] = 0.0
-                else:
-                    grid[i, j][:] = 0.0
-                continue
-
-            if elapsed < total and decay_window > 0:
-                # linear decay from maxIntensity to 0 over decay_window
-                tau = elapsed - hold
-                k = 1.0 - (tau / decay_window)  # k in (0,1]
-                k = float(np.clip(k, 0.0, 1.0))
-                if pos_val > 0:
-                    grid[i, j][0] = float(maxIntensity) * k
-                    grid[i, j][1] = 0.0
-                elif neg_val > 0:
-                    grid[i, j][1] = float(maxIntensity) * k
-                    grid[i, j][0] = 0.0
-                else:
-                    grid[i, j][:] = 0.0
-            else:
-                # after total window: OFF
-                grid[i, j][:] = 0.0
-
-def draw_table(grid, pos_x, pos_y, width):
+def draw_table(state, pos_x, pos_y, width):
     table_top = pos_y + 10
     cell_h = 28
     cell_w = max(width // max(m, 1), 28)
@@ -145,9 +126,8 @@ def draw_table(grid, pos_x, pos_y, width):
         draw_text(screen, i, (pos_x - 20, table_top + i*cell_h + 3), center=False, size=16, color=(200,220,180))
         for j in range(m):
             cx = pos_x + j*cell_w + cell_w//2
-            pos_val = int(round(grid[i,j][0]))
-            neg_val = int(round(grid[i,j][1]))
-            draw_text(screen, f"{pos_val}/{neg_val}", (cx, ry), center=True, size=16)
+            level = int(state.levels[i, j])
+            draw_text(screen, f"{max(level, 0)}/{max(-level, 0)}", (cx, ry), center=True, size=16)
     for i in range(n+1):
         y = table_top + i*cell_h
         pygame.draw.line(screen, TABLE_GRID, (pos_x, y), (pos_x + m*cell_w, y))
@@ -155,39 +135,27 @@ def draw_table(grid, pos_x, pos_y, width):
         x = pos_x + j*cell_w
         pygame.draw.line(screen, TABLE_GRID, (x, table_top), (x, table_top + n*cell_h))
 
-def get_output_matrix(grid):
-    # Flatten [pos,neg] pairs (rounded to int)
-    arr  = np.round(grid[:, :, :2]).astype(int).reshape(-1, 2)  # (n*m, 2)
-    flat = arr.flatten()                                        # length = n*m*2 = 64
-    group = 16  # m==8 => (m//8)*16 = 16
-    rows  = len(flat) // group
-    A = np.zeros((rows, group), dtype=int)
-    for idx, v in enumerate(flat):
-        A[idx // group, idx % group] = v
-    return A
-
-def matrix_to_csv_string(A):
-    return ",".join(str(int(v)) for v in A.flatten())
-
-def send_matrix_over_serial(A, ser):
-    data_str = matrix_to_csv_string(A) + "\n"
+def send_line_over_serial(line, ser):
     try:
-        ser.write(data_str.encode('utf-8'))
+        ser.write(line)
     except Exception as e:
         print(f"Serial error: {e}")
 
 # Open serial
-ser = None
-try:
-    ser = serial.Serial(SERIAL_PORT, SERIAL_BAUD, timeout=0)
-    time.sleep(2)
-except Exception as e:
-    print(f"Serial open error: {e}")
+ser = device_client.connect()   # running device_daemon.py skips the port-open reset
+if ser is None:
+    ser = serial_manager.open_managed([SERIAL_PORT], SERIAL_BAUD)
+    if ser is None:
+        print("Serial not found; running without serial output.")
 
 csv_input_str = ""
 csv_output_str = ""
-last_sent = time.time()
+last_sent = last_frame = 0.0
+send_dt = 1.0 / SEND_HZ
+t_next = 0.0               # next envelope breakpoint (inf = nothing running)
+redraw = True
 running = True
+profiler = SamplingProfiler()
 
 while running:
     now = time.time()
@@ -195,41 +163,61 @@ while running:
         if event.type == pygame.QUIT:
             running = False
 
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_f:
+            show_field = not show_field
+            redraw = True
+
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_F9:
+            profiler.toggle("prof_manual")
+
         elif event.type == pygame.MOUSEBUTTONDOWN:
             # map mouse to cell and set impulse
-            x0, pos_y, grid_w, tile, y0 = draw_grid(grid_data)  # get geometry
+            x0, pos_y, grid_w, tile, y0 = draw_grid(state)  # get geometry
             mx, my = pygame.mouse.get_pos()
             j = (mx - x0) // tile
             i = (my - y0) // tile
             if 0 <= i < n and 0 <= j < m:
                 if event.button == 1:   # left click => negative
-                    grid_data[i, j] = [0.0, float(maxIntensity), time.time()]
+                    state.press(i, j, -maxIntensity)
                 elif event.button == 3: # right click => positive
-                    grid_data[i, j] = [float(maxIntensity), 0.0, time.time()]
-
-    update_decay(grid_data)
-    x0, pos_y, grid_w, _, _ = draw_grid(grid_data)
-    draw_table(grid_data, x0, pos_y, grid_w)
-
-    # build & show CSV (for 4x8 always valid)
-    A = get_output_matrix(grid_data)
-    csv_output_str = matrix_to_csv_string(A)
-
-    # send @10Hz
-    if ser and (now - last_sent) >= 0.1:
-        send_matrix_over_serial(A, ser)
+                    state.press(i, j, maxIntensity)
+                t_next = now
+            redraw = True
+
+    # recompose only at envelope breakpoints (or after a click)
+    changed = now >= t_next and (now - last_frame) >= send_dt
+    if changed:
+        update_decay(state)
+        t_next = state.next_transition(hold=HOLD_DURATION, total=DECAY_DURATION, now=now)
+        last_frame = now
+        redraw = True
+
+        # build & show CSV (for 4x8 always valid): pos,neg pairs straight from the int8 levels
+        line = state.csv_line()
+        csv_output_str = line.decode("ascii").strip()
+
+    if redraw:
+        x0, pos_y, grid_w, tile, y0 = draw_grid(state)
+        if show_field:
+            draw_field(state, x0, y0, tile)
+        draw_table(state, x0, pos_y, grid_w)
+        pygame.display.flip()
+        redraw = False
+
+    # send on change (at most SEND_HZ), keepalive in between
+    if ser and (changed or (now - last_sent) >= KEEPALIVE_S):
+        send_line_over_serial(state.csv_line(), ser)
         last_sent = now
 
         # read echo or MCU response if any
         if ser.in_waiting:
             try:
-                line = ser.readline().decode('utf-8', errors='ignore').strip()
-                if line:
-                    csv_input_str = line
+                reply = ser.readline().decode('utf-8', errors='ignore').strip()
+                if reply:
+                    csv_input_str = reply
             except Exception:
                 pass
 
-    pygame.display.flip()
     clock.tick(FPS)
 
 if ser:
@@ -1,6 +1,9 @@
 import pygame
 import numpy as np
-import serial
+import device_client
+import serial_manager
+from sampling_profiler import SamplingProfiler
+from waveforms import OscillatorBank
 import time
 
 # --- Constants ---
@@ -20,6 +23,13 @@ TEXT_COLOR = (255, 255, 255)
 TABLE_BG = (15, 15, 15)
 TABLE_GRID = (70, 70, 70)
 
+# viewport: mouse wheel = zoom, middle drag / arrow keys = pan, F = fit, S = summary max/mean
+VIEW_RECT = (10, 20, SCREEN_W - 20, SCREEN_H - 180)
+TILE_PX = 8            # below this many pixels per cell the view is a downsampled summary
+MAX_TILE_PX = 120
+PAN_STEP = 60          # pixels per arrow key press
+TABLE_ROWS, TABLE_COLS = 16, 32   # value table only when the visible region fits
+
 
 SERIAL_PORT = '/dev/cu.usbmodem1020BA0ABA902'
 
@@ -44,6 +54,7 @@ m_box = pygame.Rect(245, 200, BTN_SIZE, BTN_SIZE)
 
 #------ parameters of field control
 A = 10.0              # base amplitude for both axes
+field_amp = A         # kept separately: the main loop reuses A for the output matrix
 w = 2*np.pi*3    # angular frequency (1 Hz)
 duration = 4.0        # seconds
 fps = 30              # frames per second
@@ -67,14 +78,18 @@ def create_grid(n, m):
 
 grid_data = create_grid(n, m)
 
+fonts = {}
+
 def draw_text(surface, text, pos, center=False, size=36, color=TEXT_COLOR):
-    f = pygame.font.SysFont(None, size)
+    f = fonts.get(size)
+    if f is None:
+        f = fonts[size] = pygame.font.SysFont(None, size)
     img = f.render(str(text), True, color)
     rect = img.get_rect()
     if center:
         rect.center = pos
     else:
-        rect.topleft = po
+        rect.topleft = pos
     surface.blit(img, rect)
 
 def draw_setup_ui():
@@ -96,87 +111,171 @@ def draw_setup_ui():
     draw_text(screen, str(m), m_box.center, center=True)
     draw_text(screen, "Press ENTER to confirm", (50, 300))
 
-def get_dynamic_tile_size(n, m):
-    tile_size = min(
-        (SCREEN_W - 20) // m,
-        (SCREEN_H - 180) // n
-    )
-    return max(4, tile_size)
+class Viewport:
+    """Pan / zoom over an n x m grid drawn into VIEW_RECT; zoom = screen pixels per cell."""
+
+    def __init__(self, rect):
+        self.rect = pygame.Rect(rect)
+        self.summary = "max"          # per-pixel reduction when zoomed out: max or mean
+        self.fit(4, 8)
+
+    def fit(self, n, m):
+        self.n, self.m = n, m
+        z = min(self.rect.w / m, self.rect.h / n)
+        self.min_zoom = z
+        self.zoom = float(int(z)) if z >= 1 else z     # whole-pixel tiles like the old layout
+        self.px = self.py = None
+        self.clamp()
+
+    def clamp(self):
+        # centre an axis that fits, otherwise keep the grid covering the view
+        gw, gh = self.m * self.zoom, self.n * self.zoom
+        r = self.rect
+        if gw <= r.w:
+            self.px = r.x + (r.w - gw) / 2
+        else:
+            self.px = min(max(self.px if self.px is not None else r.x, r.right - gw), r.x)
+        if gh <= r.h:
+            self.py = r.y
+        else:
+            self.py = min(max(self.py if self.py is not None else r.y, r.bottom - gh), r.y)
+
+    def zoom_at(self, factor, sx, sy):
+        z = min(max(self.zoom * factor, self.min_zoom), MAX_TILE_PX)
+        cx, cy = (sx - self.px) / self.zoom, (sy - self.py) / self.zoom
+        self.zoom = z
+        self.px, self.py = sx - cx * z, sy - cy * z
+        self.clamp()
+
+    def pan(self, dx, dy):
+        self.px += dx
+        self.py += dy
+        self.clamp()
+
+    def visible(self):
+        """(i0, i1, j0, j1) cell ranges that intersect the view."""
+        r, z = self.rect, self.zoom
+        j0 = max(0, int(np.floor((r.x - self.px) / z)))
+        j1 = min(self.m, int(np.ceil((r.right - self.px) / z)))
+        i0 = max(0, int(np.floor((r.y - self.py) / z)))
+        i1 = min(self.n, int(np.ceil((r.bottom - self.py) / z)))
+        return i0, i1, j0, j1
+
+    def cell_at(self, pos):
+        if not self.rect.collidepoint(pos):
+            return None
+        j = int((pos[0] - self.px) // self.zoom)
+        i = int((pos[1] - self.py) // self.zoom)
+        return (i, j) if 0 <= i < self.n and 0 <= j < self.m else None
+
+    def bottom(self):
+        return int(min(self.rect.bottom, self.py + self.n * self.zoom))
+
+view = Viewport(VIEW_RECT)
+
+def make_color_lut():
+    # alpha tiles (alpha = clip(25.5 * level, 25, 255)) pre-blended onto BG_COLOR:
+    # 0..255 POS, 256..511 NEG, 512 empty cell
+    bg = np.array(BG_COLOR, dtype=float)
+    a = np.clip(np.arange(256), 25, 255)[:, None] / 255.0
+    return np.concatenate([bg + a * (np.array(POS_COLOR) - bg), bg + a * (np.array(NEG_COLOR) - bg),
+                           np.array([GRID_COLOR], dtype=float)]).astype(np.uint8)
+
+COLOR_LUT = make_color_lut()
+
+def level_colors(pos, neg):
+    """pos / neg levels (any shape) -> (..., 3) uint8 colours with one table lookup."""
+    idx = np.where(pos > 0, np.minimum(25.5 * pos, 255).astype(np.int16),
+                   np.where(neg > 0, 256 + np.minimum(25.5 * neg, 255).astype(np.int16), 512))
+    return COLOR_LUT[idx]
+
+def draw_summary(grid, i0, i1, j0, j1):
+    # f x f cells per image pixel, reduced by max or mean, then scaled to the view
+    f = max(1, int(np.ceil(1.0 / view.zoom - 1e-9)))   # image is never larger than the view
+    sub = grid[i0:i1, j0:j1, :2]
+    h, w = -(-(i1 - i0) // f), -(-(j1 - j0) // f)
+    if sub.shape[0] != h * f or sub.shape[1] != w * f:
+        sub = np.pad(sub, ((0, h * f - sub.shape[0]), (0, w * f - sub.shape[1]), (0, 0)))
+    red = sub[0::f, 0::f].copy()
+    for a in range(f):
+        for b in range(f):
+            if a or b:
+                if view.summary == "max":
+                    np.maximum(red, sub[a::f, b::f], out=red)
+                else:
+                    red += sub[a::f, b::f]
+    if view.summary == "mean":
+        red /= f * f
+    img = pygame.surfarray.make_surface(level_colors(red[..., 0], red[..., 1]).swapaxes(0, 1))
+    size = (max(1, int(round(w * f * view.zoom))), max(1, int(round(h * f * view.zoom))))
+    screen.blit(pygame.transform.scale(img, size), (int(view.px + j0 * view.zoom), int(view.py + i0 * view.zoom)))
+
+def draw_tiles(grid, i0, i1, j0, j1):
+    z = view.zoom
+    tile = max(1, int(z) - 2)
+    colors = level_colors(grid[i0:i1, j0:j1, 0], grid[i0:i1, j0:j1, 1])
+    for i in range(i0, i1):
+        y = int(view.py + i * z)
+        for j in range(j0, j1):
+            pygame.draw.rect(screen, colors[i - i0, j - j0], (int(view.px + j * z), y, tile, tile))
 
 def draw_grid(grid):
-    tile_size = get_dynamic_tile_size(n, m)
-    grid_w = m * tile_size
-    grid_h = n * tile_size
-    x_offset = (SCREEN_W - grid_w) // 2
-    y_offset = 20
-
     screen.fill(BG_COLOR)
-    for i in range(n):
-        for j in range(m):
-            x = x_offset + j * tile_size
-            y = y_offset + i * tile_size
-            pos_val, neg_val, _ = grid[i, j]
-            if pos_val > 0:
-                alpha = int(np.clip(25.5 * pos_val, 25, 255))
-                color = (*POS_COLOR, alpha)
-                rect_surf = pygame.Surface((tile_size - 2, tile_size - 2), pygame.SRCALPHA)
-                rect_surf.fill(color)
-                screen.blit(rect_surf, (x, y))
-            elif neg_val > 0:
-                alpha = int(np.clip(25.5 * neg_val, 25, 255))
-                color = (*NEG_COLOR, alpha)
-                rect_surf = pygame.Surface((tile_size - 2, tile_size - 2), pygame.SRCALPHA)
-                rect_surf.fill(color)
-                screen.blit(rect_surf, (x, y))
-            else:
-                pygame.draw.rect(screen, GRID_COLOR, (x, y, tile_size - 2, tile_size - 2))
-    return x_offset, y_offset + grid_h, grid_w
+    i0, i1, j0, j1 = view.visible()
+    screen.set_clip(view.rect)
+    if view.zoom >= TILE_PX:
+        draw_tiles(grid, i0, i1, j0, j1)
+    else:
+        draw_summary(grid, i0, i1, j0, j1)
+    screen.set_clip(None)
+    mode = "tiles" if view.zoom >= TILE_PX else f"summary ({view.summary})"
+    draw_text(screen, f"{n}x{m}  rows {i0}-{i1 - 1}  cols {j0}-{j1 - 1}  {view.zoom:.2f} px/cell  {mode}",
+              (10, 2), size=18, color=(180, 180, 180))
+    x0 = max(view.rect.x, int(view.px))
+    x1 = min(view.rect.right, int(view.px + m * view.zoom))
+    return x0, view.bottom(), x1 - x0
 
 def update_decay(grid):
     now = time.time()
-    for i in range(n):
-        for j in range(m):
-            pos_val, neg_val, t_start = grid[i, j]
-            if pos_val > 0 and t_start > 0:
-                elapsed = now - t_start
-                if elapsed < DECAY_DURATION:
-                    grid[i, j][0] = 10 * (1 - elapsed / DECAY_DURATION)
-                else:
-                    grid[i, j][0] = 0
-                    grid[i, j][2] = 0
-            if neg_val > 0 and t_start > 0:
-                elapsed = now - t_start
-                if elapsed < DECAY_DURATION:
-                    grid[i, j][1] = 10 * (1 - elapsed / DECAY_DURATION)
-                else:
-                    grid[i, j][1] = 0
-                    grid[i, j][2] = 0
+    t_start = grid[:, :, 2]
+    elapsed = now - t_start
+    live = elapsed < DECAY_DURATION
+    ramp = 10 * (1 - elapsed / DECAY_DURATION)
+    pos = (grid[:, :, 0] > 0) & (t_start > 0)
+    neg = (grid[:, :, 1] > 0) & (t_start > 0)
+    done = (pos | neg) & ~live
+    grid[:, :, 0] = np.where(pos, np.where(live, ramp, 0), grid[:, :, 0])
+    grid[:, :, 1] = np.where(neg, np.where(live, ramp, 0), grid[:, :, 1])
+    t_start[done] = 0
 
 def draw_table(grid, pos_x, pos_y, width):
+    # values of the visible region only
     table_top = pos_y + 10
     cell_h = 28
-    cell_w = max(width // max(m,1), 28)
-    if n > 16 or m > 32:
-        msg = f"Table display is limited to 16 x 32"
+    i0, i1, j0, j1 = view.visible()
+    rows, cols = i1 - i0, j1 - j0
+    if rows > TABLE_ROWS or cols > TABLE_COLS:
+        msg = f"Zoom in to {TABLE_ROWS} x {TABLE_COLS} cells for values ({rows} x {cols} visible)"
         draw_text(screen, msg, (SCREEN_W//2, table_top+30), center=True, size=32, color=(200,100,100))
         return
-    table_h = n * cell_h
-    pygame.draw.rect(screen, TABLE_BG, (pos_x, table_top, m*cell_w, table_h))
-    for i in range(n):
-        ry = table_top + i*cell_h + cell_h//2
-        draw_text(screen, i, (pos_x - 20, table_top + i*cell_h + 3), center=False, size=16, color=(200, 220, 180))
-        for j in range(m):
-            cx = pos_x + j*cell_w + cell_w//2
+    cell_w = max(width // max(cols,1), 28)
+    table_h = rows * cell_h
+    pygame.draw.rect(screen, TABLE_BG, (pos_x, table_top, cols*cell_w, table_h))
+    for i in range(i0, i1):
+        ry = table_top + (i-i0)*cell_h + cell_h//2
+        draw_text(screen, i, (pos_x - 20, table_top + (i-i0)*cell_h + 3), center=False, size=16, color=(200, 220, 180))
+        for j in range(j0, j1):
+            cx = pos_x + (j-j0)*cell_w + cell_w//2
             pos_val = int(round(grid[i,j][0]))
             neg_val = int(round(grid[i,j][1]))
             s = f"{pos_val}/{neg_val}"
             draw_text(screen, s, (cx, ry), center=True, size=16)
-    for i in range(n+1):
+    for i in range(rows+1):
         y = table_top + i*cell_h
-        pygame.draw.line(screen, TABLE_GRID, (pos_x, y), (pos_x + m*cell_w, y))
-    for j in range(m+1):
+        pygame.draw.line(screen, TABLE_GRID, (pos_x, y), (pos_x + cols*cell_w, y))
+    for j in range(cols+1):
         x = pos_x + j*cell_w
-        pygame.draw.line(screen, TABLE_GRID, (x, table_top), (x, table_top + n*cell_h))
+        pygame.draw.line(screen, TABLE_GRID, (x, table_top), (x, table_top + rows*cell_h))
 
 def get_output_matrix(grid):
     arr = np.round(grid[:, :, :2]).astype(int).reshape(-1, 2)
@@ -234,26 +333,36 @@ def send_matrix_over_serial(matrix: np.ndarray, ser):
     except Exception as e:
         print(f"Serial error: {e}")
 
-def magnetOutputField(grid_data,t_start): ## governing equation added by dapeng 
-    t = time.time()-t_start
-    for i in range(n):
-        for j in range(m):
-            grid_data[i,j][0] = np.maximum(Ax[0,i]*np.sin(w*t + phix[0,i]) + Ay[0,j]*np.sin(w*t + phiy[0,j]),0)            
-            grid_data[i,j][1] = -1*np.minimum(Ax[0,i]*np.sin(w*t + phix[0,i]) + Ay[0,j]*np.sin(w*t + phiy[0,j]),0)
+field_bank = None     # wavetable oscillators: one per row, then one per column
+
+def make_field_bank(rows, cols, amp):
+    # same w, phix, phiy as above, sized to the current grid (phase in cycles = phi / 2pi)
+    phase = np.concatenate([np.arange(rows)/(2*rows), np.arange(cols)/(2*cols)])
+    return OscillatorBank(rows + cols, "sine", freq=w/(2*np.pi), phase=phase, amp=amp)
+
+def magnetOutputField(grid_data,t_start,amp): ## governing equation added by dapeng 
+    global field_bank
+    rows, cols = grid_data.shape[:2]
+    if field_bank is None or field_bank.count != rows + cols:
+        field_bank = make_field_bank(rows, cols, amp)
+    v = field_bank.at(time.time()-t_start)           # one table lookup per row / column
+    s = v[:rows, None] + v[None, rows:]               # Ax_i sin(wt + phix_i) + Ay_j sin(wt + phiy_j)
+    grid_data[:, :, 0] = np.maximum(s, 0)
+    grid_data[:, :, 1] = -np.minimum(s, 0)
 
 
-ser = None
-try:
-    ser = serial.Serial(SERIAL_PORT, SERIAL_BAUD, timeout=0)
-    time.sleep(2)
-except Exception as e:
-    print(f"Serial open error: {e}")
+ser = device_client.connect()   # running device_daemon.py skips the port-open reset
+if ser is None:
+    ser = serial_manager.open_managed([SERIAL_PORT], SERIAL_BAUD)
+    if ser is None:
+        print("Serial not found; running without serial output.")
 
 csv_input_str = ""
 csv_output_str = ""  
 last_sent = time.time()
 
 running = True
+profiler = SamplingProfiler()
 counter = 0
 while running:
     now = time.time()
@@ -277,23 +386,32 @@ while running:
         elif event.type == pygame.KEYDOWN:
             if setting_grid and event.key == pygame.K_RETURN:
                 grid_data = create_grid(n, m)
+                view.fit(n, m)
                 setting_grid = False
+            elif event.key == pygame.K_F9:
+                profiler.toggle("prof_mat_csv")
+            elif not setting_grid and event.key == pygame.K_f:
+                view.fit(n, m)
+            elif not setting_grid and event.key == pygame.K_s:
+                view.summary = "mean" if view.summary == "max" else "max"
+            elif not setting_grid and event.key in (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN):
+                dx = PAN_STEP * ((event.key == pygame.K_LEFT) - (event.key == pygame.K_RIGHT))
+                dy = PAN_STEP * ((event.key == pygame.K_UP) - (event.key == pygame.K_DOWN))
+                view.pan(dx, dy)
+        elif event.type == pygame.MOUSEWHEEL and not setting_grid:
+            view.zoom_at(1.25 ** event.y, *pygame.mouse.get_pos())
+        elif event.type == pygame.MOUSEMOTION and not setting_grid and event.buttons[1]:
+            view.pan(*event.rel)
         elif event.type == pygame.MOUSEBUTTONDOWN and not setting_grid:
-            tile_size = get_dynamic_tile_size(n, m)
-            grid_w = m * tile_size
-            grid_h = n * tile_size
-            x_offset = (SCREEN_W - grid_w) // 2
-            y_offset = 20
-            mx, my = pygame.mouse.get_pos() #Click to get item1
-            j = (mx - x_offset) // tile_size
-            i = (my - y_offset) // tile_size
-            if 0 <= i < n and 0 <= j < m:
+            cell = view.cell_at(event.pos)   #Click to get item1
+            if cell is not None:
+                i, j = cell
                 if event.button == 1:
                     grid_data[i, j] = [0, 10, time.time()]
                 elif event.button == 3:
                     grid_data[i, j] = [10, 0, time.time()]
     
-    magnetOutputField(grid_data,t_start)
+    magnetOutputField(grid_data,t_start,field_amp)
     if setting_grid:
         draw_setup_ui()
     else:
@@ -0,0 +1,161 @@
+# SAM LAB, D H HAN
+# Multi-robot herding: one distance field per robot, Voronoi zones, parallel band schedules
+#
+# pixel_art_distance_transform.py pulls everything toward the nearest cell of ONE target
+# set. Here every robot r has its own target cells:
+#   D[r]  : 4-neighbour distance of every cell to robot r's targets, all robots at once
+#           (stacked (R, n, m) wavefronts, -1 = unreachable)
+#   zone  : each cell belongs to the robot whose targets are nearest (Voronoi on D;
+#           ties -> lower robot index, -1 = reachable by nobody)
+#   Dz    : distance to the owning robot's targets (D gathered by zone)
+# and every zone runs the usual band schedule (outside -> inside, pulse_dt per band,
+# optional overlap, final hold on the targets) at the same time, each from its own
+# outermost band. A frame is a handful of (n, m) array ops plus an (R,)-sized schedule
+# lookup gathered through `zone`, so adding robots does not add per-frame work.
+#
+# Obstacles: `blocked` (n, m) marks cells that can't be crossed or driven (damaged
+# coils, physical obstacles, keep-out zones). Distances are geodesic: the wavefronts
+# never enter blocked cells, so bands route around them. Cells that no target can
+# reach (blocked, or walled off) get distance -1 / zone -1 and are never driven --
+# they do not fall into any band. set_blocked() redoes the fields in well under a
+# millisecond on the 4 x 8 array, so the mask can change mid-run.
+#
+# Levels follow pattern_spec: signed PWM units, + POS / - NEG, intensity -1 = NEG attracts.
+#
+# Usage:
+#   herd = MultiHerd([mask_robot0, mask_robot1], level=-10, pulse_dt=6)
+#   levels = herd.evaluate(t)                  # (n, m) signed, t = seconds since start
+#   times, frames = herd.segments()            # piecewise-constant table (pattern_spec)
+
+import numpy as np
+
+REPEL_MODES = ("none", "outside_band", "complement")
+ATTRACT_MODES = ("band", "target")
+
+
+def distance_fields(target_masks, blocked=None):
+    """
+    (R, n, m) bool targets -> (R, n, m) int geodesic 4-neighbour distances, -1 where unreachable.
+    Blocked cells (n, m) are never entered (and are never targets).
+    """
+    T = np.asarray(target_masks, dtype=bool)
+    free = None
+    if blocked is not None:
+        free = ~np.asarray(blocked, dtype=bool)
+        T = T & free
+    D = np.full(T.shape, -1, dtype=int)
+    D[T] = 0
+    front = T.copy()
+    k = 0
+    while front.any():
+        k += 1
+        grow = np.zeros_like(front)
+        grow[:, 1:, :] |= front[:, :-1, :]
+        grow[:, :-1, :] |= front[:, 1:, :]
+        grow[:, :, 1:] |= front[:, :, :-1]
+        grow[:, :, :-1] |= front[:, :, 1:]
+        front = grow & (D < 0)
+        if free is not None:
+            front &= free
+        D[front] = k
+    return D
+
+
+def partition(D):
+    """(R, n, m) distances -> (zone (n, m) robot index or -1, Dz (n, m) distance within the zone or -1)."""
+    big = np.iinfo(D.dtype).max
+    Dinf = np.where(D < 0, big, D)
+    zone = np.argmin(Dinf, axis=0)
+    Dz = np.take_along_axis(D, zone[None], axis=0)[0]
+    zone[Dz < 0] = -1
+    return zone, Dz
+
+
+class MultiHerd:
+    def __init__(self, target_masks, level=-10.0, pulse_dt=6.0, overlap=True, overlap_hold=None,
+                 final_hold=True, attract="band", repel_mode="none", repel_level=0.0, blocked=None):
+        if attract not in ATTRACT_MODES:
+            raise ValueError(f"attract must be one of {ATTRACT_MODES}, got {attract!r}")
+        if repel_mode not in REPEL_MODES:
+            raise ValueError(f"repel_mode must be one of {REPEL_MODES}, got {repel_mode!r}")
+        T = np.asarray(target_masks, dtype=bool)
+        if T.ndim == 2:
+            T = T[None]
+        self.targets = T
+        self.R, self.n, self.m = T.shape
+        self.set_blocked(blocked)
+        self.level = float(level)
+        self.repel_level = -np.copysign(abs(float(repel_level)), self.level) if repel_mode != "none" else 0.0
+        self.pulse_dt = float(pulse_dt)
+        self.overlap = bool(overlap)
+        self.overlap_hold = self.pulse_dt / 2 if overlap_hold is None else float(overlap_hold)
+        self.final_hold = bool(final_hold)
+        self.attract = attract
+        self.repel_mode = repel_mode
+
+    def set_blocked(self, blocked=None):
+        """(Re)compute the geodesic fields and zones for a new obstacle mask (None = no obstacles)."""
+        self.blocked = np.zeros((self.n, self.m), dtype=bool) if blocked is None else np.asarray(blocked, dtype=bool)
+        self.D = distance_fields(self.targets, self.blocked)
+        self.zone, self.Dz = partition(self.D)
+        self.reachable = self.zone >= 0
+        self.target = self.targets.any(axis=0) & ~self.blocked
+        owned = self.zone[None] == np.arange(self.R)[:, None, None]
+        self.dmax = np.where(owned, self.Dz[None], -1).reshape(self.R, -1).max(axis=1)   # (R,) outermost band, -1 = none
+        self._zone = np.where(self.zone < 0, self.R, self.zone)   # -1 -> sentinel slot R
+
+    def schedule(self, t):
+        """(R,) current band per robot (-1 once done) and (R,) overlap flags."""
+        s = int(t // self.pulse_dt)
+        k = np.maximum(self.dmax - s, -1)
+        ov = np.full(self.R, self.overlap and (t - s * self.pulse_dt) < self.overlap_hold)
+        return k, ov
+
+    def frame(self, k, ov, out=None):
+        """Signed (n, m) frame for per-robot bands k (R,) and overlap flags ov (R,)."""
+        kk = np.append(k, -2)[self._zone]          # band of the cell's zone; -2 = no zone
+        oo = np.append(ov, False)[self._zone]
+        Dz = self.Dz
+        herding = kk >= 0
+        done = (kk == -1) & self.final_hold
+        band = herding & ((Dz == kk) | (oo & (kk > 0) & (Dz == kk - 1)))
+        attract = (band if self.attract == "band" else herding & self.target) | (done & self.target)
+        if self.repel_mode == "complement":
+            repel = (herding | done) & ~self.target
+        elif self.repel_mode == "outside_band":
+            repel = ((herding & (Dz >= kk + 1)) | (done & (Dz >= 1))) & ~self.target
+        else:
+            repel = None
+        if out is None:
+            out = np.zeros((self.n, self.m))
+        else:
+            out.fill(0.0)
+        if repel is not None:
+            out[repel] = self.repel_level
+        out[attract] = self.level
+        return out
+
+    def evaluate(self, t, out=None):
+        if t < 0:
+            if out is None:
+                return np.zeros((self.n, self.m))
+            out.fill(0.0)
+            return out
+        k, ov = self.schedule(t)
+        return self.frame(k, ov, out)
+
+    def duration(self):
+        """Seconds until every zone has reached its targets."""
+        return (max(int(self.dmax.max()), 0) + 1) * self.pulse_dt
+
+    def segments(self):
+        """
+        The whole schedule as a piecewise-constant table: (start times (S,), frames (S, n, m)).
+        Frame s is valid from times[s] until times[s+1] (the last one forever).
+        """
+        steps = max(int(self.dmax.max()), 0) + 2
+        times = [s * self.pulse_dt for s in range(steps)]
+        if self.overlap and 0 < self.overlap_hold < self.pulse_dt:
+            times += [s * self.pulse_dt + self.overlap_hold for s in range(steps - 1)]
+        times = np.array(sorted(set(times)))
+        return times, np.stack([self.evaluate(t) for t in times])
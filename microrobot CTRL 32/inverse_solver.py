@@ -0,0 +1,166 @@
+# SAM LAB, D H HAN
+# Inverse solver: desired force (or field) at robot positions -> bounded signed coil commands
+#
+# Forces and fields are linear in the coil levels (microrobot_sim / field_basis model):
+#   velocity at p  = A(p) @ levels,   A(p) = Simulator.response(p)   (2 rows per robot)
+#   Bz at q        = bz_matrix(q) @ levels                          (1 row per point)
+# so a command is the solution of a small ridge problem with box bounds
+#   min 1/2 |A l - b|^2 + 1/2 lam |l|^2    s.t.  -pwm_max <= l <= pwm_max
+#
+# - solve_pinv(): cached regularized pseudo-inverse  l = A^T (A A^T + lam I)^-1 b, clipped.
+#   The (C x rows) operator is cached per position quantized to CACHE_RES mm, so a
+#   robot that holds still costs one small mat-vec per frame.
+# - solve(): exact bounded least squares (FISTA / projected gradient), warm-started
+#   from the previous command. When the ridge solution is inside the bounds it is
+#   returned as is.
+# Both are far below a 10 Hz send period (see `python inverse_solver.py` for timings).
+#
+# Usage:
+#   solver = ForceSolver(Simulator(4, 8))
+#   levels = solver.solve(robot_xy, desired_velocity)       # (32,) float, PWM units
+#   levels.reshape(4, 8) -> pattern_spec.get_output_matrix() / DeviceClient.send_levels()
+
+import argparse
+import collections
+import time
+
+import numpy as np
+
+from field_basis import bz_matrix
+from microrobot_sim import Simulator, PWM_MAX
+
+# ================== Config ==================
+REG = 1e-3                 # ridge weight, relative to the mean squared row norm of A
+CACHE_RES = 0.5            # mm: positions are quantized to this for the pinv cache
+CACHE_SIZE = 4096          # cached operators (LRU)
+MAX_ITER = 200             # FISTA iterations (warm starts usually need a handful)
+TOL = 1e-4                 # stop when the command changes less than this (PWM units)
+# ================== Config ==================
+
+
+class ForceSolver:
+    def __init__(self, sim, pwm_max=PWM_MAX, reg=REG, cache_res=CACHE_RES):
+        self.sim = sim
+        self.pwm_max = float(pwm_max)
+        self.reg = float(reg)
+        self.cache_res = float(cache_res)
+        self.cache = collections.OrderedDict()
+        self.last = None               # previous command, warm start of solve()
+        self.iters = 0                 # FISTA iterations used by the last solve()
+
+    # ----- system matrices -----
+    def force_matrix(self, positions):
+        """Robot positions (R, 2) mm -> (2R, C) velocity per unit level."""
+        pos = np.asarray(positions, dtype=float).reshape(-1, 2)
+        return self.sim.response(pos).reshape(-1, self.sim.n * self.sim.m)
+
+    def field_matrix(self, points):
+        """Points (k, 2) mm -> (k, C) Bz per unit level."""
+        return bz_matrix(points, self.sim.n, self.sim.m, self.sim.pitch, np.sqrt(self.sim.h2))
+
+    def _lam(self, A):
+        return self.reg * max(float((A * A).sum()) / A.shape[0], 1e-30)
+
+    # ----- cached pseudo-inverse -----
+    def pinv(self, positions):
+        """Regularized pseudo-inverse of force_matrix at the quantized positions (cached)."""
+        q = np.round(np.asarray(positions, dtype=float).reshape(-1, 2) / self.cache_res).astype(int)
+        key = q.tobytes()
+        M = self.cache.get(key)
+        if M is not None:
+            self.cache.move_to_end(key)
+            return M
+        A = self.force_matrix(q * self.cache_res)
+        G = A @ A.T
+        G[np.diag_indices_from(G)] += self._lam(A)
+        M = np.linalg.solve(G, A).T                      # A^T (A A^T + lam I)^-1
+        self.cache[key] = M
+        if len(self.cache) > CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return M
+
+    def solve_pinv(self, positions, forces):
+        """Fast path: cached pseudo-inverse, then clip to the PWM bounds."""
+        l = self.pinv(positions) @ np.asarray(forces, dtype=float).ravel()
+        return np.clip(l, -self.pwm_max, self.pwm_max)
+
+    # ----- bounded least squares -----
+    def solve_bounded(self, A, b, warm=None):
+        """min 1/2|A l - b|^2 + 1/2 lam |l|^2 in the PWM box (FISTA, warm-started)."""
+        b = np.asarray(b, dtype=float).ravel()
+        lam = self._lam(A)
+        G = A @ A.T
+        G[np.diag_indices_from(G)] += lam
+        l = A.T @ np.linalg.solve(G, b)                  # unconstrained ridge solution
+        if np.abs(l).max() <= self.pwm_max:
+            self.iters = 0
+            return l
+
+        H = A.T @ A
+        H[np.diag_indices_from(H)] += lam
+        g0 = A.T @ b
+        step = 1.0 / np.linalg.eigvalsh(G)[-1]           # 1 / Lipschitz constant
+        x = np.clip(l if warm is None else warm, -self.pwm_max, self.pwm_max)
+        y, t = x.copy(), 1.0
+        for it in range(1, MAX_ITER + 1):
+            x_new = np.clip(y - step * (H @ y - g0), -self.pwm_max, self.pwm_max)
+            t_new = 0.5 * (1.0 + np.sqrt(1.0 + 4.0 * t * t))
+            y = x_new + ((t - 1.0) / t_new) * (x_new - x)
+            done = np.abs(x_new - x).max() < TOL
+            x, t = x_new, t_new
+            if done:
+                break
+        self.iters = it
+        return x
+
+    def solve(self, positions, forces, warm=True):
+        """Desired velocity (R, 2) mm/s at robot positions (R, 2) -> bounded command (C,)."""
+        A = self.force_matrix(positions)
+        l = self.solve_bounded(A, forces, self.last if warm else None)
+        self.last = l
+        return l
+
+    def solve_field(self, points, values, warm=True):
+        """Desired Bz (unit-level basis units) at points (k, 2) -> bounded command (C,)."""
+        A = self.field_matrix(points)
+        l = self.solve_bounded(A, values, self.last if warm else None)
+        self.last = l
+        return l
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Closed-loop demo: steer one simulated robot with the inverse solver")
+    ap.add_argument("--start", default="5,5", help="start position x,y [mm]")
+    ap.add_argument("--target", default="2,4", help="target cell ROW,COL (1-based, left-bottom)")
+    ap.add_argument("--hz", type=float, default=10.0, help="command rate")
+    ap.add_argument("--duration", type=float, default=20.0)
+    ap.add_argument("--gain", type=float, default=1.0, help="desired velocity per mm of error [1/s]")
+    ap.add_argument("--pinv", action="store_true", help="use the cached pseudo-inverse instead of bounded LS")
+    args = ap.parse_args()
+
+    sim = Simulator(4, 8, diffusion=0.0)
+    solver = ForceSolver(sim)
+    r, c = (int(v) for v in args.target.split(","))
+    target = np.array([(c - 0.5) * sim.pitch, (r - 0.5) * sim.pitch])
+    pos = np.array([[float(v) for v in args.start.split(",")]])
+
+    times = []
+    steps = max(1, int(round(1.0 / (args.hz * 0.01))))
+    for k in range(int(args.duration * args.hz)):
+        want = args.gain * (target - pos[0])
+        t0 = time.perf_counter()
+        lv = solver.solve_pinv(pos, want) if args.pinv else solver.solve(pos, want)
+        times.append(time.perf_counter() - t0)
+        lv = np.round(lv)                                # device takes integer levels
+        for _ in range(steps):
+            pos = sim.step(pos, lv, 0.01)
+        if k % int(args.hz) == 0:
+            print(f"t={k / args.hz:5.1f}s  pos=({pos[0, 0]:5.1f},{pos[0, 1]:5.1f})  "
+                  f"err={np.linalg.norm(target - pos[0]):5.2f} mm  iters={solver.iters}")
+    t = 1e3 * np.array(times)
+    print(f"solve time p50 {np.percentile(t, 50):.3f} ms  p99 {np.percentile(t, 99):.3f} ms  "
+          f"(send period {1e3 / args.hz:.0f} ms)  final error {np.linalg.norm(target - pos[0]):.2f} mm")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+# SAM LAB, D H HAN
+# Load generator: end-to-end throughput / latency of the send path at increasing frame rates
+#
+# Drives synthetic frames open-loop (fixed schedule, not paced by replies) at each
+# rate step and correlates the replies with FrameLink (frame_link.py):
+#   --ack   : "@seq,..." frames, matched by sequence number (ack firmware)
+#   default : legacy CSV frames, matched in order against the full-line echo
+# Per step it reports offered / sent / confirmed frames per second, p50 / p99 / max
+# round trip and loss (frames never confirmed within the ack timeout). The saturation
+# point is the first step that cannot keep up: throughput < SAT_THROUGHPUT of the
+# offered rate, loss > SAT_LOSS, p99 above SAT_P99_FACTOR x the lowest step's p99, or
+# a write that blocked longer than WRITE_TIMEOUT (the device stopped taking bytes).
+# Replies are drained by a reader thread while the sender runs, so a device blocked on
+# its own echo write can never deadlock against a host blocked in ser.write().
+#
+# Patterns:
+#   toggle : every coil flips +max / -max each frame -> all 64 channels change (worst case)
+#   random : random signed levels each frame
+#   static : the same frame every time (best case for the firmware's changed-channel path)
+#
+# Usage:
+#   python loadgen.py --emulator --realtime                # in-process pico_emulator on a pty
+#   python loadgen.py --port /dev/ttyACM0 --ack --rates 10,20,50,100,200,400
+#   python loadgen.py --emulator --legacy --pattern toggle -o steps.json
+
+import argparse
+import json
+import threading
+import time
+
+import numpy as np
+import serial
+
+from frame_codec import levels_to_csv_line
+from frame_link import FrameLink, SEQ_MOD
+import pico_emulator
+import port_discovery
+
+# ================== Config ==================
+SERIAL_BAUD = 115200
+N_COILS = 32
+PWM_MAX = 10
+RATES = [10, 20, 50, 100, 200, 300, 500, 800, 1200]
+STEP_SECONDS = 3.0
+ACK_TIMEOUT = 1.0          # frames without a reply after this are lost
+WRITE_TIMEOUT = 0.5        # a write blocked this long -> the step is saturated
+READ_TIMEOUT = 0.005       # reader thread poll interval
+SAT_THROUGHPUT = 0.95
+SAT_LOSS = 0.01
+SAT_P99_FACTOR = 3.0
+PATTERNS = ("toggle", "random", "static")
+# ================== Config ==================
+
+
+class RecordingLink(FrameLink):
+    """
+    FrameLink that keeps every round trip of the step (not just the last RTT_HISTORY).
+    Replies are read by a reader thread (start_reader); the bookkeeping is shared under
+    a lock, the write itself happens outside it so the reader keeps draining meanwhile.
+    """
+
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+        self.all_rtts = []
+        self.t_last = 0.0          # arrival of the newest reply
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.reader = None
+
+    def record_rtt(self, rtt):
+        super().record_rtt(rtt)
+        self.all_rtts.append(rtt)
+        self.t_last = time.monotonic()
+
+    def send(self, levels, force=False):
+        """Register the frame as in flight, then write it (may raise SerialTimeoutException)."""
+        body = levels_to_csv_line(levels)
+        with self.lock:
+            seq = self.seq
+            self.seq = (self.seq + 1) % SEQ_MOD
+            self.inflight[seq] = (time.monotonic(), None if self.ack else body.strip())
+            self.sent += 1
+        self.ser.write(b"@%d," % seq + body if self.ack else body)
+        return seq
+
+    def start_reader(self):
+        def run():
+            while not self.done.is_set():
+                try:
+                    data = self.ser.read(self.ser.in_waiting or 1)
+                except (OSError, serial.SerialException):
+                    break
+                with self.lock:
+                    self.process(data)
+
+        self.reader = threading.Thread(target=run, name="loadgen-reader", daemon=True)
+        self.reader.start()
+
+    def stop_reader(self):
+        self.done.set()
+        if self.reader is not None:
+            self.reader.join()
+
+    def pending(self):
+        with self.lock:
+            self.expire()
+            return len(self.inflight)
+
+
+def make_frames(pattern, count=64, n_coils=N_COILS, pwm_max=PWM_MAX, seed=0):
+    """A cycle of `count` signed frames (int, PWM units) for the pattern."""
+    if pattern == "toggle":
+        return np.array([np.full(n_coils, pwm_max if k % 2 == 0 else -pwm_max) for k in range(count)])
+    if pattern == "random":
+        return np.random.default_rng(seed).integers(-pwm_max, pwm_max + 1, size=(count, n_coils))
+    return np.full((count, n_coils), pwm_max // 2)
+
+
+def run_step(ser, rate, frames, seconds, ack, ack_timeout=ACK_TIMEOUT):
+    """Send at `rate` Hz for `seconds`, then wait out the replies. Returns the step's stats dict."""
+    ser.reset_input_buffer()
+    link = RecordingLink(ser, window=1 << 30, ack_timeout=ack_timeout, ack=ack)
+    period = 1.0 / rate
+    link.start_reader()
+    t0 = time.monotonic()
+    end = t0 + seconds
+    next_t = t0
+    k = 0
+    late = 0.0
+    blocked = False
+    while True:
+        now = time.monotonic()
+        if now >= end:
+            break
+        if now >= next_t:
+            late = max(late, now - next_t)
+            try:
+                link.send(frames[k % len(frames)])
+            except serial.SerialTimeoutException:
+                blocked = True             # the device stopped taking bytes: saturated
+                break
+            k += 1
+            next_t += period
+            continue
+        time.sleep(min(next_t - now, 0.0005))
+    t_send = time.monotonic() - t0
+    if blocked:
+        ser.reset_output_buffer()          # drop the half-written line
+    drain_end = time.monotonic() + ack_timeout
+    while link.pending() and time.monotonic() < drain_end:
+        time.sleep(0.001)
+    link.stop_reader()
+    lost = link.lost + len(link.inflight)
+    t_conf = max(t_send, link.t_last - t0)     # replies still trickling in after the last send count too
+    r = 1e3 * np.asarray(link.all_rtts) if link.all_rtts else np.full(1, np.nan)
+    return {
+        "rate": rate, "sent": link.sent, "acked": link.acked, "lost": lost,
+        "mismatched": link.mismatched,
+        "send_hz": link.sent / t_send, "throughput_hz": link.acked / t_conf,
+        "loss": lost / max(link.sent, 1),
+        "rtt_ms_p50": float(np.percentile(r, 50)), "rtt_ms_p99": float(np.percentile(r, 99)),
+        "rtt_ms_max": float(np.max(r)), "max_send_late_ms": 1e3 * late, "write_blocked": blocked,
+    }
+
+
+def saturated(step, base_p99):
+    return (step["write_blocked"] or step["throughput_hz"] < SAT_THROUGHPUT * step["rate"] or step["loss"] > SAT_LOSS
+            or not step["rtt_ms_p99"] <= SAT_P99_FACTOR * max(base_p99, 1.0))
+
+
+def start_emulator(args):
+    """pico_emulator on a pty served from a daemon thread -> slave path."""
+    bus = pico_emulator.PCA9685Bus(fast_path=not args.legacy,
+                                   bus_hz=pico_emulator.BUS_HZ_FMPLUS if args.fmplus else pico_emulator.BUS_HZ)
+    emu = pico_emulator.PicoEmulator(bus, delay=args.delay / 1000.0, realtime=args.realtime)
+    mfd, sfd, path = pico_emulator.open_pty()
+
+    def serve():
+        try:
+            while True:
+                pico_emulator.pump(emu, mfd)
+                emu.frame_log.clear()
+        except OSError:
+            pass
+
+    threading.Thread(target=serve, daemon=True).start()
+    return path
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Throughput / latency load test of the frame send path")
+    ap.add_argument("--port", default=None, help="serial port of the board")
+    ap.add_argument("--emulator", action="store_true", help="test against an in-process pico_emulator")
+    ap.add_argument("--legacy", action="store_true", help="emulator: old 64 x setPWM() firmware path")
+    ap.add_argument("--fmplus", action="store_true", help="emulator: 1 MHz I2C")
+    ap.add_argument("--realtime", action="store_true", help="emulator: spend the modeled I2C time per frame")
+    ap.add_argument("--delay", type=float, default=0.0, help="emulator: extra processing per line [ms]")
+    ap.add_argument("--ack", action="store_true", help="sequenced frames + acks instead of the legacy echo")
+    ap.add_argument("--pattern", choices=PATTERNS, default="toggle")
+    ap.add_argument("--rates", default=",".join(str(r) for r in RATES), help="comma separated frames/s steps")
+    ap.add_argument("--seconds", type=float, default=STEP_SECONDS, help="duration of each step")
+    ap.add_argument("--keep-going", action="store_true", help="run all steps even after saturation")
+    ap.add_argument("-o", "--out", default=None, help="write the step results as JSON")
+    args = ap.parse_args()
+
+    if args.emulator:
+        path = start_emulator(args)
+        ser = serial.Serial(path, SERIAL_BAUD, timeout=READ_TIMEOUT, write_timeout=WRITE_TIMEOUT)
+    elif args.port:
+        # plain port (no reconnect manager: an outage should show up in the numbers)
+        ser = port_discovery.open_device([args.port], SERIAL_BAUD)
+        if ser is None:
+            ap.error(f"no board answered on {args.port}")
+        ser.timeout, ser.write_timeout = READ_TIMEOUT, WRITE_TIMEOUT
+    else:
+        ap.error("give --port or --emulator")
+
+    frames = make_frames(args.pattern)
+    rates = [float(r) for r in args.rates.split(",")]
+    print(f"{'rate':>7} {'sent/s':>8} {'conf/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'loss':>7}")
+    steps, sat, base_p99 = [], None, None
+    try:
+        for rate in rates:
+            st = run_step(ser, rate, frames, args.seconds, args.ack)
+            steps.append(st)
+            base_p99 = st["rtt_ms_p99"] if base_p99 is None else base_p99
+            bad = saturated(st, base_p99)
+            print(f"{rate:7.0f} {st['send_hz']:8.1f} {st['throughput_hz']:8.1f} {st['rtt_ms_p50']:8.2f} "
+                  f"{st['rtt_ms_p99']:8.2f} {st['rtt_ms_max']:8.2f} {100 * st['loss']:6.1f}%"
+                  + ("  <- saturated" if bad else "") + (" (write blocked)" if st["write_blocked"] else ""))
+            if bad and sat is None:
+                sat = st
+                if not args.keep_going:
+                    break
+            time.sleep(0.2)    # let the device queue empty between steps
+    except KeyboardInterrupt:
+        pass
+    finally:
+        try:
+            ser.write(levels_to_csv_line(np.zeros(N_COILS, dtype=int)))
+            ser.close()
+        except Exception:
+            pass
+
+    ok = [s for s in steps if s is not sat and (sat is None or s["rate"] < sat["rate"])]
+    if sat is None:
+        print(f"No saturation up to {steps[-1]['rate']:.0f} frames/s" if steps else "No steps run")
+    else:
+        best = ok[-1]["throughput_hz"] if ok else 0.0
+        print(f"Saturation at {sat['rate']:.0f} frames/s offered "
+              f"(confirmed {sat['throughput_hz']:.1f}/s); highest clean step {best:.1f} frames/s")
+    if args.out:
+        with open(args.out, "w") as fh:
+            json.dump({"pattern": args.pattern, "ack": args.ack, "steps": steps,
+                       "saturation_hz": None if sat is None else sat["rate"]}, fh, indent=1)
+        print("Saved", args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 #include <Wire.h>
 #include <Adafruit_PWMServoDriver.h>
+#include <pico/unique_id.h>
 
 // SAM Lab, D. H. Han
 // 04/15/2026
@@ -9,14 +10,26 @@
 //
 // INPUT:
 //   - CSV data received line by line over Serial
+//   - Optional sequence number: "@<seq>,v0,v1,...,v63" (see frame_link.py)
+//   - "?" : identification query (see port_discovery.py), does not touch the PWM outputs
 //
 // OUTPUT:
 //   - I2C commands sent to PCA9685 drivers
-//   - Serial echo for communication validation
+//   - Plain CSV line: serial echo for communication validation (legacy)
+//   - "@<seq>," line : short ack "!<seq>,<status>" after the PWM update
+//                      status 0 = ok, 1 = fewer than 64 values received
+//   - "?"              : "#ID,pwm32,<board id>", board id = flash unique id (hex)
 //
 // Communication:
 //   - I2C sends data to each PCA9685 address
 //   - Each PCA9685 provides 16 PWM output channels
+//   - Only channels whose value changed since the last frame are written; runs of
+//     adjacent changed channels go out as ONE auto-increment block write
+//     (LEDn_ON_L.. registers, 4 bytes per channel) instead of one setPWM() each.
+//     An unchanged frame costs no I2C traffic at all (see pico_emulator.py for the
+//     transaction counts).
+//   - I2C_FAST_MODE_PLUS 1 runs the bus at 1 MHz (PCA9685 supports Fm+; check the
+//     pull-ups / wiring before enabling)
 
 // Instantiate four PCA9685 drivers with different I2C addresses
 // Change addresses if needed
@@ -26,6 +39,17 @@ Adafruit_PWMServoDriver pwm2(0x43); // 000011
 Adafruit_PWMServoDriver pwm3(0x44); // 000100
 Adafruit_PWMServoDriver pwm4(0x45); // 000101
 
+const uint8_t pcaAddr[4] = {0x42, 0x43, 0x44, 0x45};
+
+#define I2C_FAST_MODE_PLUS 0   // 1: 1 MHz bus clock, 0: 400 kHz
+#define MAX_BLOCK_CH 7         // channels per block write: 2 + 4*7 = 30 bytes fits a 32-byte Wire buffer
+
+const uint8_t PCA_MODE1 = 0x00;
+const uint8_t PCA_MODE1_AI = 0x20;   // register auto-increment
+const uint8_t PCA_LED0_ON_L = 0x06;
+
+int lastPwm[64];               // last value written per channel, -1 = unknown (forces a write)
+
 void setup() {
   Serial.begin(115200);  // Start serial communication
 
@@ -33,7 +57,11 @@ void setup() {
   Wire.setSDA(4);        // GP4
   Wire.setSCL(5);        // GP5
   Wire.begin();          // Initialize I2C
+#if I2C_FAST_MODE_PLUS
+  Wire.setClock(1000000); // Fast-mode Plus, 1 MHz
+#else
   Wire.setClock(400000); // Set I2C clock to 400 kHz
+#endif
 
   // Initialize all PWM drivers
   pwm1.begin();
@@ -41,9 +69,38 @@ void setup() {
   pwm3.begin();
   pwm4.begin();
 
+  // begin() already sets auto-increment; make sure the block writes rely on it
+  for (int g = 0; g < 4; g++) {
+    Wire.beginTransmission(pcaAddr[g]);
+    Wire.write(PCA_MODE1);
+    Wire.endTransmission();
+    Wire.requestFrom(pcaAddr[g], (uint8_t)1);
+    uint8_t mode1 = Wire.available() ? Wire.read() : 0;
+    Wire.beginTransmission(pcaAddr[g]);
+    Wire.write(PCA_MODE1);
+    Wire.write(mode1 | PCA_MODE1_AI);
+    Wire.endTransmission();
+  }
+
+  for (int k = 0; k < 64; k++) lastPwm[k] = -1;
+
   delay(10);  // Small delay for stability
 }
 
+// One auto-increment write of channels [ch0, ch0 + n) of one PCA9685 (ON = 0, OFF = value).
+// Returns false on a NACK / bus error, when the chip may not hold these values.
+bool writeBlock(uint8_t addr, int ch0, int n, const int* vals) {
+  Wire.beginTransmission(addr);
+  Wire.write(PCA_LED0_ON_L + 4 * ch0);
+  for (int k = 0; k < n; k++) {
+    Wire.write(0);
+    Wire.write(0);
+    Wire.write(vals[k] & 0xFF);
+    Wire.write(vals[k] >> 8);
+  }
+  return Wire.endTransmission() == 0;
+}
+
 void loop() {
   const int nToken = 64; // Expecting 64 integer values
                         // 32 magnets × 2 values per magnet = 64
@@ -55,11 +112,31 @@ void loop() {
     String line = Serial.readStringUntil('\n'); // Read one line from Serial
     line.trim();
 
-    // Echo received CSV string for communication validation
-    Serial.println(line);
+    if (line == "?") {
+      // Identification handshake for port discovery
+      char boardId[2 * PICO_UNIQUE_BOARD_ID_SIZE_BYTES + 1];
+      pico_get_unique_board_id_string(boardId, sizeof(boardId));
+      Serial.print("#ID,pwm32,");
+      Serial.println(boardId);
+      return;
+    }
 
     int startIdx = 0;
     int count = 0;
+    long seq = -1;
+
+    if (line.startsWith("@")) {
+      // Sequenced frame: strip "@<seq>," and ack instead of echoing
+      int commaIdx = line.indexOf(',');
+      if (commaIdx == -1) commaIdx = line.length();
+      seq = line.substring(1, commaIdx).toInt();
+      startIdx = commaIdx + 1;
+    } else {
+      // Echo received CSV string for communication validation
+      Serial.println(line);
+    }
+
+    for (int k = 0; k < nToken; k++) values[k] = 0;
 
     // Parse comma-separated integers
     while (count < nToken) {
@@ -79,27 +156,36 @@ void loop() {
       startIdx = commaIdx + 1;
     }
 
-    // Send PWM signals to each driver
+    // Send PWM signals to each driver: only changed channels, in auto-increment runs
     for (int g = 0; g < nGr; g++) {
-      Adafruit_PWMServoDriver* pwm;
-
-      if (g == 0)      pwm = &pwm1;
-      else if (g == 1) pwm = &pwm2;
-      else if (g == 2) pwm = &pwm3;
-      else             pwm = &pwm4;
-
+      int pwm_vals[16];
       for (int i = 0; i < 16; i++) {
-        int idx = g * 16 + i;
-        int input_val = values[idx]; // Current code assumes range [0, 10]
+        int input_val = values[g * 16 + i]; // Current code assumes range [0, 10]
 
         // Safety clamp ㅃ
         input_val = constrain(input_val, 0, 10);
 
         // Map 0–10 to 0–4090
-        int pwm_val = input_val * 409;
+        pwm_vals[i] = input_val * 409;
+      }
 
-        pwm->setPWM(i, 0, pwm_val);
+      int i = 0;
+      while (i < 16) {
+        if (pwm_vals[i] == lastPwm[g * 16 + i]) { i++; continue; }
+        int run = 1;
+        while (i + run < 16 && run < MAX_BLOCK_CH && pwm_vals[i + run] != lastPwm[g * 16 + i + run]) run++;
+        bool ok = writeBlock(pcaAddr[g], i, run, &pwm_vals[i]);
+        // Failed block goes back to unknown so the next frame rewrites it
+        for (int k = 0; k < run; k++) lastPwm[g * 16 + i + k] = ok ? pwm_vals[i + k] : -1;
+        i += run;
       }
     }
+
+    if (seq >= 0) {
+      Serial.print('!');
+      Serial.print(seq);
+      Serial.print(',');
+      Serial.println(count == nToken ? 0 : 1);
+    }
   }
-}
\ No newline at end of file
+}
@@ -0,0 +1,215 @@
+# SAM LAB, D H HAN
+# Offline microrobot simulator driven by the same signed coil frames the scripts send
+#
+# Model (overdamped, low Reynolds number):
+# - each coil is a vertical point dipole at its cell centre, `height` mm below the
+#   particle plane; the particle is a magnet with a fixed vertical moment
+# - the horizontal force of one coil is proportional to its signed level times the
+#   radial gradient of Bz:  F ~ -level * dBz/drho,  dBz/drho ~ -3 rho (4h^2 - rho^2) / (rho^2 + h^2)^(7/2)
+#   sign chosen so that NEG levels (direction = 1 in the herding scripts) ATTRACT
+# - coils superpose linearly; velocity = force / drag (folded into MAX_SPEED), plus
+#   optional Brownian noise; particles stay inside the workspace
+#
+# All particles (and any leading batch axes, e.g. many parameter sets) advance in one
+# vectorized NumPy step. Frames are held between sends exactly like on the rig
+# (send_hz of the spec), so the pattern is evaluated only once per frame interval.
+#
+# Workspace: x along columns, y along rows, mm, origin at the LEFT-BOTTOM corner of
+# cell (1,1) -- same convention as the pattern specs.
+#
+# Usage:
+#   python microrobot_sim.py patterns/herd_pull.json --particles 200 --duration 40
+#   python microrobot_sim.py patterns/activate_re.json --goal 1,5 1,6 2,5 2,6 --save traj.npz
+
+import argparse
+import time
+
+import numpy as np
+
+from pattern_spec import load_pattern, cells_to_mask
+
+# ================== Config ==================
+CELL_PITCH = 10.0          # mm between coil centres
+COIL_HEIGHT = 8.0          # mm from coil dipole to particle plane
+MAX_SPEED = 5.0            # mm/s next to one coil at full level (force / drag)
+MOMENT = 1.0               # +1: NEG attracts (herding scripts); -1: POS attracts
+DIFFUSION = 0.02           # mm^2/s Brownian diffusion (0 = deterministic)
+SIM_DT = 0.01              # s integration step
+PWM_MAX = 10.0
+# ================== Config ==================
+
+
+def coil_centers(n, m, pitch=CELL_PITCH):
+    """(n*m, 2) coil centres [x, y] in row-major coil order (row 0 = TOP row)."""
+    i, j = np.meshgrid(np.arange(n), np.arange(m), indexing="ij")
+    return np.stack([(j + 0.5) * pitch, (n - 1 - i + 0.5) * pitch], axis=-1).reshape(-1, 2)
+
+
+def cell_of(pos, n, m, pitch=CELL_PITCH):
+    """Positions (..., 2) -> internal (i, j) cell indices (row 0 = TOP), clipped to the grid."""
+    pos = np.asarray(pos)
+    j = np.clip((pos[..., 0] // pitch).astype(int), 0, m - 1)
+    i = np.clip(n - 1 - (pos[..., 1] // pitch).astype(int), 0, n - 1)
+    return i, j
+
+
+def _kernel_peak(h):
+    rho = np.linspace(0.0, 4.0 * h, 4001)
+    return np.abs(3.0 * rho * (4 * h * h - rho ** 2) / (rho ** 2 + h * h) ** 3.5).max()
+
+
+class Simulator:
+    """Superposed coil-force model on an n x m coil grid."""
+
+    def __init__(self, n=4, m=8, pitch=CELL_PITCH, height=COIL_HEIGHT, max_speed=MAX_SPEED,
+                 diffusion=DIFFUSION, pwm_max=PWM_MAX, moment=MOMENT, seed=None):
+        self.n, self.m = n, m
+        self.pitch = float(pitch)
+        self.h2 = float(height) ** 2
+        self.centers = coil_centers(n, m, pitch)
+        self.c2 = (self.centers ** 2).sum(-1)
+        self.size = np.array([m * pitch, n * pitch])
+        # speed per unit level: peak of the single-coil kernel == max_speed at pwm_max
+        self.gain = moment * max_speed / (pwm_max * _kernel_peak(float(height)))
+        self.diffusion = float(diffusion)
+        self.rng = np.random.default_rng(seed)
+
+    def random_particles(self, count, batch=()):
+        """Uniformly scattered start positions, shape (*batch, count, 2)."""
+        return self.rng.random(tuple(batch) + (count, 2)) * self.size
+
+    def velocity(self, pos, levels):
+        """
+        pos (..., P, 2) mm, levels (..., n*m) or (..., n, m) signed PWM units -> (..., P, 2) mm/s.
+        Leading axes broadcast, so a batch of level vectors drives a batch of particle sets.
+        """
+        lv = np.asarray(levels, dtype=float)
+        if lv.shape[-2:] == (self.n, self.m):
+            lv = lv.reshape(lv.shape[:-2] + (-1,))
+        # |p - c|^2 and sum_c w_c (p - c) as matrix products, no (P, C, 2) temporaries
+        r2 = np.maximum((pos * pos).sum(-1)[..., :, None] + self.c2 - 2.0 * pos @ self.centers.T, 0.0)
+        s = r2 + self.h2
+        k = (4.0 * self.h2 - r2) / (s * s * s * np.sqrt(s))   # (..., P, C)
+        w = k * lv[..., None, :]
+        # level < 0 pulls toward the coil for rho < 2h
+        return 3.0 * self.gain * (pos * w.sum(-1)[..., None] - w @ self.centers)
+
+    def response(self, pos):
+        """
+        Velocity per unit level of every coil: pos (..., P, 2) -> (..., P, 2, n*m),
+        so velocity(pos, levels) == response(pos) @ levels. Used by inverse_solver.py.
+        """
+        pos = np.asarray(pos, dtype=float)
+        d = pos[..., :, None, :] - self.centers                  # (..., P, C, 2)
+        r2 = (d * d).sum(-1)
+        s = r2 + self.h2
+        k = (4.0 * self.h2 - r2) / (s * s * s * np.sqrt(s))
+        return 3.0 * self.gain * np.swapaxes(k[..., None] * d, -1, -2)
+
+    def step(self, pos, levels, dt=SIM_DT):
+        pos = pos + dt * self.velocity(pos, levels)
+        if self.diffusion > 0:
+            pos += self.rng.normal(0.0, np.sqrt(2.0 * self.diffusion * dt), pos.shape)
+        return np.clip(pos, 0.0, self.size)
+
+    def run(self, frame_fn, pos0, duration, frame_dt=0.1, dt=SIM_DT, record_every=0.1):
+        """
+        Integrate `duration` seconds. frame_fn(t) -> signed levels, called once per
+        frame_dt (held in between, like the serial send loop).
+        Returns (times (T,), trajectory (T, ..., P, 2)).
+        """
+        pos = np.array(pos0, dtype=float)
+        steps_per_frame = max(1, int(round(frame_dt / dt)))
+        rec_every = max(1, int(round(record_every / dt)))
+        n_steps = int(round(duration / dt))
+        times, traj = [0.0], [pos.copy()]
+        levels = None
+        for s in range(n_steps):
+            if s % steps_per_frame == 0:
+                levels = np.array(frame_fn(s * dt), dtype=float)
+            pos = self.step(pos, levels, dt)
+            if (s + 1) % rec_every == 0:
+                times.append((s + 1) * dt)
+                traj.append(pos.copy())
+        return np.asarray(times), np.stack(traj)
+
+
+# ---------------------------------------------
+# Scoring
+# ---------------------------------------------
+def goal_mask_of(spec, n, m):
+    """Default goal of a spec: union of herd targets and trap cells."""
+    mask = np.zeros((n, m), dtype=bool)
+    for L in spec["layers"]:
+        if L["type"] == "herd":
+            mask |= cells_to_mask(L["targets"], n, m)
+        elif L["type"] == "trap":
+            mask |= cells_to_mask(L["cells"], n, m)
+    return mask
+
+
+def default_duration(cp, tail=5.0, fallback=25.0):
+    """Long enough for every herd layer to reach its target (+ tail), else fallback + tail."""
+    herd = [L for L in cp.spec["layers"] if L["type"] == "herd"]
+    return max([(int(D.max()) + 1) * L["pulse_dt"] for L, D in zip(herd, cp.distance_maps)] or [fallback]) + tail
+
+
+def score(sim, traj, goal_mask):
+    """
+    capture : fraction of particles inside goal cells at the end
+    dist    : mean distance (mm) from the goal cell centres at the end
+    t_half  : first recorded sample index where half the particles are captured (-1 = never)
+    """
+    goal_centers = sim.centers[goal_mask.ravel()]
+    i, j = cell_of(traj, sim.n, sim.m, sim.pitch)
+    inside = goal_mask[i, j]                                   # (T, ..., P)
+    final = traj[-1]
+    d = np.sqrt(((final[..., :, None, :] - goal_centers) ** 2).sum(-1)).min(-1)
+    frac = inside.mean(-1)
+    half = frac >= 0.5
+    t_half = np.where(half.any(0), half.argmax(0), -1)
+    return {"capture": frac[-1], "dist": d.mean(-1), "t_half": t_half}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Simulate particles under a pattern spec")
+    ap.add_argument("spec", help="pattern spec (.json / .yaml)")
+    ap.add_argument("--particles", type=int, default=100)
+    ap.add_argument("--duration", type=float, default=None, help="seconds (default: herd length + 5 s, else 30 s)")
+    ap.add_argument("--dt", type=float, default=SIM_DT)
+    ap.add_argument("--goal", nargs="*", default=None, metavar="ROW,COL",
+                    help="goal cells (1-based, left-bottom); default: herd targets + trap cells")
+    ap.add_argument("--moment", type=float, default=MOMENT, help="+1: NEG attracts, -1: POS attracts")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--save", default=None, help="write times/trajectory to this .npz")
+    args = ap.parse_args()
+
+    cp = load_pattern(args.spec)
+    n, m = cp.shape
+    sim = Simulator(n, m, pwm_max=cp.pwm_max, moment=args.moment, seed=args.seed)
+
+    duration = args.duration if args.duration is not None else default_duration(cp)
+    if args.goal:
+        goal = cells_to_mask([tuple(int(v) for v in g.split(",")) for g in args.goal], n, m)
+    else:
+        goal = goal_mask_of(cp.spec, n, m)
+
+    pos0 = sim.random_particles(args.particles)
+    t0 = time.perf_counter()
+    times, traj = sim.run(cp.evaluate, pos0, duration, frame_dt=1.0 / cp.send_hz, dt=args.dt)
+    wall = time.perf_counter() - t0
+
+    print(f"{cp.name}: {args.particles} particles, {duration:.1f} s simulated in {wall:.2f} s "
+          f"({duration / max(wall, 1e-9):.0f}x real time)")
+    if goal.any():
+        s = score(sim, traj, goal)
+        th = int(s["t_half"])
+        print(f"capture {100 * s['capture']:.1f} %   mean distance {s['dist']:.2f} mm   "
+              f"50 % captured at {'never' if th < 0 else f'{times[th]:.1f} s'}")
+    if args.save:
+        np.savez_compressed(args.save, times=times, traj=traj, centers=sim.centers, goal=goal)
+        print("Saved", args.save)
+
+
+if __name__ == "__main__":
+    main()
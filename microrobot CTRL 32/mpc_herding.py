@@ -0,0 +1,350 @@
+# SAM LAB, D H HAN
+# Model-predictive herding: pick the coil commands by rolling out many candidates at once
+#
+# The band sweep (herding.py, pixel_art_distance_transform.py) steps outside -> inside on
+# a HERD_PULSE_DT timer whether or not the robot follows. Here every send period:
+#   1. the newest robot positions come in (camera tracker, UDP, stdin, simulator ... --
+#      anything that yields (R, 2) mm, see the sources below)
+#   2. K candidate sequences of H frames are drawn from a frame library
+#      (off + every free coil at the attract level, plus any extra frames, e.g. the
+#      band frames of herding.MultiHerd.segments())
+#   3. all K sequences are rolled out together through the microrobot_sim model:
+#      positions (K, R, 2), one Simulator.velocity() call per sub-step for every
+#      candidate, no Python loop over candidates
+#   4. cost = distance of every robot to its target cells over the horizon (terminal
+#      step weighted) + a small effort term; the sampling distribution is refit to the
+#      elite candidates (cross-entropy) until the best cost stops improving
+#      (STALL_ROUNDS) or the time budget is spent, whichever comes first
+#   5. the first frame of the best sequence is sent; the rest warm-starts the next period
+#      (receding horizon)
+# Planning is bounded by BUDGET (the demo uses half of a 10 Hz send period, 50 ms). A
+# 4 x 8 array, 256 candidates, horizon 6 and one robot usually stops after ~3 rounds
+# (p50 ~20 ms) and only runs to the budget while the plan is still changing; two robots
+# take ~40 ms (`python mpc_herding.py` prints the timings and rounds).
+#
+# Positions: mm, x along columns, y along rows, origin at the LEFT-BOTTOM corner of cell
+# (1,1) -- microrobot_sim.py convention. Levels follow herding.py: signed PWM units,
+# level < 0 (NEG) attracts with the default moment.
+#
+# Usage:
+#   herder = MPCHerder(Simulator(4, 8, diffusion=0), [target_mask], level=-10)
+#   levels = herder.command(robot_xy)            # (n, m) signed float, PWM units
+#   src = open_source("udp:9870")                # or "stdin", "sim" -> src.latest()
+#   python mpc_herding.py --target 2,4 --start 75,5       # closed-loop demo in the simulator
+
+import argparse
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+
+from microrobot_sim import Simulator, PWM_MAX
+
+# ================== Config ==================
+HORIZON = 6                # frames per candidate sequence
+STEP_DT = 0.5              # s each frame is held in the rollout
+SUBSTEPS = 5               # integration steps per frame in the rollout
+CANDIDATES = 256           # sequences per rollout batch
+ELITE_FRAC = 0.1           # fraction of a batch the distribution is refit to
+SMOOTHING = 0.7            # weight of the elite frequencies in the refit
+PRIOR_SCALE = 1.5          # coil pitches: proposal falls off with distance from the robots
+TERMINAL_WEIGHT = 3.0      # extra weight of the last horizon step
+EFFORT_WEIGHT = 0.05       # mm of cost per coil driven at full level
+BUDGET = 0.05              # s of planning per command (stops refining after this)
+STALL_ROUNDS = 2           # rounds without a better sequence (rel. CONVERGE_TOL) that end refining early
+CONVERGE_TOL = 1e-3        # relative cost improvement that still counts as progress
+SOURCE_PORT = 9870         # default UDP port of the "udp" position source
+# ================== Config ==================
+
+
+class MPCHerder:
+    """
+    Sampling MPC over a discrete frame library. `targets`: one (n, m) bool mask shared by
+    all robots (each goes to its nearest target cell), or one mask per robot (robot r to
+    mask r, like MultiHerd). `blocked` coils are never driven.
+    """
+
+    def __init__(self, sim, targets, level=-PWM_MAX, horizon=HORIZON, step_dt=STEP_DT,
+                 substeps=SUBSTEPS, candidates=CANDIDATES, blocked=None, library=None,
+                 budget=BUDGET, seed=None):
+        self.sim = sim
+        n, m = sim.n, sim.m
+        T = np.asarray(targets, dtype=bool)
+        if T.ndim == 2:
+            T = T[None]
+        if T.shape[1:] != (n, m) or not T.reshape(len(T), -1).any(axis=1).all():
+            raise ValueError(f"targets must be non-empty ({n}, {m}) masks")
+        self.targets = T
+        self.goal = sim.centers[None] + np.zeros((len(T), 1, 1))             # (M, C, 2) cell centres
+        self.goal_ok = T.reshape(len(T), -1)                                 # (M, C) which are targets
+        self.level = float(level)
+        self.horizon = int(horizon)
+        self.step_dt = float(step_dt)
+        self.substeps = max(1, int(substeps))
+        self.candidates = max(2, int(candidates))
+        self.budget = float(budget)
+        self.rng = np.random.default_rng(seed)
+        self.blocked = np.zeros((n, m), dtype=bool) if blocked is None else np.asarray(blocked, dtype=bool)
+        self.set_library(library)
+        self.plan = None               # (H,) library indices of the last best sequence
+        self.last_cost = np.inf
+        self.last_ms = 0.0
+        self.rounds = 0                # refinement rounds used by the last command()
+
+    def set_library(self, extra=None):
+        """Frame library: off, every free coil alone at `level`, then `extra` (F, n, m) frames."""
+        C = self.sim.n * self.sim.m
+        free = np.flatnonzero(~self.blocked.ravel())
+        lib = np.zeros((1 + len(free), C))
+        lib[1 + np.arange(len(free)), free] = self.level
+        self.coil_of = np.concatenate([[-1], free])                          # library frame -> its coil (-1 = none)
+        if extra is not None:
+            ex = np.asarray(extra, dtype=float).reshape(-1, C) * ~self.blocked.ravel()
+            lib = np.concatenate([lib, ex])
+            self.coil_of = np.concatenate([self.coil_of, np.full(len(ex), -1)])
+        self.library = lib
+        self.effort = np.abs(lib).sum(1) / max(abs(self.level), 1e-9)       # (F,) coils at full level
+
+    # ----- model -----
+    def _robot_goals(self, R):
+        if len(self.targets) == 1:
+            return np.zeros(R, dtype=int)
+        if R != len(self.targets):
+            raise ValueError(f"{len(self.targets)} target masks but {R} robot positions")
+        return np.arange(R)
+
+    def distance(self, pos, goals):
+        """pos (..., R, 2) -> (..., R) mm to the nearest target cell centre of each robot."""
+        d2 = ((pos[..., :, None, :] - self.goal[goals]) ** 2).sum(-1)       # (..., R, C)
+        d2 = np.where(self.goal_ok[goals], d2, np.inf)
+        return np.sqrt(d2.min(-1))
+
+    def rollout(self, pos0, seqs):
+        """
+        Roll every candidate out together: pos0 (R, 2), seqs (K, H) library indices
+        -> (K,) cost, (K, R, 2) final positions.
+        """
+        K, H = seqs.shape
+        goals = self._robot_goals(len(pos0))
+        pos = np.broadcast_to(np.asarray(pos0, dtype=float), (K,) + np.shape(pos0)).copy()
+        dt = self.step_dt / self.substeps
+        cost = np.zeros(K)
+        for h in range(H):
+            lv = self.library[seqs[:, h]]                                    # (K, C)
+            for _ in range(self.substeps):
+                pos += dt * self.sim.velocity(pos, lv)
+                np.clip(pos, 0.0, self.sim.size, out=pos)
+            w = 1.0 + (TERMINAL_WEIGHT if h == H - 1 else 0.0)
+            cost += w * self.distance(pos, goals).mean(-1) + EFFORT_WEIGHT * self.effort[seqs[:, h]]
+        return cost, pos
+
+    # ----- planning -----
+    def _prior(self, pos):
+        """(F,) proposal weights: coils near a robot are likely, far coils rarely tried."""
+        p = np.full(len(self.library), 1.0)
+        coil = self.coil_of >= 0
+        d = np.sqrt(((self.sim.centers[self.coil_of[coil]][:, None, :] - pos[None]) ** 2).sum(-1)).min(1)
+        p[coil] = np.exp(-d / (PRIOR_SCALE * self.sim.pitch))
+        p[0] = max(p[0], 0.5)                                                # always consider "off"
+        return p / p.sum()
+
+    def _sample(self, probs, k):
+        """k sequences from per-step categorical distributions probs (H, F)."""
+        cdf = np.cumsum(probs, axis=1)
+        u = self.rng.random((k, self.horizon, 1))
+        return np.minimum((u > cdf[None]).sum(-1), probs.shape[1] - 1)
+
+    def _seeds(self):
+        """Deterministic candidates: warm start (previous plan shifted) and every frame held."""
+        F = len(self.library)
+        held = np.repeat(np.arange(F)[:, None], self.horizon, axis=1)
+        if self.plan is None:
+            return held
+        warm = np.append(self.plan[1:], self.plan[-1])[None]
+        return np.concatenate([warm, held])
+
+    def command(self, positions, out=None):
+        """Newest robot positions (R, 2) mm -> first frame of the best sequence, (n, m) PWM units."""
+        t0 = time.perf_counter()
+        pos = np.asarray(positions, dtype=float).reshape(-1, 2)
+        F = len(self.library)
+        probs = np.tile(self._prior(pos), (self.horizon, 1))
+        seeds = self._seeds()
+        n_elite = max(2, int(ELITE_FRAC * self.candidates))
+        best_seq, best_cost = None, np.inf
+        self.rounds = stall = 0
+        while True:
+            k = max(self.candidates - (len(seeds) if self.rounds == 0 else 0), 0)
+            seqs = self._sample(probs, k)
+            if self.rounds == 0:
+                seqs = np.concatenate([seeds, seqs])
+            cost, _ = self.rollout(pos, seqs)
+            self.rounds += 1
+            order = np.argsort(cost)
+            if best_seq is None or cost[order[0]] < best_cost - CONVERGE_TOL * abs(best_cost):
+                stall = 0
+            else:
+                stall += 1
+            if cost[order[0]] < best_cost:
+                best_cost, best_seq = float(cost[order[0]]), seqs[order[0]].copy()
+            if stall >= STALL_ROUNDS:                                       # converged
+                break
+            elite = seqs[order[:n_elite]]
+            freq = np.zeros((self.horizon, F))
+            np.add.at(freq, (np.arange(self.horizon)[None].repeat(len(elite), 0), elite), 1.0)
+            probs = (1.0 - SMOOTHING) * probs + SMOOTHING * freq / len(elite)
+            spent = time.perf_counter() - t0
+            if spent + spent / self.rounds > self.budget:                   # next round would overrun
+                break
+        self.plan, self.last_cost = best_seq, best_cost
+        self.last_ms = 1e3 * (time.perf_counter() - t0)
+        frame = self.library[best_seq[0]].reshape(self.sim.n, self.sim.m)
+        if out is None:
+            return frame.copy()
+        out[...] = frame
+        return out
+
+    def reset(self):
+        self.plan = None
+
+
+# ---------------------------------------------
+# Position sources: anything with latest() -> (R, 2) mm array or None
+# ---------------------------------------------
+def parse_positions(line, n=4, pitch=None):
+    """
+    One measurement line -> (R, 2) mm, or None if it can't be parsed:
+      "x,y x,y ..."            positions in mm
+      "cell r,c r,c ..."       1-based (row, col) cells, left-bottom origin -> cell centres
+    """
+    parts = line.replace(";", " ").split()
+    if not parts:
+        return None
+    cells = parts[0].lower() == "cell"
+    if cells:
+        parts = parts[1:]
+    try:
+        xy = np.array([[float(v) for v in p.split(",")] for p in parts], dtype=float)
+    except ValueError:
+        return None
+    if xy.ndim != 2 or xy.shape[1] != 2 or not len(xy):
+        return None
+    if cells:
+        pitch = Simulator().pitch if pitch is None else pitch
+        xy = np.stack([(xy[:, 1] - 0.5) * pitch, (xy[:, 0] - 0.5) * pitch], axis=-1)
+    return xy
+
+
+class LineSource:
+    """Newest measurement from a line stream (stdin, a FIFO, a tracker's pipe), read on a thread."""
+
+    def __init__(self, stream, pitch=None):
+        self.stream = stream
+        self.pitch = pitch
+        self.pos = None
+        self.t = 0.0
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, name="positions", daemon=True).start()
+
+    def _run(self):
+        for line in self.stream:
+            self._put(line if isinstance(line, str) else line.decode("ascii", errors="ignore"))
+
+    def _put(self, line):
+        xy = parse_positions(line, pitch=self.pitch)
+        if xy is not None:
+            with self._lock:
+                self.pos, self.t = xy, time.monotonic()
+
+    def latest(self):
+        with self._lock:
+            return self.pos
+
+    def age(self):
+        return time.monotonic() - self.t if self.pos is not None else np.inf
+
+
+class UDPSource(LineSource):
+    """Same line format, one datagram per measurement (e.g. from a camera tracker)."""
+
+    def __init__(self, port=SOURCE_PORT, host="0.0.0.0", pitch=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, int(port)))
+        super().__init__(None, pitch)
+
+    def _run(self):
+        while True:
+            data, _ = self.sock.recvfrom(4096)
+            for line in data.decode("ascii", errors="ignore").splitlines():
+                self._put(line)
+
+
+class SimSource:
+    """Dry run: robots simulated under the commands actually sent (apply() after each send)."""
+
+    def __init__(self, sim, positions):
+        self.sim = sim
+        self.pos = np.asarray(positions, dtype=float).reshape(-1, 2)
+        self.t = time.monotonic()
+
+    def apply(self, levels, dt, step=0.01):
+        for _ in range(max(1, int(round(dt / step)))):
+            self.pos = self.sim.step(self.pos, levels, step)
+
+    def latest(self):
+        return self.pos
+
+    def age(self):
+        return 0.0
+
+
+def open_source(name, sim=None, start=None):
+    """"stdin", "udp[:PORT]", or "sim" (needs sim + start positions) -> position source."""
+    if name == "stdin":
+        return LineSource(sys.stdin)
+    if name.startswith("udp"):
+        return UDPSource(int(name.split(":", 1)[1]) if ":" in name else SOURCE_PORT)
+    if name == "sim":
+        return SimSource(sim, start)
+    raise ValueError(f"position source must be stdin, udp[:PORT] or sim, got {name!r}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Closed-loop MPC herding demo in the simulator")
+    ap.add_argument("--target", nargs="+", default=["2,4", "3,4"], metavar="ROW,COL",
+                    help="target cells (1-based, left-bottom), shared by all robots")
+    ap.add_argument("--start", nargs="+", default=["75,5"], metavar="X,Y", help="robot start positions [mm]")
+    ap.add_argument("--hz", type=float, default=10.0, help="command rate")
+    ap.add_argument("--duration", type=float, default=30.0)
+    ap.add_argument("--candidates", type=int, default=CANDIDATES)
+    ap.add_argument("--horizon", type=int, default=HORIZON)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    sim = Simulator(4, 8, diffusion=0.0)
+    target = np.zeros((sim.n, sim.m), dtype=bool)
+    for rc in args.target:
+        r, c = (int(v) for v in rc.split(","))
+        target[sim.n - r, c - 1] = True
+    herder = MPCHerder(sim, target, level=-PWM_MAX, horizon=args.horizon, candidates=args.candidates,
+                       budget=0.5 / args.hz, seed=args.seed)
+    src = SimSource(Simulator(4, 8, seed=args.seed), parse_positions(" ".join(args.start)))
+
+    times = []
+    for k in range(int(args.duration * args.hz)):
+        levels = herder.command(src.latest())
+        times.append(herder.last_ms)
+        src.apply(np.round(levels), 1.0 / args.hz)                          # device takes integer levels
+        if k % int(args.hz) == 0:
+            d = herder.distance(src.latest(), herder._robot_goals(len(src.latest())))
+            print(f"t={k / args.hz:5.1f}s  dist to target={np.array2string(d, precision=1)} mm  "
+                  f"cost={herder.last_cost:7.1f}  rounds={herder.rounds}")
+    t = np.array(times)
+    print(f"plan time p50 {np.percentile(t, 50):.1f} ms  p99 {np.percentile(t, 99):.1f} ms  "
+          f"(send period {1e3 / args.hz:.0f} ms, {args.candidates} candidates x {args.horizon} frames)")
+
+
+if __name__ == "__main__":
+    main()
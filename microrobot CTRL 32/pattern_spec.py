@@ -0,0 +1,537 @@
+# SAM LAB, D H HAN
+# Declarative pattern spec (JSON / YAML) -> compiled frame evaluator
+#
+# A spec file replaces the "CONFIG (EDIT ONLY THESE)" block of the experiment
+# scripts. It is parsed and validated ONCE by load_pattern(); every layer is
+# then compiled into a small table of precomputed signed frames plus a cheap
+# index function of time, so evaluating a frame in the control loop is a few
+# array gathers/blends and never touches the spec again.
+#
+# Coordinates: (row, col), 1-indexed, (1,1) = LEFT-BOTTOM (same as activate_re.py)
+# Levels: signed fraction of pwm_max in [-1, 1]
+#   + => POS channel (grid[..., 0]),  - => NEG channel (grid[..., 1])
+#   herding scripts: direction = 1 (NEG attracts) <=> intensity = -1
+#
+# Example (JSON):
+# {
+#   "name": "checker vibration + trap",
+#   "grid": [4, 8], "pwm_max": 10, "send_hz": 10,
+#   "layers": [
+#     {"type": "vibrate", "cells": [[1,1],[1,3]], "intensity_range": [-1, 1],
+#      "polarity": "alt", "period": 0.5, "dutycycle": 1},
+#     {"type": "trap", "cells": [[5,1],[5,3]], "intensity": 0.8},
+#     {"type": "sequence", "cells": "all", "steps": [[-1, 1.0], [0, 0.01], [1, 2.0]]},
+#     {"type": "herd", "targets": [[2,4],[3,4]], "intensity": -1, "pulse_dt": 6,
+#      "overlap": true, "overlap_hold": 3, "final_hold": true},
+#     {"type": "herd", "robots": [[[2,2]], [[3,7],[2,7]]], "pulse_dt": 4},
+#     {"type": "frames", "source": "art.gif", "mode": "dark", "levels": 2, "polarity": -1,
+#      "fps": 5, "loop": true},
+#     {"type": "wave", "cells": "all", "shape": "sine", "freq": 2, "intensity": 1,
+#      "phase_mode": "cols", "phase_spread": 1}
+#   ]
+# }
+# "herd" with "robots" (one target list per robot) splits the array into Voronoi zones
+# and runs a band schedule in every zone at once (herding.py).
+# "blocked": [[r, c], ...] at the top level marks cells that are never driven (damaged
+# coils, obstacles, keep-out zones); herd bands route around them (geodesic distance).
+# A herd layer may add its own "blocked" cells (obstacles for that layer only).
+# "wave" drives its cells with a wavetable oscillator per cell (waveforms.py): shape =
+# sine / triangle / sawtooth / square (duty) / chirp (cycles) or a list of samples,
+# level = offset + intensity * wave, phase offsets from phase_mode (none / rows / cols /
+# checker / diag / radial) times phase_spread cycles.
+# "frames" plays an image / GIF / video converted by frame_import.py (path relative
+# to the spec file; converted once and cached by content hash).
+#
+# Layers are blended in order with the add_cells() rule of activate_re.py:
+# same sign -> keep the larger magnitude, opposite sign -> later layer wins,
+# zero -> no change.
+#
+# Frame tables and the composed output are int8 PWM levels (quantized once at compile
+# time, wave layers once per evaluation), so evaluate() feeds frame_codec / coil_state
+# without another round + astype.
+#
+# Every layer also compiles a next-change function: the first time after t at which its
+# frame index can change, computed from the period / duty edges, step ends, herding
+# pulse times or frame durations (math.inf = never again). next_transition(t) is the
+# minimum over the layers, so the control loop only recomposes at those instants
+# (run_pattern.py). Wave layers change continuously and report t itself.
+
+import json
+import math
+import os
+
+import numpy as np
+
+from compositor import Compositor
+from frame_codec import quantize
+from herding import MultiHerd, distance_fields, REPEL_MODES, ATTRACT_MODES
+from waveforms import OscillatorBank, grid_phase, SHAPES as WAVE_SHAPES
+from frame_import import import_frames, MODES as FRAME_MODES
+
+try:
+    import yaml
+except ImportError:  # YAML is optional, JSON always works
+    yaml = None
+
+LAYER_TYPES = ("vibrate", "trap", "sequence", "herd", "frames", "wave")
+PHASE_MODES = ("none", "rows", "cols", "checker", "diag", "radial")
+POLARITIES = ("pos", "neg", "alt")
+
+
+# ---------------------------------------------
+# Parsing / validation
+# ---------------------------------------------
+def read_spec_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".yaml", ".yml"):
+        if yaml is None:
+            raise ValueError(f"{path}: PyYAML is not installed (pip install pyyaml) - use a .json spec")
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+
+def _number(d, key, where, default=None, lo=None, hi=None):
+    if key not in d:
+        if default is None:
+            raise ValueError(f"{where}.{key} is required")
+        return float(default)
+    v = d[key]
+    if isinstance(v, bool) or not isinstance(v, (int, float)):
+        raise ValueError(f"{where}.{key} must be a number, got {v!r}")
+    v = float(v)
+    if lo is not None and v < lo:
+        raise ValueError(f"{where}.{key} must be >= {lo}, got {v}")
+    if hi is not None and v > hi:
+        raise ValueError(f"{where}.{key} must be <= {hi}, got {v}")
+    return v
+
+
+def _choice(d, key, where, choices, default):
+    v = d.get(key, default)
+    if v not in choices:
+        raise ValueError(f"{where}.{key} must be one of {choices}, got {v!r}")
+    return v
+
+
+def _cells(d, key, where, n, m, allow_all=True):
+    v = d.get(key)
+    if v is None:
+        raise ValueError(f"{where}.{key} is required")
+    if allow_all and v == "all":
+        return [(r, c) for r in range(1, n + 1) for c in range(1, m + 1)]
+    if not isinstance(v, (list, tuple)):
+        raise ValueError(f"{where}.{key} must be a list of [row, col] or \"all\"")
+    out = []
+    for rc in v:
+        if not isinstance(rc, (list, tuple)) or len(rc) != 2:
+            raise ValueError(f"{where}.{key}: bad cell {rc!r}, expected [row, col]")
+        r, c = int(rc[0]), int(rc[1])
+        if not (1 <= r <= n and 1 <= c <= m):
+            raise ValueError(f"{where}.{key}: cell {(r, c)} outside {n}x{m} grid")
+        out.append((r, c))
+    return out
+
+
+def validate_spec(spec, base_dir=None):
+    """
+    Check a raw spec dict and return a normalized copy
+    (all defaults filled in, cells as (row, col) tuples).
+    Relative frame sources are resolved against base_dir (the spec's folder).
+    Raises ValueError with the offending field on any problem.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("spec must be a mapping")
+
+    grid = spec.get("grid", [4, 8])
+    if not isinstance(grid, (list, tuple)) or len(grid) != 2 or min(int(grid[0]), int(grid[1])) < 1:
+        raise ValueError(f"grid must be [rows, cols], got {grid!r}")
+    n, m = int(grid[0]), int(grid[1])
+
+    out = {
+        "name": str(spec.get("name", "pattern")),
+        "grid": (n, m),
+        "pwm_max": _number(spec, "pwm_max", "spec", default=10, lo=0, hi=127),
+        "send_hz": _number(spec, "send_hz", "spec", default=10, lo=1e-3),
+        "blocked": _cells(spec, "blocked", "spec", n, m, allow_all=False) if "blocked" in spec else [],
+        "layers": [],
+    }
+
+    layers = spec.get("layers")
+    if not isinstance(layers, list) or not layers:
+        raise ValueError("layers must be a non-empty list")
+
+    for idx, L in enumerate(layers):
+        where = f"layers[{idx}]"
+        if not isinstance(L, dict):
+            raise ValueError(f"{where} must be a mapping")
+        kind = _choice(L, "type", where, LAYER_TYPES, None)
+        item = {"type": kind, "name": str(L.get("name", f"{kind}{idx}"))}
+
+        if kind == "vibrate":
+            ir = L.get("intensity_range", [-1, 1])
+            if not isinstance(ir, (list, tuple)) or len(ir) != 2:
+                raise ValueError(f"{where}.intensity_range must be [a, b]")
+            item["cells"] = _cells(L, "cells", where, n, m)
+            item["intensity_range"] = (float(ir[0]), float(ir[1]))
+            item["polarity"] = _choice(L, "polarity", where, POLARITIES, "alt")
+            item["period"] = _number(L, "period", where, lo=0)
+            item["dutycycle"] = _number(L, "dutycycle", where, default=1, lo=0, hi=1)
+
+        elif kind == "trap":
+            item["cells"] = _cells(L, "cells", where, n, m)
+            item["intensity"] = _number(L, "intensity", where, lo=-1, hi=1)
+
+        elif kind == "sequence":
+            steps = L.get("steps")
+            if not isinstance(steps, list) or not steps:
+                raise ValueError(f"{where}.steps must be a non-empty list of [level, duration]")
+            norm = []
+            for s_idx, st in enumerate(steps):
+                if not isinstance(st, (list, tuple)) or len(st) != 2:
+                    raise ValueError(f"{where}.steps[{s_idx}] must be [level, duration]")
+                lvl, dur = float(st[0]), float(st[1])
+                if not (-1.0 <= lvl <= 1.0):
+                    raise ValueError(f"{where}.steps[{s_idx}] level must be in [-1, 1]")
+                if dur <= 0:
+                    raise ValueError(f"{where}.steps[{s_idx}] duration must be > 0")
+                norm.append((lvl, dur))
+            item["cells"] = _cells(L, "cells", where, n, m) if "cells" in L else _cells({"cells": "all"}, "cells", where, n, m)
+            item["steps"] = norm
+
+        elif kind == "herd":
+            if "robots" in L:
+                robots = L["robots"]
+                if not isinstance(robots, list) or not robots:
+                    raise ValueError(f"{where}.robots must be a non-empty list of target cell lists")
+                item["robots"] = [_cells({"targets": t}, "targets", f"{where}.robots[{r}]", n, m, allow_all=False)
+                                  for r, t in enumerate(robots)]
+                if not all(item["robots"]):
+                    raise ValueError(f"{where}.robots: every robot needs at least one target cell")
+                item["targets"] = sorted(set(c for t in item["robots"] for c in t))
+            else:
+                item["targets"] = _cells(L, "targets", where, n, m, allow_all=False)
+                if not item["targets"]:
+                    raise ValueError(f"{where}.targets must not be empty")
+                item["robots"] = [item["targets"]]
+            item["intensity"] = _number(L, "intensity", where, default=-1, lo=-1, hi=1)
+            item["pulse_dt"] = _number(L, "pulse_dt", where, lo=1e-6)
+            item["overlap"] = bool(L.get("overlap", True))
+            item["overlap_hold"] = _number(L, "overlap_hold", where, default=item["pulse_dt"] / 2, lo=0)
+            item["final_hold"] = bool(L.get("final_hold", True))
+            item["attract"] = _choice(L, "attract", where, ATTRACT_MODES, "band")
+            item["repel_mode"] = _choice(L, "repel_mode", where, REPEL_MODES, "none")
+            item["repel_intensity"] = _number(L, "repel_intensity", where, default=0, lo=0, hi=1)
+            item["blocked"] = _cells(L, "blocked", where, n, m, allow_all=False) if "blocked" in L else []
+
+        elif kind == "frames":
+            src = L.get("source")
+            if not isinstance(src, str) or not src:
+                raise ValueError(f"{where}.source must be a file path")
+            if base_dir and not os.path.isabs(src):
+                src = os.path.join(base_dir, src)
+            if not os.path.exists(src):
+                raise ValueError(f"{where}.source: {src} not found")
+            item["source"] = src
+            item["mode"] = _choice(L, "mode", where, FRAME_MODES, "dark")
+            item["levels"] = int(_number(L, "levels", where, default=2, lo=2, hi=256))
+            item["polarity"] = int(_choice(L, "polarity", where, (-1, 1), -1))
+            item["fps"] = _number(L, "fps", where, default=0, lo=0)
+            item["loop"] = bool(L.get("loop", True))
+            item["intensity"] = _number(L, "intensity", where, default=1, lo=0, hi=1)
+
+        elif kind == "wave":
+            item["cells"] = _cells(L, "cells", where, n, m) if "cells" in L else _cells({"cells": "all"}, "cells", where, n, m)
+            shape = L.get("shape", "sine")
+            if isinstance(shape, list):
+                if not shape or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in shape):
+                    raise ValueError(f"{where}.shape: a user table must be a non-empty list of numbers")
+                item["shape"] = [float(v) for v in shape]
+            else:
+                item["shape"] = _choice(L, "shape", where, WAVE_SHAPES, "sine")
+            item["freq"] = _number(L, "freq", where, lo=0)
+            item["intensity"] = _number(L, "intensity", where, default=1, lo=0, hi=1)
+            item["offset"] = _number(L, "offset", where, default=0, lo=-1, hi=1)
+            item["phase_mode"] = _choice(L, "phase_mode", where, PHASE_MODES, "none")
+            item["phase_spread"] = _number(L, "phase_spread", where, default=1)
+            item["duty"] = _number(L, "duty", where, default=0.5, lo=0, hi=1)
+            cyc = L.get("cycles", [1, 8])
+            if not isinstance(cyc, (list, tuple)) or len(cyc) != 2:
+                raise ValueError(f"{where}.cycles must be [start, end]")
+            item["cycles"] = (float(cyc[0]), float(cyc[1]))
+
+        out["layers"].append(item)
+
+    return out
+
+
+# ---------------------------------------------
+# Compilation
+# ---------------------------------------------
+def cells_to_mask(cells, n, m):
+    """(row, col) 1-based, left-bottom origin -> boolean (n, m) mask."""
+    mask = np.zeros((n, m), dtype=bool)
+    if cells:
+        rc = np.asarray(cells, dtype=int).reshape(-1, 2)
+        mask[n - rc[:, 0], rc[:, 1] - 1] = True
+    return mask
+
+
+def parse_intensity_range(ir):
+    """Same rule as activate_re.py: returns (neg_level, pos_level, start_sign_for_alt)."""
+    a = min(max(float(ir[0]), -1.0), 1.0)
+    b = min(max(float(ir[1]), -1.0), 1.0)
+    if a >= 0 and b <= 0:
+        return b, a, +1
+    if a <= 0 and b >= 0:
+        return a, b, -1
+    return min(min(a, b), 0.0), max(max(a, b), 0.0), +1
+
+
+def manhattan_distance(target_mask):
+    """4-neighbour BFS distance to the target cells (-1 = unreachable), done as array wavefronts."""
+    return distance_fields(np.asarray(target_mask, dtype=bool)[None])[0]
+
+
+def _next_end(ends, t):
+    """First entry of the sorted `ends` strictly after t (math.inf if there is none)."""
+    k = int(np.searchsorted(ends, t, side="right"))
+    return float(ends[k]) if k < len(ends) else math.inf
+
+
+def _next_cyclic(ends, total, t):
+    """Next entry of `ends` after t when the table repeats every `total` seconds."""
+    ph = t % total                                  # same phase arithmetic as the index functions
+    nxt = _next_end(ends, ph)
+    return t + ((nxt if nxt < math.inf else total + float(ends[0])) - ph)
+
+
+def _compile_vibrate(L, n, m, amp):
+    mask = cells_to_mask(L["cells"], n, m)
+    neg_level, pos_level, start = parse_intensity_range(L["intensity_range"])
+    frames = np.stack([
+        np.zeros((n, m)),
+        mask * (pos_level * amp),
+        mask * (neg_level * amp),
+    ])
+    T, d, pol = L["period"], L["dutycycle"], L["polarity"]
+
+    def index(t):
+        if T > 0 and (t % T) >= d * T:
+            return 0
+        if pol == "pos":
+            s = +1
+        elif pol == "neg":
+            s = -1
+        elif T <= 0:
+            s = start
+        else:
+            s = start if int(t // T) % 2 == 0 else -start
+        return 1 if s > 0 else 2
+
+    def next_change(t):
+        # gate off edge at d*T, polarity flip / gate on at every multiple of T
+        if T <= 0 or d <= 0 or (pol != "alt" and d >= 1):
+            return math.inf
+        ph = t % T
+        return t + ((d * T if ph < d * T else T) - ph)
+
+    return frames, index, next_change
+
+
+def _compile_trap(L, n, m, amp):
+    frames = (cells_to_mask(L["cells"], n, m) * (L["intensity"] * amp))[None]
+    return frames, lambda t: 0, lambda t: math.inf
+
+
+def _compile_sequence(L, n, m, amp):
+    mask = cells_to_mask(L["cells"], n, m)
+    levels = np.array([lvl for lvl, _ in L["steps"]])
+    ends = np.cumsum([dur for _, dur in L["steps"]])
+    total = float(ends[-1])
+    frames = mask[None] * (levels[:, None, None] * amp)
+
+    def index(t):
+        return int(np.searchsorted(ends, t % total, side="right"))
+
+    return frames, index, lambda t: _next_cyclic(ends, total, t)
+
+
+def _herd_table(herd, n, m):
+    """Piecewise-constant schedule of a MultiHerd, with an all-zero frame last for t < 0."""
+    times, frames = herd.segments()
+    frames = np.concatenate([frames, np.zeros((1, n, m))])
+    off = len(frames) - 1
+
+    def index(t):
+        if t < 0:
+            return off
+        return int(np.searchsorted(times, t, side="right")) - 1
+
+    return frames, index, lambda t: _next_end(times, t)
+
+
+def _compile_herd(L, n, m, amp, blocked):
+    herd = MultiHerd([cells_to_mask(t, n, m) for t in L["robots"]], level=L["intensity"] * amp,
+                     pulse_dt=L["pulse_dt"], overlap=L["overlap"], overlap_hold=L["overlap_hold"],
+                     final_hold=L["final_hold"], attract=L["attract"], repel_mode=L["repel_mode"],
+                     repel_level=L["repel_intensity"] * amp,
+                     blocked=blocked | cells_to_mask(L["blocked"], n, m))
+    frames, index, next_change = _herd_table(herd, n, m)
+    return frames, index, next_change, herd
+
+
+def _compile_frames(L, n, m, amp):
+    frames, durations = import_frames(L["source"], n, m, L["mode"], L["levels"], L["polarity"],
+                                      max_fps=L["fps"] or None, pwm_max=amp)
+    frames = frames.astype(float) * L["intensity"]
+    if L["fps"]:
+        durations = np.full(len(frames), 1.0 / L["fps"])
+    ends = np.cumsum(durations)
+    total = float(ends[-1])
+    last = len(frames) - 1
+
+    def index(t):
+        if L["loop"]:
+            t = t % total
+        return min(int(np.searchsorted(ends, max(t, 0.0), side="right")), last)
+
+    def next_change(t):
+        if L["loop"]:
+            return _next_cyclic(ends, total, t)
+        return _next_end(ends[:-1], t)              # the last frame holds forever
+
+    return frames, index, next_change
+
+
+def _compile_wave(L, n, m, amp):
+    """One oscillator per grid cell (amplitude 0 outside the layer's cells)."""
+    mask = cells_to_mask(L["cells"], n, m).ravel()
+    bank = OscillatorBank(n * m, L["shape"], freq=L["freq"],
+                          phase=grid_phase(n, m, L["phase_mode"], L["phase_spread"]),
+                          amp=mask * (L["intensity"] * amp), offset=mask * (L["offset"] * amp),
+                          duty=L["duty"], cycles=L["cycles"])
+    f = L["freq"]
+    next_change = (lambda t: math.inf) if f == 0 or L["intensity"] == 0 else (lambda t: t)   # continuous
+    return bank, mask.reshape(n, m), (lambda t: int(t * f)), next_change     # state: completed cycles
+
+
+class CompiledPattern:
+    """
+    Precompiled pattern: evaluate(t) returns the signed (n, m) level array in
+    PWM units (pos > 0, neg < 0) for t seconds after pattern start;
+    next_transition(t) is the first time after t at which that output can change.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.name = spec["name"]
+        self.shape = spec["grid"]
+        self.pwm_max = spec["pwm_max"]
+        self.send_hz = spec["send_hz"]
+        n, m = self.shape
+        self.blocked = cells_to_mask(spec["blocked"], n, m)
+        self.layers = []
+        self.next_changes = []              # per layer: t -> next time its frame index can change
+        self.herds = {}                     # layer index -> MultiHerd
+        self.waves = {}                     # layer index -> (OscillatorBank, cell mask)
+        for L in spec["layers"]:
+            if L["type"] == "vibrate":
+                frames, index, next_change = _compile_vibrate(L, n, m, self.pwm_max)
+            elif L["type"] == "trap":
+                frames, index, next_change = _compile_trap(L, n, m, self.pwm_max)
+            elif L["type"] == "sequence":
+                frames, index, next_change = _compile_sequence(L, n, m, self.pwm_max)
+            elif L["type"] == "frames":
+                frames, index, next_change = _compile_frames(L, n, m, self.pwm_max)
+            elif L["type"] == "wave":
+                bank, mask, index, next_change = _compile_wave(L, n, m, self.pwm_max)
+                self.waves[len(self.layers)] = (bank, mask)
+                frames = None               # evaluated live, not from a frame table
+            else:
+                frames, index, next_change, herd = _compile_herd(L, n, m, self.pwm_max, self.blocked)
+                self.herds[len(self.layers)] = herd
+            self.layers.append((L["name"], None if frames is None else quantize(frames), index))
+            self.next_changes.append(next_change)
+        # one compositor layer per spec layer, masked to the cells it ever drives
+        self.compositor = Compositor(n, m, pwm_max=self.pwm_max, dtype=np.int8)
+        for k in range(len(self.layers)):
+            self._mask_layer(k)
+
+    @property
+    def distance_maps(self):
+        """Distance to the owning robot's targets (-1 = unreachable), one map per herd layer."""
+        return [h.Dz for _, h in sorted(self.herds.items())]
+
+    def _mask_layer(self, k):
+        frames = self.layers[k][1]
+        drives = self.waves[k][1] if frames is None else (frames != 0).any(axis=0)
+        self.compositor.add_layer(k, mask=drives & ~self.blocked, blend="max", priority=k)
+
+    def set_blocked(self, blocked):
+        """
+        Change the obstacle mask mid-run ((n, m) bool or a list of (row, col) cells): herd
+        layers get new geodesic fields and schedules, blocked cells are forced off.
+        """
+        n, m = self.shape
+        b = np.asarray(blocked)
+        self.blocked = b.copy() if b.dtype == bool and b.shape == (n, m) else cells_to_mask(blocked, n, m)
+        for k, herd in self.herds.items():
+            L = self.spec["layers"][k]
+            herd.set_blocked(self.blocked | cells_to_mask(L["blocked"], n, m))
+            frames, index, next_change = _herd_table(herd, n, m)
+            self.layers[k] = (self.layers[k][0], quantize(frames), index)
+            self.next_changes[k] = next_change
+        for k in range(len(self.layers)):
+            self._mask_layer(k)
+
+    def layer_states(self, t):
+        """Frame index chosen by every layer at time t (useful for status text)."""
+        return [index(t) for _, _, index in self.layers]
+
+    def next_transition(self, t):
+        """
+        Earliest time > t at which any layer changes (math.inf = the output is final).
+        Returns t itself while a wave layer is running (changes continuously).
+        """
+        return min((f(t) for f in self.next_changes), default=math.inf)
+
+    def evaluate(self, t, out=None):
+        for k, (_, frames, index) in enumerate(self.layers):
+            if frames is None:
+                bank = self.waves[k][0]
+                v = bank.at(t)
+                np.clip(v, -self.pwm_max, self.pwm_max, out=v)
+                self.compositor.set(k, v)
+            else:
+                self.compositor.set(k, frames[index(t)])
+        return self.compositor.compose(out)
+
+
+def load_pattern(path):
+    """Read + validate + compile a spec file. Call once, outside the control loop."""
+    return CompiledPattern(validate_spec(read_spec_file(path), os.path.dirname(os.path.abspath(path))))
+
+
+# ---------------------------------------------
+# Output helpers (signed levels -> existing grid / serial formats)
+# ---------------------------------------------
+def levels_to_grid(levels, grid=None):
+    """Signed (n, m) levels -> (n, m, 3) [pos, neg, reserved] grid used by the GUIs."""
+    n, m = levels.shape
+    if grid is None:
+        grid = np.zeros((n, m, 3), dtype=float)
+    grid[:, :, 0] = np.maximum(levels, 0)
+    grid[:, :, 1] = np.maximum(-levels, 0)
+    return grid
+
+
+def get_output_matrix(levels, group=16):
+    """Signed (n, m) levels -> rows of `group` ints in [pos, neg] pair order."""
+    q = quantize(levels).astype(int)
+    flat = np.stack([np.maximum(q, 0), np.maximum(-q, 0)], axis=-1).ravel()
+    pad = (-len(flat)) % group
+    if pad:
+        flat = np.concatenate([flat, np.zeros(pad, dtype=int)])
+    return flat.reshape(-1, group)
@@ -0,0 +1,216 @@
+# SAM LAB, D H HAN
+# Pico firmware emulator on a pseudo terminal + model of its I2C bus
+#
+# Speaks the same serial protocol as magnet_control_arduino.ino:
+#   plain CSV line    -> echoed back (legacy)
+#   "@<seq>,v0,..."   -> "!<seq>,<status>" after the PWM update
+#   "?"               -> "#ID,pwm32,<board id>" (port_discovery.py handshake)
+# and counts the I2C traffic the firmware would generate for every frame, so the
+# fast path (changed channels only, auto-increment block writes, optional 1 MHz)
+# can be checked against the old 64 x setPWM() path without hardware.
+#
+# Usage:
+#   python pico_emulator.py                      # prints the pty path, then per-frame I2C counts
+#   python device_daemon.py --port /dev/pts/N    # or any script, with SERIAL_PORTS = [that path]
+#   python pico_emulator.py --legacy             # model the old firmware (one setPWM per channel)
+#   python pico_emulator.py --fmplus --delay 5   # 1 MHz bus, 5 ms extra processing per line
+#   python pico_emulator.py --realtime           # also spend the modeled I2C bus time per frame
+
+import argparse
+import os
+import pty
+import time
+import tty
+
+import numpy as np
+
+# ================== Config ==================
+N_TOKEN = 64               # values per line (32 coils x pos/neg)
+N_GROUPS = 4               # PCA9685 boards, 16 channels each
+PCA_ADDRS = [0x42, 0x43, 0x44, 0x45]
+BUS_HZ = 400000
+BUS_HZ_FMPLUS = 1000000
+MAX_BLOCK_CH = 7           # firmware MAX_BLOCK_CH (32-byte Wire buffer)
+PWM_SCALE = 409            # 0..10 -> 0..4090
+DEVICE_NAME = "pwm32"
+# ================== Config ==================
+
+
+def parse_line(line):
+    """Firmware parsing of one line -> (seq or None, values[64], count). Mirrors loop()."""
+    line = line.strip()
+    seq = None
+    if line.startswith("@"):
+        head, _, line = line[1:].partition(",")
+        try:
+            seq = int(head)
+        except ValueError:
+            seq = 0            # String.toInt() returns 0 on garbage
+    values = np.zeros(N_TOKEN, dtype=int)
+    count = 0
+    for tok in line.split(",")[:N_TOKEN]:
+        try:
+            values[count] = int(float(tok.strip() or 0))
+        except ValueError:
+            values[count] = 0
+        count += 1
+    return seq, values, count
+
+
+def transaction_bits(n_bytes):
+    """SCL cycles for one write transaction: 9 per byte (address included) + start/stop."""
+    return 9 * n_bytes + 2
+
+
+class PCA9685Bus:
+    """
+    I2C traffic model of the firmware write path.
+    fast_path=False: 64 x setPWM(ch, 0, v) every frame (address + register + 4 data bytes each)
+    fast_path=True : only changed channels, runs of up to max_block channels per transaction
+    """
+
+    def __init__(self, fast_path=True, bus_hz=BUS_HZ, max_block=MAX_BLOCK_CH):
+        self.fast_path = fast_path
+        self.bus_hz = float(bus_hz)
+        self.max_block = int(max_block)
+        self.regs = np.zeros(N_TOKEN, dtype=int)       # what the chips hold now
+        self.last = np.full(N_TOKEN, -1, dtype=int)    # firmware cache, -1 = unknown
+        self.frames = 0
+        self.total_tx = 0
+        self.total_bytes = 0
+        self.total_us = 0.0
+
+    def write_frame(self, values):
+        """Apply one parsed frame. Returns (transactions, bytes, bus time in us) for it."""
+        pwm = np.clip(np.asarray(values, dtype=int)[:N_TOKEN], 0, 10) * PWM_SCALE
+        blocks = []            # (first channel, n channels) per transaction
+        for g in range(N_GROUPS):
+            base = 16 * g
+            if not self.fast_path:
+                blocks += [(base + i, 1) for i in range(16)]
+                continue
+            i = 0
+            while i < 16:
+                if pwm[base + i] == self.last[base + i]:
+                    i += 1
+                    continue
+                run = 1
+                while i + run < 16 and run < self.max_block and pwm[base + i + run] != self.last[base + i + run]:
+                    run += 1
+                blocks.append((base + i, run))
+                i += run
+
+        n_bytes = 0
+        bits = 0
+        for ch0, n in blocks:
+            k = 2 + 4 * n      # address + register + 4 bytes per channel
+            n_bytes += k
+            bits += transaction_bits(k)
+            self.regs[ch0:ch0 + n] = pwm[ch0:ch0 + n]
+            self.last[ch0:ch0 + n] = pwm[ch0:ch0 + n]
+
+        us = 1e6 * bits / self.bus_hz
+        self.frames += 1
+        self.total_tx += len(blocks)
+        self.total_bytes += n_bytes
+        self.total_us += us
+        return len(blocks), n_bytes, us
+
+    def stats(self):
+        f = max(self.frames, 1)
+        return {"frames": self.frames, "tx_per_frame": self.total_tx / f,
+                "bytes_per_frame": self.total_bytes / f, "bus_us_per_frame": self.total_us / f}
+
+
+class PicoEmulator:
+    """Serial side of the firmware: feed() raw bytes, get back what the board would print."""
+
+    def __init__(self, bus, delay=0.0, realtime=False, board_id=None):
+        self.bus = bus
+        self.board_id = f"EMU{os.getpid():08X}" if board_id is None else board_id
+        self.delay = float(delay)
+        self.realtime = bool(realtime)     # block for the modeled bus time, like the real board
+        self.rx = bytearray()
+        self.frame_log = []      # (transactions, bytes, us) per frame since the last drain
+
+    def feed(self, data):
+        self.rx += data
+        out = bytearray()
+        while True:
+            k = self.rx.find(b"\n")
+            if k < 0:
+                break
+            line = bytes(self.rx[:k]).decode("ascii", errors="ignore").strip()
+            del self.rx[:k + 1]
+            out += self.handle_line(line)
+        return bytes(out)
+
+    def handle_line(self, line):
+        if line == "?":
+            return f"#ID,{DEVICE_NAME},{self.board_id}\r\n".encode("ascii")
+        seq, values, count = parse_line(line)
+        reply = b""
+        if seq is None:
+            reply = (line + "\r\n").encode("ascii")
+        if self.delay:
+            time.sleep(self.delay)
+        tx, nb, us = self.bus.write_frame(values)
+        if self.realtime:
+            time.sleep(us / 1e6)
+        self.frame_log.append((tx, nb, us))
+        if seq is not None:
+            reply = b"!%d,%d\r\n" % (seq, 0 if count == N_TOKEN else 1)
+        return reply
+
+
+def open_pty():
+    """Raw pseudo terminal -> (master fd, slave fd, slave path for serial.Serial)."""
+    mfd, sfd = pty.openpty()
+    tty.setraw(sfd)
+    return mfd, sfd, os.ttyname(sfd)
+
+
+def pump(emu, mfd):
+    """Block for the next chunk from the host, answer it. Raises OSError when the pty closes."""
+    reply = emu.feed(os.read(mfd, 4096))
+    if reply:
+        os.write(mfd, reply)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Emulate the Pico coil driver on a pseudo terminal")
+    ap.add_argument("--legacy", action="store_true", help="model the old firmware: 64 setPWM() per frame")
+    ap.add_argument("--fmplus", action="store_true", help="1 MHz I2C (Fast-mode Plus)")
+    ap.add_argument("--delay", type=float, default=0.0, help="extra processing time per line [ms]")
+    ap.add_argument("--quiet", action="store_true", help="summary every 100 frames instead of per frame")
+    ap.add_argument("--realtime", action="store_true", help="spend the modeled I2C bus time per frame")
+    args = ap.parse_args()
+
+    bus = PCA9685Bus(fast_path=not args.legacy, bus_hz=BUS_HZ_FMPLUS if args.fmplus else BUS_HZ)
+    emu = PicoEmulator(bus, delay=args.delay / 1000.0, realtime=args.realtime)
+
+    mfd, sfd, path = open_pty()
+    print("Emulated board on", path)
+    print("I2C model:", "legacy setPWM" if args.legacy else "changed-channel block writes",
+          f"@ {bus.bus_hz / 1e3:.0f} kHz")
+    try:
+        while True:
+            pump(emu, mfd)
+            for tx, nb, us in emu.frame_log:
+                if not args.quiet:
+                    print(f"{tx:2d} transactions, {nb:3d} bytes, {us:7.0f} us")
+            if args.quiet and emu.frame_log and bus.frames % 100 < len(emu.frame_log):
+                s = bus.stats()
+                print(f"{s['frames']} frames: {s['tx_per_frame']:.1f} tx/frame, "
+                      f"{s['bytes_per_frame']:.0f} B/frame, {s['bus_us_per_frame']:.0f} us/frame")
+            emu.frame_log.clear()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Totals:", bus.stats())
+        os.close(mfd)
+        os.close(sfd)
+
+
+if __name__ == "__main__":
+    main()
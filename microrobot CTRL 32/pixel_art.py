@@ -1,14 +1,20 @@
 import pygame
 import numpy as np
 import time
-import serial
+import device_client
+import serial_manager
+from frame_import import import_frames
+from sampling_profiler import SamplingProfiler
 
 # ================== Config ==================
 SERIAL_PORTS = ['/dev/cu.usbmodem1020BA0ABA902']
 # ------------------ Pattern (1-based -> convert to 0-based) ------------------
 ONE_BASED_CELLS = [
-    (2,2), (2,3), (3,2) (3,3)
+    (2,2), (2,3), (3,2), (3,3)
 ]
+# ------------------ Or: image / animated GIF / video (overrides the cells) ------------------
+IMAGE_PATH = None          # e.g. 'art.gif'; dark pixels -> on (frame_import.py)
+IMAGE_LEVELS = 2           # 2 = on/off, 11 = 0..10 from the pixel darkness
 # ================== Config ==================
 
 
@@ -109,6 +115,12 @@ def activate_pattern(grid, cells, direction):
                 grid[i, j] = [0.0, 10.0, 0.0]
 
 
+def apply_levels(grid, levels):
+    # signed (n, m) levels -> [pos, neg] channels
+    grid[:, :, 0] = np.maximum(levels, 0)
+    grid[:, :, 1] = np.maximum(-levels, 0)
+
+
 def get_output_matrix(grid):
     arr = np.round(grid[:, :, :2]).astype(int).reshape(-1, 2)
     flat = arr.flatten()
@@ -121,14 +133,13 @@ def get_output_matrix(grid):
 
 
 def try_open_serial():
-    for port in SERIAL_PORTS:
-        try:
-            ser = serial.Serial(port, SERIAL_BAUD, timeout=0)
-            time.sleep(1.5)
-            print(f"Serial opened: {port}")
-            return ser
-        except Exception:
-            continue
+    ser = device_client.connect()
+    if ser is not None:
+        print("Device daemon connected")
+        return ser
+    ser = serial_manager.open_managed(SERIAL_PORTS, SERIAL_BAUD)
+    if ser is not None:
+        return ser
     print("Serial not found; running without serial output.")
     return None
 
@@ -160,6 +171,14 @@ def main():
 
     grid = create_grid(N_ROWS, N_COLS)
 
+    # image frames are converted once (and cached by content hash); polarity follows `direction`
+    frames, frame_ends = None, None
+    if IMAGE_PATH:
+        frames, durations = import_frames(IMAGE_PATH, N_ROWS, N_COLS, levels=IMAGE_LEVELS, polarity=-direction)
+        frame_ends = np.cumsum(durations)
+        print(f"{IMAGE_PATH}: {len(frames)} frame(s)")
+    t_start = 0.0
+
     start_w, start_h = 180, 60
     stop_w, stop_h = 120, 44
     start_rect = pygame.Rect(0, 0, start_w, start_h)
@@ -168,6 +187,7 @@ def main():
     stop_rect.center = (SCREEN_W // 2, SCREEN_H // 2 + 260 + 70)
 
     running = True
+    profiler = SamplingProfiler()
     started = False
 
     ser = try_open_serial()
@@ -182,17 +202,24 @@ def main():
                     running = False
                 elif event.key == pygame.K_SPACE:
                     started = True
-                    activate_pattern(grid, CELLS, direction)
+                    t_start = time.time()
+                    activate_pattern(grid, CELLS if frames is None else [], direction)
+                elif event.key == pygame.K_F9:
+                    profiler.toggle("prof_pixel_art")
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 mx, my = event.pos
                 if start_rect.collidepoint(mx, my):
                     started = True
-                    activate_pattern(grid, CELLS, direction)
+                    t_start = time.time()
+                    activate_pattern(grid, CELLS if frames is None else [], direction)
                 elif stop_rect.collidepoint(mx, my):
                     clear_all_pwm(grid, ser)
                     running = False
 
         now = time.time()
+        if started and frames is not None:
+            k = int(np.searchsorted(frame_ends, (now - t_start) % frame_ends[-1], side="right"))
+            apply_levels(grid, frames[min(k, len(frames) - 1)])
         if started and (now - last_send) >= 0.5:
             A = get_output_matrix(grid)
             send_matrix_over_serial(A, ser)
@@ -200,7 +227,7 @@ def main():
 
         screen.fill(BG_COLOR)
         draw_text(screen, f"direction = {direction}  (1: negative/red, -1: positive/green)", (20, 8), size=24)
-        draw_text(screen, f"Grid: {N_ROWS} x {N_COLS} | pattern cells: {len(CELLS)}", (20, 34), size=22, color=(200, 220, 200))
+        draw_text(screen, f"Grid: {N_ROWS} x {N_COLS} | pattern cells: {len(CELLS) if frames is None else IMAGE_PATH}", (20, 34), size=22, color=(200, 220, 200))
         draw_grid(screen, grid)
 
         for rect, label in [(start_rect, "Start"), (stop_rect, "Stop")]:
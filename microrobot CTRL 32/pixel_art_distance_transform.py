@@ -7,12 +7,25 @@
 #
 # Coordinate convention:
 # - ONE_BASED_CELLS uses (row, col) with 1-based indexing, where (1,1) is the LEFT-BOTTOM of the grid.
+#
+# Multi-robot: set ROBOT_TARGETS to one target list per robot. The array is split into
+# Voronoi zones (nearest robot target) and every zone runs its own band schedule at the
+# same time (herding.py); ONE_BASED_CELLS is then ignored.
+#
+# HERD_MODE = "mpc": instead of the timed band sweep, every send period the newest robot
+# positions (POSITION_SOURCE: a tracker over UDP / stdin, or "sim" for a dry run) are fed
+# to mpc_herding.py, which rolls out many candidate command sequences at once and sends
+# the first frame of the best one. Robots are drawn as dots; no measurement (or one older
+# than MPC_MAX_AGE) -> all coils off.
 
 import pygame
 import numpy as np
 import time
-import serial
-from collections import deque
+import device_client
+import serial_manager
+from herding import MultiHerd, distance_fields
+from microrobot_sim import Simulator
+from mpc_herding import MPCHerder, open_source
 
 # ================== Config ==================
 SERIAL_PORTS = ['/dev/cu.usbmodem1020BA0ABA902']
@@ -26,6 +39,8 @@ direction = 1  # attraction
 ONE_BASED_CELLS = [
     (2, 4), (3, 4)
 ]
+BLOCKED_CELLS = []          # (row, col) cells never driven or crossed: damaged coils, obstacles, keep-out
+ROBOT_TARGETS = None        # e.g. [[(2, 2)], [(3, 7), (2, 7)]]: one target list per robot
 
 # Herding timing
 HERD_PULSE_DT = 6        # seconds: time between band steps (outside -> inside)
@@ -35,12 +50,19 @@ HERD_OVERLAP_HOLD = HERD_PULSE_DT/2    # seconds: overlap duration
 FINAL_HOLD = True           # keep final target ON continuously after herding
 SERIAL_SEND_DT = 0.10       # seconds: serial update interval (10 Hz)
 PWM_MAX = 10.0              # UI/command magnitude (0..10)
+
+# Herding mode: "bands" (outside -> inside on HERD_PULSE_DT) or "mpc" (closed loop on positions)
+HERD_MODE = "bands"
+POSITION_SOURCE = "sim"     # mpc: "udp:9870", "stdin" or "sim" (robots simulated under the sent frames)
+SIM_START = [(75.0, 5.0)]   # mm, start positions for POSITION_SOURCE = "sim"
+MPC_MAX_AGE = 1.0           # s: older measurements switch the coils off
 # ================== Config ==================
 
 # Convert (1-based, left-bottom origin) -> internal (0-based, top-left origin)
 # N_ROWS is fixed = 4; mapping: i = N_ROWS - row, j = col - 1
 N_ROWS, N_COLS = 4, 8
 CELLS = [(N_ROWS - r, c - 1) for (r, c) in ONE_BASED_CELLS]
+BLOCKED = [(N_ROWS - r, c - 1) for (r, c) in BLOCKED_CELLS]
 
 # UI
 SCREEN_W, SCREEN_H = 800, 800
@@ -108,6 +130,13 @@ def draw_grid(surface, grid):
     pygame.draw.rect(surface, GRID_COLOR, (x0, y0, grid_w, grid_h), 2)
     return (x0, y0, tile)
 
+def draw_robots(surface, positions, geom, pitch):
+    # mm (left-bottom origin) -> screen
+    x0, y0, tile = geom
+    for x, y in positions:
+        center = (int(x0 + x / pitch * tile), int(y0 + (N_ROWS - y / pitch) * tile))
+        pygame.draw.circle(surface, (255, 220, 0), center, max(4, tile // 10))
+
 def get_output_matrix(grid):
     # pack [pos,neg] (2 channels) into rows of 16 ints
     arr = np.round(grid[:, :, :2]).astype(int).reshape(-1, 2)
@@ -120,14 +149,13 @@ def get_output_matrix(grid):
     return A
 
 def try_open_serial():
-    for port in SERIAL_PORTS:
-        try:
-            ser = serial.Serial(port, SERIAL_BAUD, timeout=0)
-            time.sleep(1.5)
-            print(f"Serial opened: {port}")
-            return ser
-        except Exception:
-            continue
+    ser = device_client.connect()
+    if ser is not None:
+        print("Device daemon connected")
+        return ser
+    ser = serial_manager.open_managed(SERIAL_PORTS, SERIAL_BAUD)
+    if ser is not None:
+        return ser
     print("Serial not found; running without serial output.")
     return None
 
@@ -153,24 +181,12 @@ def build_target_mask(n, m, cells):
             mask[i, j] = True
     return mask
 
-def manhattan_distance_to_targets(n, m, target_mask):
-    D = np.full((n, m), np.inf, dtype=float)
-    q = deque()
-    ti, tj = np.where(target_mask)
-    for i, j in zip(ti, tj):
-        D[i, j] = 0
-        q.append((i, j))
-
-    while q:
-        i, j = q.popleft()
-        for di, dj in ((1, 0), (-1, 0), (0, 1), (0, -1)):
-            ni, nj = i + di, j + dj
-            if 0 <= ni < n and 0 <= nj < m and D[ni, nj] > D[i, j] + 1:
-                D[ni, nj] = D[i, j] + 1
-                q.append((ni, nj))
-
-    D[np.isinf(D)] = 0
-    return D.astype(int)
+def manhattan_distance_to_targets(n, m, target_mask, blocked_mask=None):
+    """
+    Geodesic 4-neighbour distance to the targets, routed around blocked cells.
+    Unreachable (and blocked) cells are -1, so they never match a band.
+    """
+    return distance_fields(target_mask[None], blocked_mask)[0]
 
 def apply_sel(grid, sel_mask, direction, amp=PWM_MAX):
     grid[:, :, :2] = 0.0
@@ -214,9 +230,29 @@ def main():
     last_send_t = 0.0
 
     # Target mask and Manhattan distance to target cells
-    target_mask = build_target_mask(N_ROWS, N_COLS, CELLS)
-    D = manhattan_distance_to_targets(N_ROWS, N_COLS, target_mask)
+    blocked_mask = build_target_mask(N_ROWS, N_COLS, BLOCKED)
+    target_mask = build_target_mask(N_ROWS, N_COLS, CELLS) & ~blocked_mask
+    D = manhattan_distance_to_targets(N_ROWS, N_COLS, target_mask, blocked_mask)
     Dmax = int(D.max())
+    herd = None
+    if ROBOT_TARGETS:
+        herd = MultiHerd([build_target_mask(N_ROWS, N_COLS, [(N_ROWS - r, c - 1) for (r, c) in cells])
+                          for cells in ROBOT_TARGETS],
+                         level=-PWM_MAX if direction == 1 else PWM_MAX, pulse_dt=HERD_PULSE_DT,
+                         overlap=HERD_OVERLAP, overlap_hold=HERD_OVERLAP_HOLD, final_hold=FINAL_HOLD,
+                         blocked=blocked_mask)
+        levels = np.zeros((N_ROWS, N_COLS))
+
+    mpc = source = None
+    if HERD_MODE == "mpc":
+        sim = Simulator(N_ROWS, N_COLS, diffusion=0.0, pwm_max=PWM_MAX, moment=direction)
+        goals = ([build_target_mask(N_ROWS, N_COLS, [(N_ROWS - r, c - 1) for (r, c) in cells])
+                  for cells in ROBOT_TARGETS] if ROBOT_TARGETS else [target_mask])
+        mpc = MPCHerder(sim, goals, level=-direction * PWM_MAX, blocked=blocked_mask,
+                        budget=SERIAL_SEND_DT / 2)
+        source = open_source(POSITION_SOURCE, Simulator(N_ROWS, N_COLS, pwm_max=PWM_MAX, moment=direction),
+                             SIM_START)
+        mpc_levels = np.zeros((N_ROWS, N_COLS))
 
     # State
     started = False
@@ -257,7 +293,32 @@ def main():
 
         # ----- Herding logic (pull 주변 -> target) -----
         if started:
-            if state == "herd":
+            if mpc is not None:
+                # closed loop: replan once per send period on the newest measurement
+                if (now - last_send_t) >= SERIAL_SEND_DT:
+                    pos = source.latest()
+                    if pos is None or source.age() > MPC_MAX_AGE:
+                        mpc_levels[:] = 0.0
+                        state = "no position"
+                    else:
+                        mpc.command(pos, out=mpc_levels)
+                        state = f"mpc {mpc.last_ms:.0f} ms"
+                    grid[:, :, 0] = np.maximum(np.round(mpc_levels), 0.0)
+                    grid[:, :, 1] = np.maximum(-np.round(mpc_levels), 0.0)
+                    if hasattr(source, "apply"):
+                        source.apply(np.round(mpc_levels), SERIAL_SEND_DT)
+
+            elif herd is not None:
+                # every zone steps its own bands; the first band goes on immediately
+                t = now - band_last_t - HERD_PULSE_DT
+                herd.evaluate(t, out=levels)
+                grid[:, :, 0] = np.maximum(levels, 0.0)
+                grid[:, :, 1] = np.maximum(-levels, 0.0)
+                band_k = int(herd.schedule(t)[0].max())
+                if t >= herd.duration():
+                    state = "hold" if FINAL_HOLD else "idle"
+
+            elif state == "herd":
                 if (now - band_last_t) >= HERD_PULSE_DT:
                     band_last_t = now
 
@@ -291,12 +352,14 @@ def main():
         # ----- Draw -----
         screen.fill(BG_COLOR)
         draw_text(screen, f"direction={direction}  (1: NEG/red, -1: POS/green)", (20, 10), size=24)
-        draw_text(screen, f"target ONE_BASED_CELLS={ONE_BASED_CELLS}  | state={state}  | k={band_k}", (20, 38), size=22, color=(200, 220, 200))
+        draw_text(screen, f"target {'ROBOT_TARGETS' if herd else 'ONE_BASED_CELLS'}={ROBOT_TARGETS or ONE_BASED_CELLS}  | state={state}  | k={band_k}", (20, 38), size=22, color=(200, 220, 200))
 
         # show D map (optional): comment out if not needed
         # draw_text(screen, f"Dmax={Dmax}", (20, 62), size=18, color=(180, 180, 180))
 
-        draw_grid(screen, grid)
+        geom = draw_grid(screen, grid)
+        if source is not None and source.latest() is not None:
+            draw_robots(screen, source.latest(), geom, mpc.sim.pitch)
 
         # buttons
         for rect, label in [(start_rect, "Start (SPACE)"), (stop_rect, "Stop (ESC)")]:
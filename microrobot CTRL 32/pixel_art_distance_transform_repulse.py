@@ -16,8 +16,10 @@
 import pygame
 import numpy as np
 import time
-import serial
-from collections import deque
+import device_client
+import serial_manager
+from compositor import Compositor
+from herding import distance_fields
 
 # ================== Config ==================
 SERIAL_PORTS = ['/dev/cu.usbmodem1020BA0ABA902']
@@ -31,6 +33,7 @@ direction = 1
 ONE_BASED_CELLS = [
     (2, 4), (2, 5), (3, 4), (3, 5)
 ]
+BLOCKED_CELLS = []          # (row, col) cells never driven or crossed: damaged coils, obstacles, keep-out
 
 # Herding timing (k: Dmax -> 0)
 HERD_PULSE_DT = 5.0            # seconds: time between band steps (outside -> inside)
@@ -58,6 +61,7 @@ REPEL_MODE = "outside_band"
 # N_ROWS is fixed = 4; mapping: i = N_ROWS - row, j = col - 1
 N_ROWS, N_COLS = 4, 8
 CELLS = [(N_ROWS - r, c - 1) for (r, c) in ONE_BASED_CELLS]
+BLOCKED = [(N_ROWS - r, c - 1) for (r, c) in BLOCKED_CELLS]
 
 # UI
 SCREEN_W, SCREEN_H = 800, 800
@@ -134,14 +138,13 @@ def get_output_matrix(grid):
     return A
 
 def try_open_serial():
-    for port in SERIAL_PORTS:
-        try:
-            ser = serial.Serial(port, SERIAL_BAUD, timeout=0)
-            time.sleep(1.5)
-            print(f"Serial opened: {port}")
-            return ser
-        except Exception:
-            continue
+    ser = device_client.connect()
+    if ser is not None:
+        print("Device daemon connected")
+        return ser
+    ser = serial_manager.open_managed(SERIAL_PORTS, SERIAL_BAUD)
+    if ser is not None:
+        return ser
     print("Serial not found; running without serial output.")
     return None
 
@@ -167,50 +170,33 @@ def build_target_mask(n, m, cells):
             mask[i, j] = True
     return mask
 
-def manhattan_distance_to_targets(n, m, target_mask):
-    D = np.full((n, m), np.inf, dtype=float)
-    q = deque()
-    ti, tj = np.where(target_mask)
-    for i, j in zip(ti, tj):
-        D[i, j] = 0
-        q.append((i, j))
-
-    while q:
-        i, j = q.popleft()
-        for di, dj in ((1, 0), (-1, 0), (0, 1), (0, -1)):
-            ni, nj = i + di, j + dj
-            if 0 <= ni < n and 0 <= nj < m and D[ni, nj] > D[i, j] + 1:
-                D[ni, nj] = D[i, j] + 1
-                q.append((ni, nj))
-
-    D[np.isinf(D)] = 0
-    return D.astype(int)
+def manhattan_distance_to_targets(n, m, target_mask, blocked_mask=None):
+    """
+    Geodesic 4-neighbour distance to the targets, routed around blocked cells.
+    Unreachable (and blocked) cells are -1, so they never match a band.
+    """
+    return distance_fields(target_mask[None], blocked_mask)[0]
 
 def clamp_amp(x):
     return float(max(0.0, min(float(PWM_MAX), float(x))))
 
-def apply_attract_and_repel(grid, target_mask, repel_mask, direction, attract_amp, repel_amp):
+def apply_attract_and_repel(grid, comp, repel_mask, direction, attract_amp, repel_amp):
     """
     direction =  1: NEG(red) is attract channel, POS(green) is repel channel
     direction = -1: POS(green) is attract channel, NEG(red) is repel channel
 
-    We set BOTH masks every frame (squeeze).
+    We set BOTH layers every frame (squeeze); the attract layer (target mask,
+    higher priority) overrides the repel layer.
     """
     a = clamp_amp(attract_amp)
     r = clamp_amp(repel_amp)
+    s = -1.0 if direction == 1 else 1.0      # signed level of the attract channel
 
-    grid[:, :, :2] = 0.0  # reset every frame
-
-    if direction == -1:
-        # attract = POS (green)
-        grid[target_mask, 0] = a
-        # repel = NEG (red)
-        grid[repel_mask, 1] = r
-    else:
-        # attract = NEG (red)
-        grid[target_mask, 1] = a
-        # repel = POS (green)
-        grid[repel_mask, 0] = r
+    comp.set("attract", s * a)
+    comp.set("repel", np.where(repel_mask, -s * r, 0.0))
+    levels = comp.compose()
+    grid[:, :, 0] = np.maximum(levels, 0.0)
+    grid[:, :, 1] = np.maximum(-levels, 0.0)
 
 def band_masks(D, k, overlap):
     """
@@ -242,10 +228,16 @@ def main():
     last_send_t = 0.0
 
     # Target mask and Manhattan distance to target cells
-    target_mask = build_target_mask(N_ROWS, N_COLS, CELLS)
-    D = manhattan_distance_to_targets(N_ROWS, N_COLS, target_mask)
+    blocked_mask = build_target_mask(N_ROWS, N_COLS, BLOCKED)
+    target_mask = build_target_mask(N_ROWS, N_COLS, CELLS) & ~blocked_mask
+    D = manhattan_distance_to_targets(N_ROWS, N_COLS, target_mask, blocked_mask)
     Dmax = int(D.max())
 
+    # layers: repel (any cells, set per frame) under attract (fixed target mask)
+    comp = Compositor(N_ROWS, N_COLS, pwm_max=PWM_MAX)
+    comp.add_layer("repel", blend="override", priority=0)
+    comp.add_layer("attract", mask=target_mask, blend="override", priority=1)
+
     # State
     started = False
     state = "idle"        # "idle" -> "herd" -> "hold"
@@ -306,7 +298,7 @@ def main():
 
                 # Build repel_mask
                 if REPEL_MODE == "complement":
-                    repel_mask = (~target_mask)
+                    repel_mask = (~target_mask) & (D >= 0)      # reachable cells only
                 else:
                     # "outside_band": repel everything outside the current band toward target (exclude target)
                     # push from far to near: D >= k_use+1
@@ -315,7 +307,7 @@ def main():
                 # Apply BOTH: target attraction + opposite-polarity repulsion squeeze
                 apply_attract_and_repel(
                     grid,
-                    target_mask=target_mask,
+                    comp,
                     repel_mask=repel_mask,
                     direction=direction,
                     attract_amp=ATTRACT_AMP,
@@ -325,10 +317,10 @@ def main():
             elif state == "hold":
                 # Keep squeezing in hold if desired:
                 # Here: complement squeeze (strong). If you want only target hold, set repel_mask to all False.
-                repel_mask = (~target_mask) if REPEL_MODE == "complement" else ((D >= 1) & (~target_mask))
+                repel_mask = ((~target_mask) & (D >= 0)) if REPEL_MODE == "complement" else ((D >= 1) & (~target_mask))
                 apply_attract_and_repel(
                     grid,
-                    target_mask=target_mask,
+                    comp,
                     repel_mask=repel_mask,
                     direction=direction,
                     attract_amp=ATTRACT_AMP,
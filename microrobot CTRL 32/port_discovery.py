@@ -0,0 +1,208 @@
+# SAM LAB, D H HAN
+# Serial port discovery: enumerate, probe all candidates at once, cache the last good board
+#
+# Candidates = the cached last-known-good port, the ports a script lists in SERIAL_PORTS,
+# then every enumerated USB serial port that looks like a Pico / Arduino (USB VID, or
+# ttyACM* / cu.usbmodem* / COM* names). Ports that don't exist on this machine (e.g. the
+# macOS paths on a Linux box) simply fail to open and drop out.
+#
+# Each candidate is opened on its own thread and asked "?" every QUERY_INTERVAL until
+# it answers or PROBE_TIMEOUT runs out:
+#   "#ID,pwm32,<board id>"  current firmware (board id = the RP2040 flash unique id)
+#   "?"                     older firmware echoing the line -> accepted, id ""
+# Anything else (another USB serial gadget) never matches and is closed. The winning
+# port stays open (no second open / reset) and is written to the cache, so the next
+# start usually takes one probe round trip.
+#
+# Usage:
+#   ser = open_device(SERIAL_PORTS, SERIAL_BAUD)       # serial.Serial or None
+#   python port_discovery.py                            # list + probe, print what answers
+#   python port_discovery.py --forget                   # drop the cache
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+from serial.tools import list_ports
+
+# ================== Config ==================
+SERIAL_BAUD = 115200
+PROBE_TIMEOUT = 2.0        # seconds a candidate gets to answer (covers a reset-on-open boot)
+QUERY_INTERVAL = 0.1       # re-send "?" this often while waiting
+USB_VIDS = (0x2E8A, 0x2341, 0x239A)   # Raspberry Pi (Pico), Arduino, Adafruit
+PORT_PREFIXES = ("/dev/ttyACM", "/dev/cu.usbmodem", "/dev/tty.usbmodem", "COM")
+CACHE_DIR = os.environ.get("PWM32_CACHE", os.path.join(tempfile.gettempdir(), "pwm32_cache"))
+CACHE_FILE = os.path.join(CACHE_DIR, "last_port.json")
+# ================== Config ==================
+
+ID_QUERY = b"?\n"
+ID_REPLY = "#ID,"
+
+
+def load_cache():
+    try:
+        with open(CACHE_FILE) as fh:
+            c = json.load(fh)
+        return c if isinstance(c, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(port, device_id):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = CACHE_FILE + ".tmp"
+        with open(tmp, "w") as fh:
+            json.dump({"port": port, "device_id": device_id, "time": time.time()}, fh)
+        os.replace(tmp, CACHE_FILE)
+    except OSError:
+        pass
+
+
+def forget_cache():
+    try:
+        os.remove(CACHE_FILE)
+    except OSError:
+        pass
+
+
+def candidate_ports(ports=(), cache=None):
+    """Ordered, de-duplicated candidates: cached port, given ports, enumerated boards."""
+    out = []
+    if cache and cache.get("port"):
+        out.append(cache["port"])
+    out += list(ports)
+    for p in list_ports.comports():
+        if p.vid in USB_VIDS or p.device.startswith(PORT_PREFIXES):
+            out.append(p.device)
+    return list(dict.fromkeys(out))
+
+
+def parse_reply(line):
+    """One reply line -> board id ("" for the legacy echo), or None if it isn't our board."""
+    line = line.strip()
+    if line.startswith(ID_REPLY):
+        parts = line.split(",")
+        return parts[2] if len(parts) > 2 else ""
+    if line == "?":
+        return ""
+    return None
+
+
+def probe(port, baud=SERIAL_BAUD, timeout=PROBE_TIMEOUT, cancel=None):
+    """Open `port` and wait for an ID reply -> (open serial.Serial, board id) or None."""
+    try:
+        ser = serial.Serial(port, baud, timeout=0)
+    except (OSError, serial.SerialException, ValueError):
+        return None
+    deadline = time.monotonic() + timeout
+    buf = b""
+    next_q = 0.0
+    try:
+        while time.monotonic() < deadline and not (cancel is not None and cancel.is_set()):
+            now = time.monotonic()
+            if now >= next_q:
+                ser.write(ID_QUERY)
+                next_q = now + QUERY_INTERVAL
+            buf += ser.read(ser.in_waiting or 1)
+            while b"\n" in buf:
+                line, buf = buf.split(b"\n", 1)
+                dev = parse_reply(line.decode("ascii", errors="ignore"))
+                if dev is not None:
+                    time.sleep(0.02)               # let replies to the repeated "?" arrive
+                    ser.reset_input_buffer()
+                    return ser, dev
+            time.sleep(0.005)
+    except (OSError, serial.SerialException):
+        pass
+    ser.close()
+    return None
+
+
+def discover(ports=(), baud=SERIAL_BAUD, device_id=None, timeout=PROBE_TIMEOUT, use_cache=True):
+    """
+    Probe every candidate concurrently -> (serial.Serial, port, board id) or None.
+    device_id: only accept that board. Otherwise the cached board wins when it answers,
+    else the first board to answer.
+    """
+    cache = load_cache() if use_cache else {}
+    cands = candidate_ports(ports, cache)
+    if not cands:
+        return None
+    want = device_id if device_id is not None else cache.get("device_id") or None
+    cancel = threading.Event()
+    found = []
+    done = threading.Condition()
+
+    def run(port):
+        r = probe(port, baud, timeout, cancel)
+        with done:
+            if r is not None:
+                found.append((r[0], port, r[1]))
+            done.notify_all()
+        return r
+
+    best = None
+    with ThreadPoolExecutor(max_workers=len(cands)) as pool:
+        futures = [pool.submit(run, p) for p in cands]
+        with done:
+            while True:
+                match = [f for f in found if want is None or f[2] == want]
+                if match:
+                    best = match[0]
+                    break
+                if all(f.done() for f in futures):
+                    if device_id is None and found:
+                        best = found[0]        # cached board is gone; take any board
+                    break
+                done.wait(0.05)
+        cancel.set()
+    for f in found:
+        if f is not best:
+            f[0].close()
+    if best is not None and use_cache:
+        save_cache(best[1], best[2])
+    return best
+
+
+def open_device(ports=(), baud=SERIAL_BAUD, device_id=None, timeout=PROBE_TIMEOUT):
+    """Drop-in for the scripts' open loop: the board's open serial.Serial, or None."""
+    r = discover(ports, baud, device_id, timeout)
+    if r is None:
+        return None
+    ser, port, dev = r
+    print(f"Serial opened: {port}" + (f" (board {dev})" if dev else ""))
+    return ser
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Find the coil driver board among the serial ports")
+    ap.add_argument("--port", action="append", default=[], help="extra candidate port (repeatable)")
+    ap.add_argument("--id", default=None, help="only accept this board id")
+    ap.add_argument("--timeout", type=float, default=PROBE_TIMEOUT)
+    ap.add_argument("--forget", action="store_true", help="delete the cached last-known-good port")
+    args = ap.parse_args()
+
+    if args.forget:
+        forget_cache()
+        print("Cache cleared:", CACHE_FILE)
+        return
+    print("Cached:", load_cache() or "none")
+    print("Candidates:", ", ".join(candidate_ports(args.port, load_cache())) or "none")
+    t0 = time.monotonic()
+    r = discover(args.port, device_id=args.id, timeout=args.timeout)
+    dt = 1e3 * (time.monotonic() - t0)
+    if r is None:
+        print(f"No board answered ({dt:.0f} ms)")
+        return
+    r[0].close()
+    print(f"Board {r[2] or '(legacy firmware)'} on {r[1]} ({dt:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+# SAM LAB, D H HAN
+# Spec-driven pattern runner (replaces copy-and-edit of the experiment scripts)
+#
+# Usage:
+#   python run_pattern.py patterns/activate_re.json
+#   python run_pattern.py patterns/herd_pull.json --port /dev/ttyACM0
+#
+# - The spec is loaded, validated and compiled ONCE at startup (pattern_spec.py);
+#   the loop only evaluates the compiled pattern.
+# - The control loop runs in its own process and publishes every frame it sends on the
+#   shared-memory frame bus (frame_bus.py). The pygame window only reads the newest
+#   frame at FPS, so rendering can never delay the coils; `python frame_bus.py
+#   monitor|record` can watch the same run.
+# - Event-driven: the loop asks the compiled pattern for its next transition
+#   (pattern_spec.next_transition: period / duty edges, sequence steps, herding pulse
+#   times, frame durations), sleeps until then and recomposes + sends only there. In
+#   between the last frame is resent every KEEPALIVE_S without recomposing (daemon
+#   leases, a board that reset). send_hz caps the rate; wave layers, which change
+#   continuously, are recomposed every send period as before.
+# - --headless: control loop only, in this process (no window).
+# - F9 / --profile PREFIX: sampling profiler (sampling_profiler.py) on the control loop
+#   and the viewer; F9 starts / stops it, --profile records the whole run. Dumps
+#   PREFIX_control_*.collapsed / .txt (and PREFIX_viewer_* for the window).
+# - SPACE: restart the pattern clock (e.g. re-run a herding sweep)
+# - F: toggle the live field map (Bz of the current command, field_basis.py) over the tiles
+# - ESC / close: send all zeros and exit.
+
+import argparse
+import multiprocessing as mp
+import time
+
+import numpy as np
+import pygame
+
+import device_client
+import serial_manager
+from field_basis import FieldBasis, field_rgb
+from frame_bus import FrameBus, BUS_NAME
+from sampling_profiler import SamplingProfiler
+from frame_codec import levels_to_csv_line
+from pattern_spec import load_pattern, levels_to_grid
+
+# ================== Config ==================
+SERIAL_PORTS = ['/dev/cu.usbmodem1020BA0ABA902']
+SERIAL_BAUD = 115200
+KEEPALIVE_S = 0.5          # resend the unchanged frame this often between transitions
+FIELD_ALPHA = 170          # opacity of the field map overlay (0..255)
+PROFILE_PREFIX = "prof_run_pattern"
+# ================== Config ==================
+
+# UI
+SCREEN_W, SCREEN_H = 800, 550
+FPS = 30
+BG_COLOR   = (30, 30, 30)
+GRID_COLOR = (80, 80, 80)
+POS_COLOR  = (255, 0, 0)
+NEG_COLOR  = (0, 0, 255)
+TEXT_COLOR = (255, 255, 255)
+
+# ---------------------------------------------
+# Helpers
+# ---------------------------------------------
+def draw_text(surface, text, pos, center=False, size=18, color=TEXT_COLOR):
+    f = pygame.font.SysFont(None, size)
+    img = f.render(str(text), True, color)
+    rect = img.get_rect()
+    if center:
+        rect.center = pos
+    else:
+        rect.topleft = pos
+    surface.blit(img, rect)
+
+def get_dynamic_tile_size(n, m):
+    tile_size = min((SCREEN_W - 20)//m, (SCREEN_H - 180)//n)
+    return max(4, tile_size)
+
+def draw_grid(screen, grid, pwm_max):
+    n, m, _ = grid.shape
+    tile = get_dynamic_tile_size(n, m)
+    grid_w, grid_h = m * tile, n * tile
+    x0 = (SCREEN_W - grid_w) // 2
+    y0 = 20
+    for i in range(n):
+        for j in range(m):
+            x = x0 + j * tile
+            y = y0 + i * tile
+            pos_val, neg_val, _ = grid[i, j]
+            if pos_val > 0 or neg_val > 0:
+                val, color = (pos_val, POS_COLOR) if pos_val > 0 else (neg_val, NEG_COLOR)
+                alpha = int(np.clip(255.0 * (val / max(pwm_max, 1e-6)), 25, 255))
+                surf = pygame.Surface((tile - 2, tile - 2), pygame.SRCALPHA)
+                surf.fill((*color, alpha))
+                screen.blit(surf, (x, y))
+            else:
+                pygame.draw.rect(screen, GRID_COLOR, (x, y, tile - 2, tile - 2))
+    return x0, y0 + grid_h
+
+def draw_field(screen, basis, levels, pwm_max, surf):
+    """Field map of `levels` scaled over the tile area (one mat-vec per frame)."""
+    n, m = levels.shape
+    tile = get_dynamic_tile_size(n, m)
+    x0 = (SCREEN_W - m * tile) // 2
+    pygame.surfarray.blit_array(surf, field_rgb(basis.field(levels), basis.vmax * pwm_max).swapaxes(0, 1))
+    img = pygame.transform.smoothscale(surf, (m * tile - 2, n * tile - 2))
+    img.set_alpha(FIELD_ALPHA)
+    screen.blit(img, (x0, 20))
+
+def try_open_serial(ports):
+    ser = device_client.connect()
+    if ser is not None:
+        print("Device daemon connected")
+        return ser
+    ser = serial_manager.open_managed(ports, SERIAL_BAUD)
+    if ser is not None:
+        return ser
+    print("Serial not found; running without serial output.")
+    return None
+
+def send_levels_over_serial(levels, ser):
+    # int8 levels -> firmware CSV line (same bytes as the old get_output_matrix() path)
+    send_line_over_serial(levels_to_csv_line(levels), ser)
+
+def send_line_over_serial(line, ser):
+    if ser is None:
+        return
+    try:
+        ser.write(line)
+    except Exception as e:
+        print("Serial write error:", e)
+
+# ---------------------------------------------
+# Control process
+# ---------------------------------------------
+def control_loop(spec, ports, bus_name, t0, stop, profile, prefix=PROFILE_PREFIX, wake=None):
+    """
+    Recompose and send at the pattern's transitions (at most send_hz, keepalive resends
+    in between) until `stop` is set, publishing every frame sent.
+    `t0` (shared double) is the pattern clock origin; the viewer resets it on SPACE and
+    sets `wake` so the new clock is picked up at once. The profiler runs while the
+    `profile` event is set.
+    """
+    profiler = SamplingProfiler()
+    pattern = load_pattern(spec)
+    n, m = pattern.shape
+    period = 1.0 / pattern.send_hz
+    wait = (wake or stop).wait
+    levels = np.zeros((n, m), dtype=np.int8)
+    bus = FrameBus.create(n, m, bus_name)
+    ser = try_open_serial(ports)
+    try:
+        origin = None
+        t_next = 0.0                            # pattern time of the next recompose
+        last_frame = last_send = -float("inf")  # monotonic time of the last recompose / send
+        while not stop.is_set():
+            if wake is not None:
+                wake.clear()
+            if profile.is_set() != profiler.running:
+                profiler.toggle(prefix + "_control")
+            now = time.monotonic()
+            t = time.time() - t0.value
+            if t0.value != origin:              # start / SPACE: recompose from the new clock
+                origin, t_next = t0.value, t
+            send = now - last_send >= KEEPALIVE_S
+            if t >= t_next and now - last_frame >= period:
+                pattern.evaluate(t, out=levels)
+                t_next = pattern.next_transition(t)
+                line = levels_to_csv_line(levels)
+                last_frame, send = now, True
+            if send:
+                send_line_over_serial(line, ser)
+                bus.publish(levels, pattern_t=t)
+                last_send = now
+            # sleep to the next transition (not before the send period is up) or keepalive
+            due = max(t_next - t, last_frame + period - now)
+            wait(max(min(due, last_send + KEEPALIVE_S - now), 0.0))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if ser is not None:
+            try:
+                send_levels_over_serial(np.zeros((n, m), dtype=np.int8), ser)
+                ser.close()
+            except Exception:
+                pass
+        bus.close()
+        if profiler.running:
+            profiler.toggle(prefix + "_control")
+
+# ---------------------------------------------
+# Main (viewer)
+# ---------------------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Run a declarative coil pattern spec")
+    ap.add_argument("spec", help="pattern spec file (.json / .yaml)")
+    ap.add_argument("--port", action="append", help="serial port (repeatable); default: SERIAL_PORTS")
+    ap.add_argument("--bus", default=BUS_NAME, help="shared-memory frame bus name")
+    ap.add_argument("--headless", action="store_true", help="no window: run the control loop in this process")
+    ap.add_argument("--profile", nargs="?", const=PROFILE_PREFIX, default=None, metavar="PREFIX",
+                    help="sampling-profile the control loop for the whole run")
+    args = ap.parse_args()
+
+    ports = args.port or SERIAL_PORTS
+    prefix = args.profile or PROFILE_PREFIX
+    t0 = mp.Value("d", time.time(), lock=False)
+    stop = mp.Event()
+    wake = mp.Event()
+    profile = mp.Event()
+    if args.profile:
+        profile.set()
+    if args.headless:
+        control_loop(args.spec, ports, args.bus, t0, stop, profile, prefix)
+        return
+
+    pattern = load_pattern(args.spec)           # viewer copy: name, pwm_max, layer states
+    n, m = pattern.shape
+    grid = np.zeros((n, m, 3), dtype=float)
+    levels = np.zeros((n, m), dtype=np.int8)
+
+    proc = mp.Process(target=control_loop, args=(args.spec, ports, args.bus, t0, stop, profile, prefix, wake),
+                      daemon=True)
+    proc.start()
+    bus = FrameBus.attach(args.bus, timeout=10.0)
+
+    pygame.init()
+    screen = pygame.display.set_mode((SCREEN_W, SCREEN_H))
+    pygame.display.set_caption(f"pattern: {pattern.name}")
+    clock = pygame.time.Clock()
+
+    basis = FieldBasis(n, m)
+    field_surf = pygame.Surface((basis.shape[1], basis.shape[0]))
+    show_field = False
+    profiler = SamplingProfiler()
+    last_seq, last_rate_t, rate = 0, time.monotonic(), 0.0
+
+    running = True
+    while running and proc.is_alive():
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    running = False
+                elif event.key == pygame.K_SPACE:
+                    t0.value = time.time()
+                    wake.set()
+                elif event.key == pygame.K_f:
+                    show_field = not show_field
+                elif event.key == pygame.K_F9:
+                    profiler.toggle(prefix + "_viewer")
+                    if profiler.running:
+                        profile.set()
+                    else:
+                        profile.clear()
+                    wake.set()
+
+        # zero-copy read; fall back to a copy if the writer lapped us meanwhile
+        seq, _, view = bus.read(copy=False)
+        levels[:] = view
+        if not bus.valid(seq):
+            seq, _, view = bus.read()
+            levels[:] = view
+        t = time.time() - t0.value              # frames are only published at transitions
+        levels_to_grid(levels, grid)
+
+        now = time.monotonic()
+        if now - last_rate_t >= 1.0:
+            rate = (seq - last_seq) / (now - last_rate_t)
+            last_seq, last_rate_t = seq, now
+
+        screen.fill(BG_COLOR)
+        _, y = draw_grid(screen, grid, pattern.pwm_max)
+        if show_field:
+            draw_field(screen, basis, levels, pattern.pwm_max, field_surf)
+        draw_text(screen, f"spec: {args.spec}  |  {pattern.name}", (20, y + 20))
+        draw_text(screen, f"t={t:7.2f}s  send={pattern.send_hz:g}Hz (sent {rate:4.1f}/s)  layer states={pattern.layer_states(t)}", (20, y + 44))
+        draw_text(screen, "SPACE: restart   F: field map   F9: profiler" + (" (ON)" if profiler.running else "") + "   ESC: stop",
+                  (20, y + 68), color=(200, 220, 200))
+
+        pygame.display.flip()
+        clock.tick(FPS)
+
+    if profiler.running:
+        profiler.toggle(prefix + "_viewer")
+    stop.set()
+    wake.set()
+    proc.join(timeout=2.0)
+    view = None                                 # release the shared-memory view before closing
+    bus.close()
+    pygame.quit()
+
+if __name__ == "__main__":
+    main()
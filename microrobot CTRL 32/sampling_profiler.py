@@ -0,0 +1,161 @@
+# SAM LAB, D H HAN
+# On-demand sampling profiler for a running control loop / GUI
+#
+# Every INTERVAL seconds of wall time the target thread's Python stack is recorded and
+# each distinct stack is counted. Nothing is instrumented, so the profiled loop runs at
+# full speed; at the default 5 ms interval one sample costs tens of microseconds
+# (< 1 % of one core) and it can stay on during an experiment.
+# - main thread (all the GUIs / control loops here): an interval timer (SIGALRM) stops
+#   the loop between bytecodes, so samples land where the time is actually spent
+# - any other thread, or no setitimer (Windows): a daemon thread reads
+#   sys._current_frames(); it only gets the GIL when the target releases it, so
+#   samples are biased toward blocking calls (sleep, I/O)
+#
+# Output of dump(prefix):
+#   <prefix>_<time>.collapsed   one "outer;inner;leaf count" line per stack
+#                               (flamegraph.pl / speedscope / inferno input)
+#   <prefix>_<time>.txt         top functions by self and total time
+#
+# Usage:
+#   prof = SamplingProfiler()                 # profiles the calling thread
+#   ... on a hotkey:  prof.toggle("prof_gui") # 1st press starts, 2nd stops, dumps, prints the summary
+#   python run_pattern.py spec.json --headless --profile prof_run
+
+import collections
+import os
+import signal
+import sys
+import threading
+import time
+
+# ================== Config ==================
+INTERVAL = 0.005           # seconds between samples
+MAX_DEPTH = 64             # frames kept per sample (innermost)
+TOP = 15                   # rows in the summary
+# ================== Config ==================
+
+
+class SamplingProfiler:
+    def __init__(self, interval=INTERVAL, thread_id=None, max_depth=MAX_DEPTH):
+        self.interval = float(interval)
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.max_depth = max_depth
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.t_start = 0.0
+        self.t_stop = 0.0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._old_handler = None
+        self._running = False
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def use_timer(self):
+        return (hasattr(signal, "setitimer") and self.thread_id == threading.main_thread().ident
+                and threading.get_ident() == self.thread_id)
+
+    def start(self):
+        if self.running:
+            return
+        self.stacks.clear()
+        self.samples = 0
+        self.t_start = time.time()
+        self.t_stop = 0.0
+        self._running = True
+        if self.use_timer:
+            self._old_handler = signal.signal(signal.SIGALRM, self._on_timer)
+            signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+        else:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        if self._thread is None:
+            signal.setitimer(signal.ITIMER_REAL, 0.0)
+            signal.signal(signal.SIGALRM, self._old_handler or signal.SIG_DFL)
+        else:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self._running = False
+        self.t_stop = time.time()
+
+    def toggle(self, prefix="profile"):
+        """Start, or stop + dump + print the summary. Returns the dumped paths (or None on start)."""
+        if not self.running:
+            self.start()
+            print(f"Profiler started ({1e3 * self.interval:g} ms interval)")
+            return None
+        self.stop()
+        paths = self.dump(prefix)
+        print(self.summary())
+        print("Profile written:", ", ".join(paths))
+        return paths
+
+    # ----- sampling -----
+    def _label(self, code):
+        s = self._labels.get(code)
+        if s is None:
+            s = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = s
+        return s
+
+    def _sample(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            stack.append(self._label(frame.f_code))
+            frame = frame.f_back
+        self.stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def _on_timer(self, signum, frame):
+        self._sample(frame)
+
+    def _run(self):
+        tid = self.thread_id
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(tid)
+            if frame is None:
+                break                          # target thread is gone
+            self._sample(frame)
+            frame = None                       # don't keep the target's frames alive
+
+    # ----- reports -----
+    def functions(self):
+        """-> (self counts, total counts) per function label."""
+        own, total = collections.Counter(), collections.Counter()
+        for stack, cnt in self.stacks.items():
+            own[stack[-1]] += cnt
+            for f in set(stack):
+                total[f] += cnt
+        return own, total
+
+    def summary(self, top=TOP):
+        n = max(self.samples, 1)
+        secs = (self.t_stop or time.time()) - self.t_start
+        own, total = self.functions()
+        lines = [f"{self.samples} samples over {secs:.1f} s",
+                 f"{'self %':>7} {'total %':>8}  function"]
+        for f, c in own.most_common(top):
+            lines.append(f"{100.0 * c / n:7.1f} {100.0 * total[f] / n:8.1f}  {f}")
+        return "\n".join(lines)
+
+    def write_collapsed(self, path):
+        with open(path, "w") as fh:
+            for stack, cnt in sorted(self.stacks.items()):
+                fh.write(";".join(s.replace(";", ":") for s in stack) + f" {cnt}\n")
+
+    def dump(self, prefix="profile"):
+        base = f"{prefix}_{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.t_start))}"
+        self.write_collapsed(base + ".collapsed")
+        with open(base + ".txt", "w") as fh:
+            fh.write(self.summary(top=50) + "\n")
+        return base + ".collapsed", base + ".txt"
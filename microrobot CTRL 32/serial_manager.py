@@ -0,0 +1,208 @@
+# SAM LAB, D H HAN
+# Connection manager: a serial port that survives USB glitches and unplug / replug
+#
+# ManagedSerial wraps the open serial.Serial and is a drop-in `ser` for the scripts
+# (write / read / in_waiting / readline / reset_input_buffer / close). A supervisor
+# thread watches the link:
+# - a write or read that raises (SerialException / OSError), or the device node
+#   vanishing, marks the link DOWN; writes no longer raise, the newest line is kept
+# - while down it re-runs port discovery (port_discovery.py, same board id, any port
+#   -- the board may come back as ttyACM1) with exponential backoff
+# - on reconnect the newest full frame is written immediately, so the coils are back
+#   in the commanded state without waiting for the script's next send
+# Every script line is a complete frame, so resending the newest line is a full resync.
+#
+# metrics(): outages, total / last / max outage time, writes dropped while down;
+# printed on close() when there was an outage.
+#
+# Usage:
+#   ser = open_managed(SERIAL_PORTS, SERIAL_BAUD)   # ManagedSerial or None (no board found)
+#   ser.write(line)                                 # never raises
+#   ser.metrics()
+
+import os
+import threading
+import time
+
+import serial
+
+import port_discovery
+
+# ================== Config ==================
+BACKOFF_MIN = 0.05         # first retry delay after a failed reconnect attempt [s]
+BACKOFF_MAX = 1.0          # retry delay cap [s]
+CHECK_INTERVAL = 0.2       # device-node presence check while up [s]
+RECONNECT_TIMEOUT = 2.0    # handshake wait per attempt (covers the board booting)
+# ================== Config ==================
+
+LINK_ERRORS = (serial.SerialException, OSError)
+
+
+class ManagedSerial:
+    def __init__(self, ser, port, device_id="", ports=(), baud=port_discovery.SERIAL_BAUD,
+                 on_reconnect=None):
+        self.ser = ser
+        self.port = port
+        self.device_id = device_id
+        self.ports = list(ports)
+        self.baud = baud
+        self.on_reconnect = on_reconnect          # callback(ManagedSerial), called from the supervisor
+        self.up = True
+        self.last_line = None                     # newest frame written or pending
+        self.outages = 0
+        self.dropped = 0
+        self.downtime = 0.0
+        self.last_outage = 0.0
+        self.max_outage = 0.0
+        self.t_down = 0.0
+        self.last_error = ""
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._supervise, name="serial-manager", daemon=True)
+        self._thread.start()
+
+    # ----- serial.Serial surface -----
+    def write(self, data):
+        with self._lock:
+            self.last_line = bytes(data)
+            if not self.up:
+                self.dropped += 1
+                return len(data)
+            try:
+                return self.ser.write(data)
+            except LINK_ERRORS as e:
+                self._mark_down(e)
+                self.dropped += 1
+                return len(data)
+
+    def _io(self, fn, default):
+        with self._lock:
+            if not self.up:
+                return default
+            try:
+                return fn(self.ser)
+            except LINK_ERRORS as e:
+                self._mark_down(e)
+                return default
+
+    @property
+    def in_waiting(self):
+        return self._io(lambda s: s.in_waiting, 0)
+
+    @property
+    def out_waiting(self):
+        return self._io(lambda s: s.out_waiting, 0)
+
+    def read(self, size=1):
+        return self._io(lambda s: s.read(size), b"")
+
+    def readline(self):
+        return self._io(lambda s: s.readline(), b"")
+
+    def reset_input_buffer(self):
+        self._io(lambda s: s.reset_input_buffer(), None)
+
+    def fileno(self):
+        return self.ser.fileno()
+
+    def close(self):
+        self._closed.set()
+        self._wake.set()
+        self._thread.join()
+        with self._lock:
+            if self.up:
+                try:
+                    self.ser.close()
+                except LINK_ERRORS:
+                    pass
+        if self.outages:
+            m = self.metrics()
+            print(f"Serial: {m['outages']} outage(s), {m['downtime_s']:.2f} s down in total "
+                  f"(max {m['max_outage_s']:.2f} s), {m['dropped_writes']} frames dropped while down")
+
+    # ----- state -----
+    def _mark_down(self, err):
+        # caller holds the lock
+        if not self.up:
+            return
+        self.up = False
+        self.t_down = time.monotonic()
+        self.outages += 1
+        self.last_error = str(err)
+        print(f"Serial link lost ({err}); reconnecting")
+        try:
+            self.ser.close()
+        except LINK_ERRORS:
+            pass
+        self._wake.set()
+
+    def _node_gone(self):
+        return self.port.startswith("/dev/") and not os.path.exists(self.port)
+
+    def _supervise(self):
+        delay = BACKOFF_MIN
+        while not self._closed.is_set():
+            if self.up:
+                self._wake.wait(CHECK_INTERVAL)
+                self._wake.clear()
+                if self._node_gone():
+                    with self._lock:
+                        self._mark_down("device disappeared")
+                continue
+            r = port_discovery.discover([self.port] + self.ports, self.baud, device_id=self.device_id or None,
+                                        timeout=RECONNECT_TIMEOUT)
+            if r is None:
+                self._closed.wait(delay)
+                delay = min(2 * delay, BACKOFF_MAX)
+                continue
+            delay = BACKOFF_MIN
+            if self._closed.is_set():
+                r[0].close()
+                break
+            self._install(*r)
+
+    def _install(self, ser, port, device_id):
+        with self._lock:
+            resync_err = None
+            if self.last_line is not None:
+                try:
+                    ser.write(self.last_line)          # resync: newest full frame right away
+                except LINK_ERRORS as e:
+                    resync_err = e
+            if resync_err is not None:
+                try:
+                    ser.close()
+                except LINK_ERRORS:
+                    pass
+                return
+            self.ser, self.port = ser, port
+            self.device_id = device_id or self.device_id
+            self.up = True
+            self.last_outage = time.monotonic() - self.t_down
+            self.downtime += self.last_outage
+            self.max_outage = max(self.max_outage, self.last_outage)
+        print(f"Serial link back on {port} after {self.last_outage:.2f} s")
+        if self.on_reconnect is not None:
+            self.on_reconnect(self)
+
+    def metrics(self):
+        with self._lock:
+            down_now = 0.0 if self.up else time.monotonic() - self.t_down
+            return {
+                "up": self.up, "port": self.port, "device_id": self.device_id,
+                "outages": self.outages, "downtime_s": self.downtime + down_now,
+                "last_outage_s": down_now if not self.up else self.last_outage,
+                "max_outage_s": max(self.max_outage, down_now),
+                "dropped_writes": self.dropped, "last_error": self.last_error,
+            }
+
+
+def open_managed(ports=(), baud=port_discovery.SERIAL_BAUD, device_id=None, on_reconnect=None):
+    """Discover the board and wrap it -> ManagedSerial, or None when no board answers."""
+    r = port_discovery.discover(ports, baud, device_id)
+    if r is None:
+        return None
+    ser, port, dev = r
+    print(f"Serial opened: {port}" + (f" (board {dev})" if dev else ""))
+    return ManagedSerial(ser, port, dev, ports, baud, on_reconnect)
@@ -1,7 +1,8 @@
 import pygame
 import numpy as np
 import time
-import serial
+import device_client
+import serial_manager
 
 # ================== Config ==================
 SCREEN_W, SCREEN_H = 800, 800
@@ -64,13 +65,13 @@ def draw_grid(surface, grid, alpha_scale=255.0):
     pygame.draw.rect(surface, GRID_COLOR, (x0, y0, grid_w, grid_h), 2)
 
 def try_open_serial():
-    for port in SERIAL_PORTS:
-        try:
-            ser = serial.Serial(port, SERIAL_BAUD, timeout=0)
-            time.sleep(1.0); print(f"Serial opened: {port}")
-            return ser
-        except Exception:
-            continue
+    ser = device_client.connect()
+    if ser is not None:
+        print("Device daemon connected")
+        return ser
+    ser = serial_manager.open_managed(SERIAL_PORTS, SERIAL_BAUD)
+    if ser is not None:
+        return ser
     print("Serial not found; running without serial output.")
     return None
 
@@ -0,0 +1,244 @@
+# SAM LAB, D H HAN
+# Parallel parameter sweep / search over pattern spec knobs, scored in simulation
+#
+# Every candidate = base spec + overrides -> validate -> compile -> microrobot_sim.
+# Candidates run on a process pool (all cores by default) with the SAME particle
+# start positions (seed), so configurations are compared on equal footing.
+# Results go to a columnar file (one column per parameter / metric):
+#   .npz always, .parquet when pyarrow is installed. The best rows are printed.
+#
+# Parameter syntax:  <layer>.<key>=<values>
+#   <layer> : layer name, layer type or index ("herd", "trap (right half)", "0");
+#             "spec" for top-level keys (send_hz, pwm_max)
+#   <values>: "2,4,6" (list) or "2:8:4" (lo:hi:count, linspace)
+# Script knobs -> spec keys:
+#   period / dutycycle -> vibrate.period / .dutycycle,  trap_intensity -> trap.intensity,
+#   HERD_PULSE_DT -> herd.pulse_dt,  HERD_OVERLAP_HOLD -> herd.overlap_hold,
+#   REPEL_AMP -> herd.repel_intensity
+#
+# Usage:
+#   python sweep.py patterns/herd_pull.json -p herd.pulse_dt=2:8:7 -p herd.overlap_hold=0,1,2,3
+#   python sweep.py patterns/herd_repulse.json --mode cem --samples 32 --iters 5 \
+#       -p herd.pulse_dt=1:8 -p herd.repel_intensity=0:1 -o repulse.parquet
+
+import argparse
+import copy
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pattern_spec import read_spec_file, validate_spec, CompiledPattern, cells_to_mask
+from microrobot_sim import Simulator, goal_mask_of, default_duration, score, SIM_DT, MOMENT
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # parquet output is optional, .npz always works
+    pyarrow = None
+
+# ================== Config ==================
+PARTICLES = 100
+SEED = 0
+TOP_K = 10
+ELITE_FRAC = 0.25          # CEM: fraction of samples that refit the distribution
+# ================== Config ==================
+
+OBJECTIVES = ("capture", "dist", "t_half")
+
+
+# ---------------------------------------------
+# Parameters
+# ---------------------------------------------
+def parse_param(text):
+    """'herd.pulse_dt=2:8:4' -> (name, values array, (lo, hi))."""
+    name, _, vals = text.partition("=")
+    if "." not in name or not vals:
+        raise ValueError(f"bad parameter {text!r} (expected layer.key=values)")
+    if ":" in vals:
+        parts = [float(v) for v in vals.split(":")]
+        lo, hi = parts[0], parts[1]
+        count = int(parts[2]) if len(parts) > 2 else 5
+        values = np.linspace(lo, hi, count)
+    else:
+        values = np.array([float(v) for v in vals.split(",")])
+        lo, hi = float(values.min()), float(values.max())
+    return name.strip(), values, (lo, hi)
+
+
+def apply_overrides(raw, overrides):
+    """Copy of a raw spec dict with {layer.key: value} applied. Raises ValueError if nothing matches."""
+    spec = copy.deepcopy(raw)
+    for name, value in overrides.items():
+        sel, key = name.rsplit(".", 1)
+        if sel == "spec":
+            spec[key] = value
+            continue
+        hit = False
+        for idx, L in enumerate(spec["layers"]):
+            if sel in (str(idx), L.get("type"), L.get("name")):
+                L[key] = value
+                hit = True
+        if not hit:
+            raise ValueError(f"{name}: no layer matches {sel!r}")
+    return spec
+
+
+# ---------------------------------------------
+# Evaluation (runs in the worker processes)
+# ---------------------------------------------
+def evaluate(job):
+    raw, overrides, opts = job
+    t0 = time.perf_counter()
+    try:
+        cp = CompiledPattern(validate_spec(apply_overrides(raw, overrides), opts["base_dir"]))
+    except ValueError as e:
+        return {"capture": np.nan, "dist": np.nan, "t_half": np.nan, "wall": 0.0, "error": str(e)}
+    n, m = cp.shape
+    goal = cells_to_mask(opts["goal"], n, m) if opts["goal"] else goal_mask_of(cp.spec, n, m)
+    sim = Simulator(n, m, pwm_max=cp.pwm_max, moment=opts["moment"], seed=opts["seed"])
+    pos0 = sim.random_particles(opts["particles"])
+    duration = opts["duration"] or default_duration(cp)
+    times, traj = sim.run(cp.evaluate, pos0, duration, frame_dt=1.0 / cp.send_hz, dt=opts["dt"])
+    s = score(sim, traj, goal)
+    th = int(s["t_half"])
+    return {"capture": float(s["capture"]), "dist": float(s["dist"]),
+            "t_half": float(times[th]) if th >= 0 else np.inf,
+            "wall": time.perf_counter() - t0, "error": ""}
+
+
+def objective(r, kind):
+    """Higher is better. Ties on capture are broken by distance."""
+    if r["error"]:
+        return -np.inf
+    if kind == "capture":
+        return r["capture"] - 1e-3 * r["dist"]
+    if kind == "dist":
+        return -r["dist"]
+    return -r["t_half"] + 1e-3 * r["capture"]
+
+
+# ---------------------------------------------
+# Search strategies
+# ---------------------------------------------
+def grid_candidates(params):
+    names = [p[0] for p in params]
+    return [dict(zip(names, combo)) for combo in itertools.product(*[p[1] for p in params])]
+
+
+def random_candidates(params, count, rng):
+    return [{name: float(rng.uniform(lo, hi)) for name, _, (lo, hi) in params} for _ in range(count)]
+
+
+def run_jobs(pool, raw, cands, opts):
+    return list(pool.map(evaluate, [(raw, c, opts) for c in cands], chunksize=1))
+
+
+def search_cem(pool, raw, params, opts, samples, iters, kind, rng):
+    """Cross-entropy search: sample, keep the elite, refit mean/std, repeat."""
+    lo = np.array([p[2][0] for p in params])
+    hi = np.array([p[2][1] for p in params])
+    mu, sd = (lo + hi) / 2.0, (hi - lo) / 4.0
+    names = [p[0] for p in params]
+    n_elite = max(2, int(ELITE_FRAC * samples))
+    all_c, all_r = [], []
+    for it in range(iters):
+        x = np.clip(rng.normal(mu, np.maximum(sd, 1e-9), (samples, len(params))), lo, hi)
+        cands = [dict(zip(names, map(float, row))) for row in x]
+        res = run_jobs(pool, raw, cands, opts)
+        all_c += cands
+        all_r += res
+        obj = np.array([objective(r, kind) for r in res])
+        elite = x[np.argsort(-obj)[:n_elite]]
+        mu, sd = elite.mean(0), elite.std(0)
+        print(f"iter {it + 1}/{iters}: best {obj.max():.4f}  mean {dict(zip(names, np.round(mu, 3).tolist()))}")
+    return all_c, all_r
+
+
+# ---------------------------------------------
+# Output
+# ---------------------------------------------
+def to_columns(cands, results, kind):
+    cols = {}
+    for name in cands[0]:
+        cols[name] = np.array([c[name] for c in cands], dtype=float)
+    for key in ("capture", "dist", "t_half", "wall"):
+        cols[key] = np.array([r[key] for r in results], dtype=float)
+    cols["objective"] = np.array([objective(r, kind) for r in results])
+    cols["error"] = np.array([r["error"] for r in results])
+    return cols
+
+
+def write_columns(path, cols):
+    if path.endswith(".parquet"):
+        if pyarrow is None:
+            raise SystemExit("pyarrow is not installed (pip install pyarrow) - use an .npz output")
+        pyarrow.parquet.write_table(pyarrow.table(cols), path)
+    else:
+        np.savez_compressed(path, **cols)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Sweep / search pattern parameters in simulation")
+    ap.add_argument("spec", help="base pattern spec (.json / .yaml)")
+    ap.add_argument("-p", "--param", action="append", required=True, help="layer.key=values (repeatable)")
+    ap.add_argument("--mode", choices=["grid", "random", "cem"], default="grid")
+    ap.add_argument("--samples", type=int, default=64, help="random: total, cem: per iteration")
+    ap.add_argument("--iters", type=int, default=4, help="cem iterations")
+    ap.add_argument("--objective", choices=OBJECTIVES, default="capture")
+    ap.add_argument("--particles", type=int, default=PARTICLES)
+    ap.add_argument("--duration", type=float, default=None, help="seconds (default: per candidate)")
+    ap.add_argument("--dt", type=float, default=SIM_DT)
+    ap.add_argument("--goal", nargs="*", default=None, metavar="ROW,COL")
+    ap.add_argument("--moment", type=float, default=MOMENT)
+    ap.add_argument("--seed", type=int, default=SEED)
+    ap.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    ap.add_argument("-o", "--out", default="sweep_results.npz", help=".npz or .parquet")
+    ap.add_argument("--top", type=int, default=TOP_K)
+    args = ap.parse_args()
+
+    raw = read_spec_file(args.spec)
+    params = [parse_param(p) for p in args.param]
+    base_dir = os.path.dirname(os.path.abspath(args.spec))
+    validate_spec(apply_overrides(raw, {p[0]: float(p[1][0]) for p in params}), base_dir)  # fail fast on bad names
+    opts = {
+        "particles": args.particles, "duration": args.duration, "dt": args.dt, "moment": args.moment,
+        "seed": args.seed, "base_dir": base_dir,
+        "goal": [tuple(int(v) for v in g.split(",")) for g in args.goal] if args.goal else None,
+    }
+    rng = np.random.default_rng(args.seed)
+    workers = args.workers or os.cpu_count()
+
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if args.mode == "grid":
+            cands = grid_candidates(params)
+            results = run_jobs(pool, raw, cands, opts)
+        elif args.mode == "random":
+            cands = random_candidates(params, args.samples, rng)
+            results = run_jobs(pool, raw, cands, opts)
+        else:
+            cands, results = search_cem(pool, raw, params, opts, args.samples, args.iters, args.objective, rng)
+    wall = time.perf_counter() - t0
+
+    cols = to_columns(cands, results, args.objective)
+    write_columns(args.out, cols)
+    sim_s = cols["wall"].sum()
+    print(f"{len(cands)} candidates on {workers} processes in {wall:.1f} s "
+          f"({sim_s / max(wall, 1e-9):.1f}x speedup over serial) -> {args.out}")
+
+    names = [p[0] for p in params]
+    order = np.argsort(-cols["objective"])[:args.top]
+    print("rank  " + "  ".join(f"{n:>18s}" for n in names) + "   capture    dist  t_half")
+    for rank, k in enumerate(order, 1):
+        vals = "  ".join(f"{cols[n][k]:18.3f}" for n in names)
+        print(f"{rank:4d}  {vals}   {100 * cols['capture'][k]:6.1f}%  {cols['dist'][k]:6.2f}  {cols['t_half'][k]:6.1f}")
+    bad = int((cols["error"] != "").sum())
+    if bad:
+        print(f"{bad} candidates failed validation, e.g.: {cols['error'][cols['error'] != ''][0]}")
+
+
+if __name__ == "__main__":
+    main()
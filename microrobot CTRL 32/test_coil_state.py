@@ -0,0 +1,51 @@
+# SAM LAB, D H HAN
+# CoilState.next_transition must always move forward (coil_state.py)
+#
+# Usage:
+#   python -m pytest -q test_coil_state.py
+
+import math
+
+from coil_state import CoilState
+
+HOLD, TOTAL = 5.0, 10.0
+
+
+def run_event_loop(peak, epoch):
+    """Wake only at next_transition, like gui_manual_control; return the wake times and levels."""
+    st = CoilState(4, 8, envelope=True, epoch=epoch)
+    st.press(0, 0, peak, t=epoch)
+    now, wakes = epoch, []
+    for _ in range(100):
+        st.update_envelope(hold=HOLD, total=TOTAL, now=now)
+        wakes.append((now - epoch, int(st.levels[0, 0])))
+        nxt = st.next_transition(hold=HOLD, total=TOTAL, now=now)
+        if nxt == math.inf:
+            break
+        assert nxt > now                                # never the same time again
+        now = nxt
+    return wakes
+
+
+def test_ramp_across_half_boundaries_advances():
+    # peak 10: |v| = 2.5 at e = 8.75 (rint -> 2), 1.5 at e = 9.25 (rint -> 2, drops just after)
+    for epoch in (0.0, 1.7e9):
+        wakes = run_event_loop(-10, epoch)
+        levels = [lv for _, lv in wakes]
+        assert levels == list(range(-10, 1))            # one wake per step, none wasted
+        t = dict((lv, e) for e, lv in wakes)
+        assert abs(t[-2] - 8.75) < 1e-3 and 9.25 < t[-1] < 9.25 + 1e-3
+
+
+def test_each_wake_changes_the_level():
+    wakes = run_event_loop(10, 1.7e9)
+    levels = [lv for _, lv in wakes]
+    assert levels == sorted(set(levels), reverse=True)  # no wake leaves the level unchanged
+
+
+def test_idle_is_inf():
+    st = CoilState(4, 8, envelope=True, epoch=0.0)
+    assert st.next_transition(hold=HOLD, total=TOTAL, now=1.0) == math.inf
+    st.press(1, 2, 3, t=0.0)
+    st.update_envelope(hold=HOLD, total=TOTAL, now=TOTAL)
+    assert not st.levels.any() and st.next_transition(hold=HOLD, total=TOTAL, now=TOTAL) == math.inf
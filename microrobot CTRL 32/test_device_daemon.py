@@ -0,0 +1,126 @@
+# SAM LAB, D H HAN
+# Client handling in device_daemon.py: malformed messages, arbitration, STOP / RESUME
+#
+# Usage:
+#   python -m pytest -q test_device_daemon.py
+
+import asyncio
+import os
+import tempfile
+
+import time
+
+import numpy as np
+import pytest
+
+from device_daemon import DeviceDaemon
+from frame_codec import (encode_message, encode_hello, decode_hello, HELLO, PING, PONG, STOP, RESUME,
+                         HEADER)
+
+
+def daemon_with_clients(*hellos):
+    """Daemon without a port or event loop and one client per (name, priority, lease, overlay)."""
+    daemon = DeviceDaemon(None, socket_path="/nonexistent")
+    daemon.preempt = asyncio.Event()
+    clients = []
+    for hello in hellos:
+        c = daemon.register()
+        daemon.dispatch(c, HELLO, encode_hello(*hello)[HEADER.size:])
+        clients.append(c)
+    return daemon, clients
+
+
+def frame(level):
+    return np.full(32, level, dtype=np.int8)
+
+
+def with_daemon(scenario):
+    """Run scenario(daemon, path) against a daemon serving a temporary Unix socket (no serial port)."""
+    path = os.path.join(tempfile.mkdtemp(), "pwm32.sock")
+    daemon = DeviceDaemon(None, socket_path=path)
+
+    async def run():
+        daemon.loop = asyncio.get_running_loop()
+        daemon.preempt = asyncio.Event()
+        server = await asyncio.start_unix_server(daemon.handle_client, path=path)
+        try:
+            return await scenario(daemon, path)
+        finally:
+            server.close()
+
+    return asyncio.run(run())
+
+
+def test_decode_hello_rejects_short_payload():
+    with pytest.raises(ValueError):
+        decode_hello(b"\x01\x00")
+
+
+def test_short_hello_closes_only_that_client():
+    errors = []
+
+    async def scenario(daemon, path):
+        daemon.loop.set_exception_handler(lambda loop, ctx: errors.append(ctx))
+        r_bad, w_bad = await asyncio.open_unix_connection(path)
+        r_ok, w_ok = await asyncio.open_unix_connection(path)
+        w_bad.write(encode_message(HELLO, b"\x01\x00"))
+        assert await asyncio.wait_for(r_bad.read(), 1.0) == b""              # closed, no crash
+        w_ok.write(encode_message(PING, b"x"))
+        head = await asyncio.wait_for(r_ok.readexactly(HEADER.size), 1.0)
+        assert HEADER.unpack(head)[1] == PONG
+        await asyncio.sleep(0.01)
+        n = len(daemon.clients)
+        w_ok.close()
+        while daemon.clients:                           # let the handler finish before teardown
+            await asyncio.sleep(0.005)
+        return n
+
+    assert with_daemon(scenario) == 1
+    assert not errors                                   # nothing left to "Unhandled exception in client_connected_cb"
+
+
+def test_merge_highest_priority_wins_and_lease_expires():
+    daemon, (gui, script, overlay) = daemon_with_clients(("gui", 0, 0.0), ("script", 10, 0.2),
+                                                         ("mark", 20, 0.0, True))
+    daemon.submit(gui, frame(3))
+    daemon.submit(script, frame(7))
+    daemon.submit(overlay, np.eye(1, 32, 5, dtype=np.int8)[0] * -9)
+    now = time.monotonic()
+    out, used = daemon.merge(now)
+    assert out[0] == 7 and out[5] == -9 and [c.name for c in used] == ["gui", "script", "mark"]
+    out, used = daemon.merge(now + 1.0)                 # script lease (0.2 s) ran out
+    assert out[0] == 3 and out[5] == -9 and script not in used
+
+
+def test_stop_preempts_every_client():
+    daemon, (gui, estop) = daemon_with_clients(("gui", 50, 0.0), ("estop", 100, 0.0))
+    daemon.submit(gui, frame(10))
+    daemon.dispatch(gui, STOP, b"")
+    assert daemon.preempt.is_set()                      # tick loop wakes now, not next period
+    out, used = daemon.merge(time.monotonic())
+    assert not out.any() and used == []
+
+
+def test_resume_from_lower_priority_is_refused():
+    daemon, (estop, gui) = daemon_with_clients(("estop", 100, 0.0), ("gui", 10, 0.0))
+    anon = daemon.register()                            # never sent HELLO: priority 0
+    daemon.submit(gui, frame(10))
+    daemon.dispatch(estop, STOP, b"")
+    daemon.dispatch(anon, RESUME, b"")
+    daemon.dispatch(gui, RESUME, b"")
+    st = daemon.stats()
+    assert daemon.stopped and st["stop_priority"] == 100 and st["resume_refused"] == 2
+    assert not daemon.merge(time.monotonic())[0].any()
+    daemon.dispatch(estop, RESUME, b"")
+    assert not daemon.stopped and daemon.stats()["stop_priority"] is None
+    assert daemon.merge(time.monotonic())[0][0] == 10
+
+
+def test_resume_needs_the_highest_stopper():
+    daemon, (gui, estop) = daemon_with_clients(("gui", 10, 0.0), ("estop", 100, 0.0))
+    daemon.dispatch(gui, STOP, b"")
+    daemon.dispatch(estop, STOP, b"")                   # a later, higher STOP raises the bar
+    daemon.dispatch(gui, RESUME, b"")
+    assert daemon.stopped and daemon.resume_refused == 1
+    daemon.dispatch(estop, RESUME, b"")
+    assert not daemon.stopped
@@ -0,0 +1,80 @@
+# SAM LAB, D H HAN
+# STOP must never wait for an ack window slot (frame_link.py / device_daemon.py)
+#
+# Usage:
+#   python -m pytest -q test_frame_link.py
+
+import asyncio
+
+import numpy as np
+
+from device_daemon import DeviceDaemon
+from frame_link import FrameLink
+
+
+class SilentSerial:
+    """Serial stand-in that takes every write and never answers (all acks lost)."""
+
+    def __init__(self):
+        self.lines = []
+        self.in_waiting = 0
+        self.out_waiting = 0
+
+    def write(self, data):
+        self.lines.append(bytes(data))
+        return len(data)
+
+    def read(self, size=1):
+        return b""
+
+
+def is_zero_frame(line):
+    return all(v == b"0" for v in line.strip().split(b",")[1:])
+
+
+def test_force_send_bypasses_full_window():
+    ser = SilentSerial()
+    link = FrameLink(ser, window=2, ack=True)
+    frame = np.full(32, 5, dtype=np.int8)
+    assert link.send(frame) is not None
+    assert link.send(frame) is not None
+    assert link.send(frame) is None                     # window full, no acks coming
+    assert link.send(np.zeros(32, dtype=np.int8), force=True) is not None
+    assert len(ser.lines) == 3 and is_zero_frame(ser.lines[-1])
+    assert len(link.inflight) == 1 and link.flushed == 2
+
+
+def run_stop_after_full_window(adaptive):
+    """Fill the window with acks lost, STOP, return (writes after STOP, seconds to the first one)."""
+    ser = SilentSerial()
+    daemon = DeviceDaemon(ser, socket_path="/nonexistent", send_hz=10, ack_window=4, adaptive=adaptive)
+
+    async def scenario():
+        daemon.loop = asyncio.get_running_loop()
+        daemon.preempt = asyncio.Event()
+        c = daemon.register()
+        daemon.submit(c, np.full(32, 7, dtype=np.int8))
+        tick = asyncio.ensure_future(daemon.tick_loop())
+        await asyncio.sleep(0.45)                       # > window frames at 10 Hz, nothing acked
+        n = len(ser.lines)
+        t_stop = daemon.loop.time()
+        daemon.emergency_stop(c)
+        while len(ser.lines) == n and daemon.loop.time() - t_stop < 1.0:
+            await asyncio.sleep(0.005)
+        dt = daemon.loop.time() - t_stop
+        tick.cancel()
+        return ser.lines[n:], dt
+
+    return asyncio.run(scenario())
+
+
+def test_stop_written_on_next_tick_without_acks():
+    lines, dt = run_stop_after_full_window(adaptive=False)
+    assert lines and is_zero_frame(lines[0])
+    assert dt < 0.05                                    # the preempted tick, not ACK_TIMEOUT
+
+
+def test_stop_not_skipped_by_adaptive_rate():
+    lines, dt = run_stop_after_full_window(adaptive=True)
+    assert lines and is_zero_frame(lines[0])
+    assert dt < 0.05
@@ -0,0 +1,53 @@
+# SAM LAB, D H HAN
+# WebSocket upgrade of the browser bridge: only local pages may connect (ws_bridge.py)
+#
+# Usage:
+#   python -m pytest -q test_ws_bridge.py
+
+import asyncio
+
+from device_daemon import DeviceDaemon
+from ws_bridge import origin_allowed
+
+UPGRADE = (b"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+           b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\nSec-WebSocket-Version: 13\r\n")
+
+
+def upgrade(origin):
+    """Send an upgrade request with `origin` (None = no header) to handle_ws; (status line, clients registered)."""
+    daemon = DeviceDaemon(None, socket_path="/nonexistent")
+
+    async def run():
+        server = await asyncio.start_server(daemon.handle_ws, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        head = UPGRADE + (b"Origin: " + origin.encode() + b"\r\n" if origin is not None else b"")
+        writer.write(head + b"\r\n")
+        status = (await asyncio.wait_for(reader.readline(), 1.0)).strip()
+        writer.close()
+        while daemon.clients:
+            await asyncio.sleep(0.005)
+        server.close()
+        await server.wait_closed()
+        return status, daemon.next_id - 1                # ids handed out = clients registered
+
+    return asyncio.run(run())
+
+
+def test_foreign_origin_gets_403():
+    status, registered = upgrade("https://evil.example")
+    assert status == b"HTTP/1.1 403 Forbidden" and registered == 0
+
+
+def test_local_origins_upgrade():
+    for origin in (None, "null", "http://localhost:8000", "http://127.0.0.1"):
+        status, registered = upgrade(origin)
+        assert status == b"HTTP/1.1 101 Switching Protocols" and registered == 1, origin
+
+
+def test_origin_allowed():
+    for origin in (None, "null", "file://", "http://localhost", "https://127.0.0.1:8443", "http://[::1]:5500"):
+        assert origin_allowed(origin), origin
+    for origin in ("https://evil.example", "http://localhost.evil.example", "http://127.0.0.1@evil.example",
+                   "ws://localhost", "http://localhost:99999", ""):
+        assert not origin_allowed(origin), origin
@@ -0,0 +1,159 @@
+# SAM LAB, D H HAN
+# Waveform library: precomputed wavetables + per-cell phase accumulators
+#
+# Every shape is sampled ONCE into a table of TABLE_SIZE points over one period
+# (values in [-1, 1]). An OscillatorBank holds one 32-bit fixed-point phase per cell
+# (any number of cells, any mix of shapes, frequencies and phase offsets); a frame is
+#   phase += freq * dt * 2^32   (uint32, wraps for free)
+#   value  = offset + amp * tables[shape_id, phase >> shift]
+# i.e. one integer add and ONE gather for all cells -- no per-cell trig calls, and a
+# frequency change never makes the phase jump.
+#
+# Shapes:
+#   sine, triangle, sawtooth (rising), square (duty), chirp (sine sweeping `cycles`
+#   = (c0, c1) cycles per table length, so a table period is one sweep), and
+#   arbitrary user tables (any length, linearly resampled, optionally normalized).
+#
+# Usage:
+#   bank = OscillatorBank(32, "sine", freq=2.0, phase=np.linspace(0, 1, 32, endpoint=False))
+#   values = bank.advance(dt)                   # accumulator (live frequency changes)
+#   values = bank.at(t)                         # stateless: phase0 + freq * t
+#   levels = values.reshape(4, 8) * PWM_MAX
+
+import numpy as np
+
+# ================== Config ==================
+TABLE_BITS = 12
+TABLE_SIZE = 1 << TABLE_BITS
+SHAPES = ("sine", "triangle", "sawtooth", "square", "chirp")
+# ================== Config ==================
+
+_PHASE_ONE = float(1 << 32)
+
+
+def wavetable(shape, size=TABLE_SIZE, duty=0.5, cycles=(1.0, 8.0)):
+    """One period of `shape` sampled at `size` points, float32 in [-1, 1]."""
+    x = np.arange(size) / size
+    if shape == "sine":
+        y = np.sin(2 * np.pi * x)
+    elif shape == "triangle":
+        y = 1.0 - 4.0 * np.abs(((x + 0.25) % 1.0) - 0.5)     # starts at 0, rising, like sine
+    elif shape == "sawtooth":
+        y = 2.0 * ((x + 0.5) % 1.0) - 1.0                    # starts at 0, rising
+    elif shape == "square":
+        y = np.where(x < float(duty), 1.0, -1.0)
+    elif shape == "chirp":
+        c0, c1 = float(cycles[0]), float(cycles[1])
+        y = np.sin(2 * np.pi * (c0 * x + 0.5 * (c1 - c0) * x * x))
+    else:
+        raise ValueError(f"shape must be one of {SHAPES} or a user table, got {shape!r}")
+    return y.astype(np.float32)
+
+
+def user_table(values, size=TABLE_SIZE, normalize=True):
+    """Arbitrary samples of one period -> wavetable (linear, periodic resampling)."""
+    v = np.asarray(values, dtype=float).ravel()
+    if v.size == 0:
+        raise ValueError("user table must not be empty")
+    xp = np.arange(v.size + 1) / v.size
+    y = np.interp(np.arange(size) / size, xp, np.append(v, v[0]))
+    if normalize:
+        peak = np.abs(y).max()
+        if peak > 0:
+            y = y / peak
+    return np.clip(y, -1.0, 1.0).astype(np.float32)
+
+
+def _table(shape, duty, cycles):
+    if isinstance(shape, str):
+        return wavetable(shape, duty=duty, cycles=cycles)
+    return user_table(shape)
+
+
+class OscillatorBank:
+    """
+    `count` independent oscillators. shape: a shape name, a user table (sequence of
+    samples), or a list of those plus per-cell `shape_id` selecting one per cell.
+    freq [Hz], phase [cycles, 0..1], amp and offset broadcast to (count,).
+    """
+
+    def __init__(self, count, shape="sine", freq=1.0, phase=0.0, amp=1.0, offset=0.0,
+                 shape_id=0, duty=0.5, cycles=(1.0, 8.0)):
+        self.count = int(count)
+        shapes = shape if isinstance(shape, list) else [shape]
+        self.tables = np.stack([_table(s, duty, cycles) for s in shapes])     # (K, TABLE_SIZE)
+        self._flat = self.tables.ravel()
+        self.shape_id = np.broadcast_to(np.asarray(shape_id, dtype=np.int64), (self.count,)).copy()
+        if self.shape_id.min() < 0 or self.shape_id.max() >= len(shapes):
+            raise ValueError(f"shape_id must be in 0..{len(shapes) - 1}")
+        self._base = (self.shape_id * TABLE_SIZE).astype(np.intp)
+        self.amp = np.broadcast_to(np.asarray(amp, dtype=np.float32), (self.count,)).copy()
+        self.offset = np.broadcast_to(np.asarray(offset, dtype=np.float32), (self.count,)).copy()
+        self.phase0 = self._fixed(np.broadcast_to(np.asarray(phase, dtype=float), (self.count,)))
+        self.set_freq(freq)
+        self.phase = self.phase0.copy()
+        self._idx = np.zeros(self.count, dtype=np.intp)
+        self._out = np.zeros(self.count, dtype=np.float32)
+
+    @staticmethod
+    def _fixed(cycles):
+        """Phase in cycles (any real) -> uint32 fixed point."""
+        return (np.round(np.mod(cycles, 1.0) * _PHASE_ONE).astype(np.uint64) & 0xFFFFFFFF).astype(np.uint32)
+
+    def set_freq(self, freq):
+        """New frequencies [Hz]; the running phases continue from where they are."""
+        self.freq = np.broadcast_to(np.asarray(freq, dtype=float), (self.count,)).copy()
+        self._inc_dt = None                 # cached fixed-point increment for a repeated dt
+
+    def reset(self):
+        self.phase[:] = self.phase0
+
+    def sample(self, out=None):
+        """Current values of all oscillators (one gather)."""
+        out = self._out if out is None else out
+        idx = self._idx
+        np.right_shift(self.phase, 32 - TABLE_BITS, out=idx, casting="unsafe")
+        idx += self._base
+        np.take(self._flat, idx, out=out)
+        out *= self.amp
+        out += self.offset
+        return out
+
+    def advance(self, dt, out=None):
+        """Step every phase accumulator by dt seconds, then sample."""
+        dt = float(dt)
+        if self._inc_dt != dt:
+            self._inc = self._fixed(self.freq * dt)
+            self._inc_dt = dt
+        self.phase += self._inc
+        return self.sample(out)
+
+    def at(self, t, out=None):
+        """Stateless: values at time t for phase = phase0 + freq * t (same as advancing from reset)."""
+        self.phase[:] = self.phase0 + self._fixed(self.freq * float(t))
+        return self.sample(out)
+
+
+def grid_phase(n, m, mode="none", spread=1.0):
+    """
+    Per-cell phase offsets [cycles] for an (n, m) array, row-major like the levels:
+    none, rows (by row), cols (by column), checker (0 / 0.5), diag (row + col), radial (from centre).
+    `spread` = total phase across the array in cycles.
+    """
+    i, j = np.mgrid[0:n, 0:m].astype(float)
+    if mode == "none":
+        p = np.zeros((n, m))
+    elif mode == "rows":
+        p = i / max(n, 1)
+    elif mode == "cols":
+        p = j / max(m, 1)
+    elif mode == "checker":
+        return (0.5 * ((i + j) % 2)).ravel()
+    elif mode == "diag":
+        p = (i + j) / max(n + m - 1, 1)
+    elif mode == "radial":
+        r = np.hypot(i - (n - 1) / 2, j - (m - 1) / 2)
+        p = r / max(r.max(), 1e-9)
+    else:
+        raise ValueError(f"phase mode must be none/rows/cols/checker/diag/radial, got {mode!r}")
+    return (spread * p).ravel()
@@ -0,0 +1,166 @@
+# SAM LAB, D H HAN
+# Minimal WebSocket endpoint (RFC 6455, stdlib only) for the HTML GUIs
+#
+# device_daemon.py --ws-port 8765 serves this next to the Unix socket, so
+# guiControl32.html / magnet_control_gui.html ("Connect Bridge") feed the same
+# rate-controlled, coalescing tick loop as the Python scripts instead of
+# owning the serial port through Web Serial.
+#
+# Browser -> daemon messages:
+#   text  "p0,n0,p1,n1,..."                      legacy CSV line (pos/neg pairs) -> FRAME
+#   text  {"hello": {"name", "priority", "lease", "overlay"}}
+#   text  {"cmd": "stop" | "resume" | "stats" | "ping"}
+#   binary                                        frame_codec messages (same as the Unix socket)
+# Daemon -> browser: "pong", the STATS JSON, or {"error": "..."} for a message it could
+# not use (the connection stays open). hello priority is clamped to int16, lease to
+# 0..65.535 s, name to MAX_NAME bytes.
+#
+# Binding to 127.0.0.1 does not keep other web pages out: any site the operator has open
+# can connect to ws://127.0.0.1:<port>. handshake() therefore answers 403 unless the
+# Origin header is absent (non-browser clients), "null" / file:// (the GUIs opened
+# from disk) or http(s)://localhost / 127.0.0.1 / [::1] on any port.
+
+import base64
+import hashlib
+import json
+import math
+import struct
+from urllib.parse import urlsplit
+
+from frame_codec import (encode_hello, csv_line_to_levels, FRAME, STOP, RESUME, STATS, PING,
+                         HELLO, encode_frame, HEADER)
+
+GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_NAME = 64              # hello name, utf-8 bytes
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+OP_CONT = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+MAX_MESSAGE = 1 << 20
+
+
+def origin_allowed(origin):
+    """True for no Origin, a local file page or an http(s) page served from this machine."""
+    if origin is None or origin == "null" or origin.startswith("file://"):
+        return True
+    try:
+        u = urlsplit(origin)
+        return u.scheme in ("http", "https") and u.hostname in LOCAL_HOSTS and (u.port is None or u.port > 0)
+    except ValueError:
+        return False
+
+
+async def handshake(reader, writer):
+    """
+    Read the HTTP upgrade request and answer 101. Returns False (after a 400 / 403) if it
+    is not a WebSocket request or comes from a foreign page (origin_allowed).
+    """
+    request = await reader.readuntil(b"\r\n\r\n")
+    headers = {}
+    for line in request.decode("latin-1").split("\r\n")[1:]:
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+    key = headers.get("sec-websocket-key")
+    if key is None or "websocket" not in headers.get("upgrade", "").lower():
+        writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+        await writer.drain()
+        return False
+    if not origin_allowed(headers.get("origin")):
+        writer.write(b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n")
+        await writer.drain()
+        return False
+    accept = base64.b64encode(hashlib.sha1(key.encode("ascii") + GUID).digest())
+    writer.write(b"HTTP/1.1 101 Switching Protocols\r\n"
+                 b"Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                 b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+    await writer.drain()
+    return True
+
+
+def encode_ws(data, opcode=OP_TEXT):
+    """Server -> client frame (never masked)."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    n = len(data)
+    if n < 126:
+        head = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < (1 << 16):
+        head = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        head = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return head + data
+
+
+async def read_message(reader, writer):
+    """
+    Next complete data message as (opcode, bytes), answering pings on the way.
+    Returns None when the peer closes.
+    """
+    parts, msg_op = [], None
+    while True:
+        b0, b1 = await reader.readexactly(2)
+        fin, opcode = b0 & 0x80, b0 & 0x0F
+        n = b1 & 0x7F
+        if n == 126:
+            n = struct.unpack("!H", await reader.readexactly(2))[0]
+        elif n == 127:
+            n = struct.unpack("!Q", await reader.readexactly(8))[0]
+        if n > MAX_MESSAGE:
+            raise ConnectionError("WebSocket message too large")
+        mask = await reader.readexactly(4) if b1 & 0x80 else None
+        data = await reader.readexactly(n)
+        if mask:
+            data = bytes(b ^ mask[i & 3] for i, b in enumerate(data))
+
+        if opcode == OP_CLOSE:
+            writer.write(encode_ws(data[:2], OP_CLOSE))
+            return None
+        if opcode == OP_PING:
+            writer.write(encode_ws(data, OP_PONG))
+            continue
+        if opcode == OP_PONG:
+            continue
+        if opcode != OP_CONT:
+            msg_op = opcode
+        parts.append(data)
+        if fin:
+            return msg_op, b"".join(parts)
+
+
+def _hello_number(h, key, default, lo, hi):
+    v = h.get(key, default)
+    if isinstance(v, bool) or not isinstance(v, (int, float)) or not math.isfinite(v):
+        raise ValueError(f"hello.{key} must be a finite number, got {v!r}")
+    return min(max(v, lo), hi)
+
+
+def text_to_messages(text):
+    """Browser text message -> list of frame_codec (kind, payload) tuples."""
+    text = text.strip()
+    if not text:
+        return []
+    if text.startswith("{"):
+        obj = json.loads(text)
+        if not isinstance(obj, dict):
+            raise ValueError("JSON message must be an object")
+        out = []
+        if "hello" in obj:
+            h = obj["hello"]
+            if not isinstance(h, dict):
+                raise ValueError("hello must be an object")
+            name = str(h.get("name", "browser")).encode("utf-8")[:MAX_NAME].decode("utf-8", errors="ignore")
+            hello = encode_hello(name, int(_hello_number(h, "priority", 0, -0x8000, 0x7FFF)),
+                                 float(_hello_number(h, "lease", 0.0, 0.0, 65.535)), bool(h.get("overlay", False)))
+            out.append((HELLO, hello[HEADER.size:]))
+        cmd = obj.get("cmd")
+        if cmd in ("stop", "resume", "stats", "ping"):
+            out.append(({"stop": STOP, "resume": RESUME, "stats": STATS, "ping": PING}[cmd], b""))
+        return out
+    frame = encode_frame(csv_line_to_levels(text))
+    return [(FRAME, frame[HEADER.size:])]